@@ -0,0 +1,88 @@
+"""
+Micro-benchmark of trackers.bytetrack.matching.bbox_ious against the original double loop.
+
+    python bench/bench_bbox_ious.py --sizes 10 50 100 200 --torch-device cpu
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+FILE = Path(__file__).resolve()
+ROOT = FILE.parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))  # add ROOT to PATH
+
+from trackers.bytetrack.matching import bbox_ious, bbox_ious_torch
+
+
+def bbox_ious_loop(boxes, query_boxes):
+    # reference: the pure-python implementation bbox_ious replaced
+    N = boxes.shape[0]
+    K = query_boxes.shape[0]
+    overlaps = np.zeros((N, K), dtype=np.float32)
+    for k in range(K):
+        box_area = (
+            (query_boxes[k, 2] - query_boxes[k, 0] + 1) *
+            (query_boxes[k, 3] - query_boxes[k, 1] + 1)
+        )
+        for n in range(N):
+            iw = (
+                min(boxes[n, 2], query_boxes[k, 2]) -
+                max(boxes[n, 0], query_boxes[k, 0]) + 1
+            )
+            if iw > 0:
+                ih = (
+                    min(boxes[n, 3], query_boxes[k, 3]) -
+                    max(boxes[n, 1], query_boxes[k, 1]) + 1
+                )
+                if ih > 0:
+                    ua = float(
+                        (boxes[n, 2] - boxes[n, 0] + 1) *
+                        (boxes[n, 3] - boxes[n, 1] + 1) +
+                        box_area - iw * ih
+                    )
+                    overlaps[n, k] = iw * ih / ua
+    return overlaps
+
+
+def random_boxes(n, rng, w=1920, h=1080):
+    # person-like boxes on a 1080p frame
+    xy = rng.uniform(0, [w - 50, h - 100], size=(n, 2))
+    wh = rng.uniform([20, 50], [200, 400], size=(n, 2))
+    return np.ascontiguousarray(np.concatenate([xy, xy + wh], axis=1), dtype=np.float32)
+
+
+def timeit(fn, *args, repeat=20):
+    fn(*args)  # warmup
+    t = time.perf_counter()
+    for _ in range(repeat):
+        fn(*args)
+    return (time.perf_counter() - t) / repeat * 1E3
+
+
+def main(opt):
+    rng = np.random.default_rng(0)
+    print(f"{'N x K':>11} {'loop ms':>10} {'numpy ms':>10} {'torch ms':>10} {'speedup':>8}  max abs err")
+    for n in opt.sizes:
+        a, b = random_boxes(n, rng), random_boxes(n, rng)
+        ref = bbox_ious_loop(a, b)
+        err = np.abs(bbox_ious(a, b) - ref).max()
+        t_loop = timeit(bbox_ious_loop, a, b, repeat=max(1, opt.repeat // 10))
+        t_np = timeit(bbox_ious, a, b, repeat=opt.repeat)
+        t_torch = timeit(bbox_ious_torch, a, b, opt.torch_device, repeat=opt.repeat) if opt.torch_device else float('nan')
+        print(f'{n:>5} x {n:<5} {t_loop:10.3f} {t_np:10.3f} {t_torch:10.3f} {t_loop / t_np:7.1f}x  {err:.2e}')
+
+
+def parse_opt():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', nargs='+', type=int, default=[10, 50, 100, 200, 500])
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--torch-device', type=str, default=None, help='cpu or cuda, skip the torch path if unset')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main(parse_opt())
@@ -0,0 +1,84 @@
+"""
+Crops-per-second of the ReID preprocessing: the per-crop PIL path (ReIDDetectMultiBackend._preprocess)
+against the batched tensor path (_preprocess_boxes, roi_align on the uploaded frame with --device cuda,
+cv2 resize on cpu). No ReID model is loaded.
+
+    python bench/bench_reid_preprocess.py --sizes 1 10 30 60 --device cpu
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+FILE = Path(__file__).resolve()
+ROOT = FILE.parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))  # add ROOT to PATH
+if str(ROOT / 'ultralytics') not in sys.path:
+    sys.path.append(str(ROOT / 'ultralytics'))  # add yolov8 ROOT to PATH
+if str(ROOT / 'trackers' / 'strongsort') not in sys.path:
+    sys.path.append(str(ROOT / 'trackers' / 'strongsort'))  # add strong_sort ROOT to PATH
+
+from reid_multibackend import ReIDDetectMultiBackend
+
+
+class Preprocess(ReIDDetectMultiBackend):
+    # transform state of ReIDDetectMultiBackend only, without building a model
+    def __init__(self, device):
+        nn.Module.__init__(self)
+        self.device = device
+        self._build_transforms()
+
+
+def random_frame_boxes(n, rng, w=1920, h=1080):
+    # smooth 1080p frame and person-like boxes, integer and clipped as in _xywh_to_xyxy
+    frame = np.kron(rng.integers(0, 255, (h // 8, w // 8, 3), dtype=np.uint8), np.ones((8, 8, 1), dtype=np.uint8))
+    xy = rng.uniform(0, [w - 200, h - 400], size=(n, 2))
+    wh = rng.uniform([40, 100], [200, 400], size=(n, 2))
+    return frame, np.concatenate([xy, xy + wh], axis=1).astype(int)
+
+
+def sync(device):
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+
+
+def timeit(fn, device, repeat):
+    fn()  # warmup
+    sync(device)
+    t = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    sync(device)
+    return (time.perf_counter() - t) / repeat
+
+
+def main(opt):
+    device = torch.device(opt.device)
+    pre = Preprocess(device)
+    rng = np.random.default_rng(0)
+    print(f"{'crops':>6} {'PIL crops/s':>12} {'tensor crops/s':>14} {'speedup':>8}  mean abs diff")
+    for n in opt.sizes:
+        frame, xyxys = random_frame_boxes(n, rng)
+        crops = [frame[y1:y2, x1:x2] for x1, y1, x2, y2 in xyxys]
+        ref = pre._preprocess(crops)
+        diff = (pre._preprocess_boxes(frame, xyxys) - ref).abs().mean().item()
+        t_pil = timeit(lambda: pre._preprocess([frame[y1:y2, x1:x2] for x1, y1, x2, y2 in xyxys]), device, opt.repeat)
+        t_roi = timeit(lambda: pre._preprocess_boxes(frame, xyxys), device, opt.repeat)
+        print(f'{n:>6} {n / t_pil:12.0f} {n / t_roi:14.0f} {t_pil / t_roi:7.1f}x  {diff:.3f}')
+
+
+def parse_opt():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', nargs='+', type=int, default=[1, 10, 30, 60])
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--device', type=str, default='cpu', help='cpu or cuda')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main(parse_opt())
@@ -0,0 +1,315 @@
+"""
+Offline benchmark of detector + tracker combinations.
+
+Every combination replays the same frames through InferenceSession.step(), in a fresh process
+so the peak RSS of one run does not include the models of the previous ones. The source is a
+recorded video or a seeded synthetic stream of people walking over a textured background.
+`--yolo-weights stub` (the default) replaces the detector with a model that returns the
+synthetic detections as raw YOLOv8 output, so preprocess and NMS still run and the whole suite
+works on a CPU-only machine without any weights. Writes FPS, per-stage latency (p50/p95/p99,
+ms), peak RSS and, for StrongSORT, the appearance feature bytes per track to <out>.csv and
+<out>.json.
+
+    python bench/bench_trackers.py --frames 300 --device cpu
+    python bench/bench_trackers.py --source video.mp4 --yolo-weights weights/sf640.engine stub \
+        --trackers bytetrack ocsort --device 0 --half
+"""
+import argparse
+import csv
+import json
+import multiprocessing
+import platform
+import resource
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import cv2
+import numpy as np
+import torch
+
+FILE = Path(__file__).resolve()
+ROOT = FILE.parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))  # add ROOT to PATH
+if str(ROOT / 'ultralytics') not in sys.path:
+    sys.path.append(str(ROOT / 'ultralytics'))  # add yolov8 ROOT to PATH
+if str(ROOT / 'trackers' / 'strongsort') not in sys.path:
+    sys.path.append(str(ROOT / 'trackers' / 'strongsort'))  # add strong_sort ROOT to PATH
+
+TRACKERS = ('bytetrack', 'ocsort', 'botsort', 'strongsort', 'deepocsort')
+QUANTILES = ('p50', 'p95', 'p99')
+
+
+class SyntheticStream(object):
+    """
+    Seeded people moving over a static background. Yields (frame, det), det is (N, 6)
+    x1, y1, x2, y2, conf, cls in frame coordinates, with box jitter and missed detections.
+    """
+
+    def __init__(self, frames=300, size=(1920, 1080), seed=0, max_people=30, render=True):
+        self.frames = frames
+        self.w, self.h = size
+        self.seed = seed
+        self.max_people = max_people
+        self.render = render
+        rng = np.random.default_rng(seed)
+        # smooth texture, gives the camera motion compensation keypoints to match
+        small = rng.integers(0, 255, (self.h // 16 + 1, self.w // 16 + 1, 3), dtype=np.uint8)
+        self.background = cv2.resize(small, (self.w, self.h), interpolation=cv2.INTER_LINEAR)
+
+    def __len__(self):
+        return self.frames
+
+    def __iter__(self):
+        rng = np.random.default_rng(self.seed)
+        people = []  # x, y, w, h, vx, vy, frames left, color
+        for _ in range(self.frames):
+            if rng.random() < 0.3 and len(people) < self.max_people:
+                w, h = rng.uniform(0.02, 0.05) * self.w, rng.uniform(0.1, 0.25) * self.h
+                people.append([rng.uniform(0, self.w - w), rng.uniform(0, self.h - h), w, h,
+                               rng.uniform(-5, 5), rng.uniform(-5, 5), rng.integers(30, 200),
+                               tuple(int(c) for c in rng.integers(0, 255, 3))])
+            frame = self.background.copy() if self.render else None
+            det = []
+            for p in people:
+                p[0] += p[4]
+                p[1] += p[5]
+                p[6] -= 1
+                x1, y1, x2, y2 = p[0], p[1], p[0] + p[2], p[1] + p[3]
+                if frame is not None:
+                    cv2.rectangle(frame, (int(x1), int(y1)), (int(x2), int(y2)), p[7], -1)
+                if rng.random() < 0.9:
+                    n = rng.normal(0, 2, 4)
+                    det.append([x1 + n[0], y1 + n[1], x2 + n[2], y2 + n[3], rng.uniform(0.3, 0.95), 0])
+            people = [p for p in people if p[6] > 0]
+            det = np.clip(np.array(det, dtype=np.float32).reshape(-1, 6), 0, [self.w, self.h] * 2 + [1, 0])
+            det = det[(det[:, 2] - det[:, 0] >= 4) & (det[:, 3] - det[:, 1] >= 4)]  # left the frame
+            yield frame, det
+
+
+class VideoStream(object):
+    # frames of a recorded video, detections of the same synthetic people for the stub detector
+    def __init__(self, path, frames=300, seed=0, max_people=30):
+        cap = cv2.VideoCapture(str(path))
+        assert cap.isOpened(), f'Failed to open {path}'
+        n = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        size = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        cap.release()
+        self.path = str(path)
+        self.frames = min(frames, n) if n > 0 else frames
+        self.dets = SyntheticStream(self.frames, size, seed, max_people, render=False)
+
+    def __len__(self):
+        return self.frames
+
+    def __iter__(self):
+        cap = cv2.VideoCapture(self.path)
+        for _, det in self.dets:
+            ok, frame = cap.read()
+            if not ok:
+                break
+            yield frame, det
+        cap.release()
+
+
+class StubDetector(object):
+    """
+    Detector stand-in for InferenceSession: returns the detections set by feed() as raw YOLOv8
+    output (1, 4 + nc, anchors) in letterbox coordinates, padded with low-score anchors.
+    """
+
+    def __init__(self, anchors=8400, nc=1):
+        self.model = None  # no transforms
+        self.anchors = anchors
+        self.nc = nc
+        self.det, self.shape = np.zeros((0, 6), dtype=np.float32), (0, 0)
+
+    def warmup(self, imgsz=(1, 3, 640, 640)):
+        pass
+
+    def feed(self, det, shape):
+        self.det, self.shape = det, shape  # (N, 6) in im0 coordinates, im0 (h, w)
+
+    def __call__(self, im, augment=False, visualize=False):
+        # inverse of scale_boxes
+        h, w = im.shape[2:]
+        gain = min(h / self.shape[0], w / self.shape[1])
+        pad = (w - self.shape[1] * gain) / 2, (h - self.shape[0] * gain) / 2
+        det = self.det[:self.anchors]
+        pred = np.zeros((1, 4 + self.nc, self.anchors), dtype=np.float32)
+        xyxy = det[:, :4] * gain + np.array(pad * 2, dtype=np.float32)
+        pred[0, 0:2, :len(det)] = ((xyxy[:, 0:2] + xyxy[:, 2:4]) / 2).T
+        pred[0, 2:4, :len(det)] = (xyxy[:, 2:4] - xyxy[:, 0:2]).T
+        pred[0, 4 + det[:, 5].astype(int), np.arange(len(det))] = det[:, 4]
+        pred[0, 4, len(det):] = 0.01  # background anchors, removed by the confidence threshold
+        return torch.from_numpy(pred).to(im.device, im.dtype)
+
+
+def load_detector(weights, device, opt):
+    from ultralytics.nn.autobackend import AutoBackend
+    from ultralytics.yolo.utils.checks import check_imgsz
+
+    if weights == 'stub':
+        return StubDetector(), 32, {0: 'person'}, True, opt.imgsz
+    model = AutoBackend(Path(weights), device=device, dnn=False, fp16=opt.half)
+    return model, model.stride, model.names, model.pt, check_imgsz(opt.imgsz, stride=model.stride)
+
+
+def make_source(opt):
+    if opt.source == 'synthetic':
+        return SyntheticStream(opt.frames, opt.size, opt.seed, opt.max_people)
+    return VideoStream(opt.source, opt.frames, opt.seed, opt.max_people)
+
+
+def peak_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2 ** 20 if platform.system() == 'Darwin' else rss / 2 ** 10  # bytes on macOS, KiB on Linux
+
+
+def run_one(weights, tracking_method, opt):
+    """One detector + tracker combination, run in its own process. Returns the result row."""
+    from infer_yolov8 import InferenceSession
+    from metrics import METRICS
+    from ultralytics.yolo.utils.torch_utils import select_device
+
+    torch.manual_seed(opt.seed)
+    row = {'detector': Path(weights).stem if weights != 'stub' else 'stub', 'tracker': tracking_method}
+    try:
+        device = select_device(opt.device)
+        model, stride, names, pt, imgsz = load_detector(weights, device, opt)
+        session = InferenceSession(model, stride, names, pt,
+                                   reid_weights=Path(opt.reid_weights),
+                                   tracking_method=tracking_method,
+                                   tracking_config=ROOT / 'trackers' / tracking_method / 'configs' /
+                                   (tracking_method + '.yaml'),
+                                   imgsz=imgsz,
+                                   conf_thres=opt.conf_thres,
+                                   device=device,
+                                   half=opt.half,
+                                   draw=False)
+        stream = make_source(opt)
+        entrance, frames, t0 = None, 0, None
+        it = iter(stream)
+        while True:
+            t = time.perf_counter()
+            try:
+                frame, det = next(it)
+            except StopIteration:
+                break
+            if frames == opt.warmup:  # steady state only
+                METRICS.reset()
+                t0 = t
+            else:
+                METRICS.observe('capture', time.perf_counter() - t)
+            if entrance is None:
+                h, w = frame.shape[:2]
+                entrance = [0, h // 3, w, h // 3, 0, 2 * h // 3, w, 2 * h // 3]
+            if isinstance(model, StubDetector):
+                model.feed(det, frame.shape[:2])
+            session.step(frame, entrance, 'both')
+            frames += 1
+        if t0 is None:
+            raise RuntimeError(f'only {frames} frames, not more than --warmup {opt.warmup}')
+        wall = time.perf_counter() - t0
+        n = frames - opt.warmup
+        row.update(frames=n, seconds=round(wall, 3), fps=round(n / wall, 2), tracks=session.counter.total,
+                   stages={stage: {k: round(s[k] * 1E3, 3) for k in ('mean',) + QUANTILES}
+                           for stage, s in METRICS.snapshot()['stages'].items()})
+        tracker = getattr(session.tracker, 'tracker', None)
+        if hasattr(tracker, 'memory'):  # StrongSORT appearance gallery
+            row['feature_bytes_per_track'] = round(tracker.memory()['bytes_per_track'])
+    except (Exception, SystemExit) as e:  # missing weights, unsupported backend... keep going with the other combinations
+        row['error'] = f'{type(e).__name__}: {e}'
+        if opt.verbose:
+            traceback.print_exc()
+    row['peak_rss_mb'] = round(peak_rss_mb(), 1)
+    return row
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'torch': torch.__version__,
+        'opencv': cv2.__version__,
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'cuda': torch.cuda.get_device_name(0) if torch.cuda.is_available() else None,
+        'threads': torch.get_num_threads(),
+    }
+
+
+def write_results(rows, opt):
+    out = Path(opt.out)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    stages = [s for s in ('capture', 'preprocess', 'inference', 'nms', 'tracker', 'reid', 'cmc', 'counting')
+              if any(s in r.get('stages', {}) for r in rows)]
+    fields = ['detector', 'tracker', 'frames', 'seconds', 'fps', 'tracks', 'peak_rss_mb', 'feature_bytes_per_track'] + \
+             [f'{s}_{q}_ms' for s in stages for q in QUANTILES] + ['error']
+    with open(out.with_suffix('.csv'), 'w', newline='') as f:
+        writer = csv.DictWriter(f, fields)
+        writer.writeheader()
+        for r in rows:
+            flat = {k: v for k, v in r.items() if k != 'stages'}
+            for s, v in r.get('stages', {}).items():
+                flat.update({f'{s}_{q}_ms': v[q] for q in QUANTILES})
+            writer.writerow({k: flat.get(k, '') for k in fields})
+    with open(out.with_suffix('.json'), 'w') as f:
+        json.dump({'options': {k: str(v) if isinstance(v, Path) else v for k, v in vars(opt).items()},
+                   'environment': environment(), 'results': rows}, f, indent=1)
+    return stages
+
+
+def main(opt):
+    # spawn: every combination starts from an empty process, its peak RSS is its own
+    context = multiprocessing.get_context('spawn')
+    rows = []
+    for weights in opt.yolo_weights:
+        for tracking_method in opt.trackers:
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                row = pool.submit(run_one, weights, tracking_method, opt).result()
+            rows.append(row)
+            print(f"{row['detector']:>12} {row['tracker']:>11} " +
+                  (f"{row['fps']:8.1f} FPS {row['peak_rss_mb']:8.1f} MB" if 'error' not in row else row['error']))
+    stages = write_results(rows, opt)
+
+    print(f"\n{'detector':>12} {'tracker':>11} {'FPS':>8} {'RSS MB':>8}" + ''.join(f' {s:>10}' for s in stages) +
+          '  (p50/p95 ms)')
+    for r in rows:
+        if 'error' in r:
+            continue
+        print(f"{r['detector']:>12} {r['tracker']:>11} {r['fps']:8.1f} {r['peak_rss_mb']:8.1f}" +
+              ''.join(f" {'%.1f/%.1f' % (r['stages'][s]['p50'], r['stages'][s]['p95']) if s in r['stages'] else '-':>10}"
+                      for s in stages))
+    print(f'Results saved to {Path(opt.out).with_suffix(".csv")} and .json')
+
+
+def parse_opt():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--source', type=str, default='synthetic', help='video file or synthetic')
+    parser.add_argument('--yolo-weights', nargs='+', type=str, default=['stub'],
+                        help='model.pt / .engine path(s), stub for the synthetic detector')
+    parser.add_argument('--reid-weights', type=Path, default=ROOT / 'weights' / 'osnet_x0_25_msmt17.pt')
+    parser.add_argument('--trackers', nargs='+', type=str, default=list(TRACKERS), choices=TRACKERS)
+    parser.add_argument('--frames', type=int, default=300, help='frames per combination, warmup included')
+    parser.add_argument('--warmup', type=int, default=20, help='frames not counted in FPS and latency')
+    parser.add_argument('--size', nargs=2, type=int, default=[1920, 1080], help='synthetic frame w h')
+    parser.add_argument('--max-people', type=int, default=30, help='people in the synthetic stream')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--imgsz', '--img', '--img-size', nargs='+', type=int, default=[640], help='inference size h,w')
+    parser.add_argument('--conf-thres', type=float, default=0.25, help='confidence threshold')
+    parser.add_argument('--device', default='cpu', help='cuda device, i.e. 0, or cpu')
+    parser.add_argument('--half', action='store_true', help='use FP16 half-precision inference')
+    parser.add_argument('--out', type=str, default=str(ROOT / 'runs' / 'bench' / 'trackers'),
+                        help='writes <out>.csv and <out>.json')
+    parser.add_argument('--verbose', action='store_true', help='print the traceback of failed combinations')
+    opt = parser.parse_args()
+    opt.imgsz *= 2 if len(opt.imgsz) == 1 else 1  # expand
+    return opt
+
+
+if __name__ == "__main__":
+    main(parse_opt())
@@ -0,0 +1,358 @@
+"""
+Detection replay cache.
+
+track.py / tracknew.py --dump-dets write the NMS output of every frame the tracker sees (and with
+--dump-embeddings the ReID embedding of every detection) to a directory of raw columns:
+
+    meta.json     frame count, detection count, column dtypes, frame shape, fps, weights
+    frame.bin     int32   (F,)     frame id, as in the MOT txt results
+    count.bin     int32   (F,)     detections of the frame
+    boxes.bin     float32 (N, 4)   x1, y1, x2, y2 in frame coordinates
+    conf.bin      float32 (N,)
+    cls.bin       int16   (N,)
+    emb.bin       float16 (N, D)   optional
+    affines.bin   Deep OC-SORT camera motion of the live run by frame id, see cmc.AffineLog
+
+The reader memory-maps the columns, so opening a cache costs nothing however long the video was,
+and replay() feeds the detections straight into tracker.update, without decoding a frame or running
+the detector. Cached embeddings are served to the tracker by ReplayEmbedder in place of its ReID
+model, so StrongSORT, BoT-SORT and Deep OC-SORT replay without a GPU too.
+
+    cache = DetectionCache('runs/track/exp/dets')
+    tracker = create_tracker('ocsort', config, reid_weights, 'cpu', False)
+    for frame_id, outputs in replay(cache, tracker):
+        ...
+
+    python det_cache.py --cache runs/track/exp/dets --tracking-method strongsort --save-txt tracks.txt
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+
+FILE = Path(__file__).resolve()
+ROOT = FILE.parents[0]
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))  # add ROOT to PATH
+if str(ROOT / 'ultralytics') not in sys.path:
+    sys.path.append(str(ROOT / 'ultralytics'))  # add yolov8 ROOT to PATH
+if str(ROOT / 'trackers' / 'strongsort') not in sys.path:
+    sys.path.append(str(ROOT / 'trackers' / 'strongsort'))  # add strong_sort ROOT to PATH
+
+FRAME_COLUMNS = {'frame': ('int32', ()), 'count': ('int32', ())}
+DET_COLUMNS = {'boxes': ('float32', (4,)), 'conf': ('float32', ()), 'cls': ('int16', ())}
+EMB_DTYPE = 'float16'
+
+
+def canonical_boxes(boxes, shape):
+    """
+    Integer crop boxes of the (N, 4) xyxy `boxes`, the way StrongSORT and BoT-SORT cut them
+    (xyxy2xywh then _xywh_to_xyxy), vectorised.
+    """
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    h, w = shape[:2]
+    c = (boxes[:, 0:2] + boxes[:, 2:4]) / 2
+    half = (boxes[:, 2:4] - boxes[:, 0:2]) / 2
+    x1y1 = np.maximum(np.trunc(c - half), 0)
+    x2y2 = np.minimum(np.trunc(c + half), [w - 1, h - 1])
+    return np.concatenate([x1y1, x2y2], axis=1).astype(int)
+
+
+def reid_model(tracker):
+    # attribute holding the ReID model: StrongSORT and BoT-SORT use model, Deep OC-SORT embedder
+    for attr in ('model', 'embedder'):
+        if getattr(tracker, attr, None) is not None and hasattr(tracker, '_get_features'):
+            return attr
+    return None
+
+
+class DetectionWriter(object):
+
+    def __init__(self, path, **meta):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.meta = meta
+        self.frames = 0
+        self.detections = 0
+        self.emb_dim = None
+        self._files = {name: open(self.path / f'{name}.bin', 'wb') for name in {**FRAME_COLUMNS, **DET_COLUMNS}}
+
+    def _append(self, name, data, dtype):
+        self._files[name].write(np.ascontiguousarray(data, dtype=dtype).tobytes())
+
+    def write(self, frame_id, det, emb=None):
+        """One frame: det is the (N, 6) x1, y1, x2, y2, conf, cls NMS output, emb (N, D) or None."""
+        det = det.cpu().numpy() if isinstance(det, torch.Tensor) else np.asarray(det)
+        det = det.reshape(-1, det.shape[-1] if det.size else 6)
+        self._append('frame', [frame_id], 'int32')
+        self._append('count', [len(det)], 'int32')
+        self._append('boxes', det[:, 0:4], 'float32')
+        self._append('conf', det[:, 4], 'float32')
+        self._append('cls', det[:, 5], 'int16')
+        if emb is not None and len(det):
+            emb = emb.cpu().numpy() if isinstance(emb, torch.Tensor) else np.asarray(emb)
+            if self.emb_dim is None:
+                if self.detections:
+                    raise ValueError('embeddings have to be written from the first frame on')
+                self.emb_dim = emb.shape[1]
+                self._files['emb'] = open(self.path / 'emb.bin', 'wb')
+            self._append('emb', emb, EMB_DTYPE)
+        elif self.emb_dim is not None and len(det):
+            raise ValueError('embeddings missing for a frame with detections')
+        self.frames += 1
+        self.detections += len(det)
+
+    def close(self):
+        if not self._files:
+            return
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+        columns = {name: [dtype, list(tail)] for name, (dtype, tail) in {**FRAME_COLUMNS, **DET_COLUMNS}.items()}
+        if self.emb_dim is not None:
+            columns['emb'] = [EMB_DTYPE, [self.emb_dim]]
+        meta = dict(self.meta, version=1, frames=self.frames, detections=self.detections, columns=columns)
+        # meta.json last, temp file + rename: a cache without it was not finished
+        fd, tmp = tempfile.mkstemp(prefix='.meta.', dir=self.path)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(meta, f, indent=1, default=str)
+        os.replace(tmp, self.path / 'meta.json')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
+class DetectionCache(object):
+
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path / 'meta.json') as f:
+            self.meta = json.load(f)
+        self.columns = {}
+        for name, (dtype, tail) in self.meta['columns'].items():
+            n = self.meta['frames'] if name in FRAME_COLUMNS else self.meta['detections']
+            shape = (n, *tail)
+            if n:
+                self.columns[name] = np.memmap(self.path / f'{name}.bin', dtype=dtype, mode='r', shape=shape)
+            else:  # np.memmap cannot map an empty file
+                self.columns[name] = np.zeros(shape, dtype=dtype)
+        self.frame_ids = self.columns['frame']
+        self.offsets = np.concatenate([[0], np.cumsum(self.columns['count'], dtype=np.int64)])
+        self.has_embeddings = 'emb' in self.columns
+        self.shape = tuple(self.meta.get('shape') or (0, 0))  # (h, w) of the frames
+
+    def __len__(self):
+        return len(self.frame_ids)
+
+    def __getitem__(self, i):
+        """(frame_id, det, emb) of the i-th cached frame, det is a (N, 6) float32 array, emb (N, D) or None."""
+        a, b = self.offsets[i], self.offsets[i + 1]
+        c = self.columns
+        det = np.empty((b - a, 6), dtype=np.float32)
+        det[:, 0:4] = c['boxes'][a:b]
+        det[:, 4] = c['conf'][a:b]
+        det[:, 5] = c['cls'][a:b]
+        emb = np.asarray(c['emb'][a:b], dtype=np.float32) if self.has_embeddings else None
+        return int(self.frame_ids[i]), det, emb
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+class ReplayEmbedder(object):
+    """
+    Stands in for the ReID model of a tracker. set() gives it the detections and embeddings of the
+    frame; a call with the crop boxes the tracker derived from those detections returns their
+    embeddings, looked up by box.
+    """
+
+    def __init__(self, tracker):
+        self.tracker = tracker
+        self.xyxy_input = hasattr(tracker, 'embedder')  # Deep OC-SORT passes its xyxy boxes to _get_features as they are
+        self.boxes = np.zeros((0, 4), dtype=np.float32)
+        self.emb = None
+
+    @classmethod
+    def attach(cls, tracker):
+        attr = reid_model(tracker)
+        if attr is None:
+            return None
+        embedder = cls(tracker)
+        setattr(tracker, attr, embedder)
+        return embedder
+
+    def set(self, boxes, emb):
+        self.boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        self.emb = torch.as_tensor(np.asarray(emb, dtype=np.float32))
+
+    def forward(self, im, xyxys=None):
+        b = self.boxes
+        if self.xyxy_input:
+            xywhs = b
+        else:  # xyxy2xywh, same float32 arithmetic as the tracker
+            xywhs = np.concatenate([(b[:, 0:2] + b[:, 2:4]) / 2, b[:, 2:4] - b[:, 0:2]], axis=1)
+        index = {tuple(self.tracker._xywh_to_xyxy(xywh)): i for i, xywh in enumerate(xywhs)}
+        return self.emb[[index[tuple(box)] for box in np.asarray(xyxys).tolist()]]
+
+    def __call__(self, im, xyxys=None):
+        return self.forward(im, xyxys=xyxys)
+
+    def warmup(self, *args, **kwargs):
+        pass
+
+
+class DetectionRecorder(object):
+    """
+    Dumps the detections a live tracker is fed. With embeddings, every detection is embedded once
+    on the crop StrongSORT and BoT-SORT cut, and the tracker gets those embeddings through a
+    ReplayEmbedder, so the live run and a replay see the same features. Trackers without ReID use
+    a ReIDDetectMultiBackend of `reid_weights` for the dump only. Deep OC-SORT appends its camera
+    motion to affines.bin of the recording, keyed by frame id.
+    """
+
+    def __init__(self, path, tracker, embeddings=False, reid_weights=None, device='cpu', half=False, **meta):
+        self.writer = DetectionWriter(path, **meta)
+        self.tracker = tracker
+        self.cmc = hasattr(tracker, 'cmc')
+        if self.cmc:
+            (self.writer.path / 'affines.bin').unlink(missing_ok=True)  # a new recording, as the columns
+            affine_log(tracker, self.writer.path, cached_only=False)
+        self.model = self.embedder = None
+        if embeddings:
+            attr = reid_model(tracker)
+            if attr is not None:
+                self.model = getattr(tracker, attr)
+                self.embedder = ReplayEmbedder.attach(tracker)
+            else:
+                from reid_multibackend import ReIDDetectMultiBackend
+                self.model = ReIDDetectMultiBackend(weights=Path(reid_weights), device=device, fp16=half)
+
+    @torch.no_grad()
+    def write(self, frame_id, det, im0):
+        self.writer.meta.setdefault('shape', im0.shape[:2])
+        det = det.cpu()
+        emb = None
+        if self.model is not None and len(det):
+            # rounded to the cached precision, the live run sees what a replay sees
+            emb = self.model(im0, xyxys=canonical_boxes(det[:, 0:4].numpy(), im0.shape)).half().float().cpu()
+            if self.embedder is not None:
+                self.embedder.set(det[:, 0:4].numpy(), emb)
+        if self.cmc:
+            self.tracker.cmc_frame = frame_id
+        self.writer.write(frame_id, det, emb)
+
+    def close(self):
+        if self.cmc:
+            self.tracker.cmc.cache.close()
+        self.writer.close()
+
+
+def affine_log(tracker, path, cached_only):
+    # Deep OC-SORT logs (or with cached_only replays) its camera motion in <path>/affines.bin
+    from trackers.deepocsort.cmc import AffineLog
+
+    tracker.cmc.cache = AffineLog(path)
+    tracker.cmc.cached_only = cached_only
+    tracker.cmc_stream = 'affines'
+
+
+def static_camera(tracker):
+    # no frames to estimate camera motion on: BoT-SORT GMC and Deep OC-SORT CMC off
+    if hasattr(tracker, 'gmc'):
+        tracker.gmc.method = 'none'
+    if hasattr(tracker, 'cmc_off'):
+        tracker.cmc_off = True
+
+
+def replay(cache, tracker, frame=None, conf_thres=None, max_frames=None, cmc_log=False):
+    """
+    Feed the cached detections into tracker.update, frame by frame. Yields (frame_id, outputs).
+    Like the live loop, frames without detections are not passed to the tracker (outputs is []).
+    `frame` is the image handed to the tracker. By default it is a black frame of the recorded
+    size and camera motion compensation is turned off.
+    conf_thres drops the detections below it, the same detections NMS would have kept at that
+    threshold (if the cache was dumped with a lower one). max_frames stops after that many frames.
+    With cmc_log, Deep OC-SORT applies the camera motion the live run logged in affines.bin
+    instead of estimating it, frames missing from the log are taken as static.
+    """
+    cmc_log = cmc_log and hasattr(tracker, 'cmc')
+    if cmc_log:
+        affine_log(tracker, cache.path, cached_only=True)
+    if frame is None:
+        frame = np.zeros((*cache.shape, 3), dtype=np.uint8)
+        if not cmc_log:
+            static_camera(tracker)
+    embedder = ReplayEmbedder.attach(tracker) if cache.has_embeddings else None
+    for i in range(len(cache) if max_frames is None else min(max_frames, len(cache))):
+        frame_id, det, emb = cache[i]
+        if conf_thres is not None:
+            keep = det[:, 4] > conf_thres  # as in non_max_suppression
+            det = det[keep]
+            emb = emb[keep] if emb is not None else None
+        if not len(det):
+            yield frame_id, []
+            continue
+        if embedder is not None:
+            embedder.set(det[:, 0:4], emb)
+        if cmc_log:
+            tracker.cmc_frame = frame_id
+        yield frame_id, tracker.update(torch.from_numpy(det), frame)
+
+
+def write_mot(f, frame_id, outputs):
+    # MOT challenge rows, as track.py --save-txt writes them
+    for output in outputs:
+        x1, y1, x2, y2, id = output[0:5]
+        f.write(('%g ' * 10 + '\n') % (frame_id, id, x1, y1, x2 - x1, y2 - y1, -1, -1, -1, 0))
+
+
+def main(opt):
+    from trackers.multi_tracker_zoo import create_tracker
+
+    cache = DetectionCache(opt.cache)
+    config = opt.tracking_config or ROOT / 'trackers' / opt.tracking_method / 'configs' / f'{opt.tracking_method}.yaml'
+    tracker = create_tracker(opt.tracking_method, config, opt.reid_weights, torch.device(opt.device), False)
+    if reid_model(tracker) is not None and not cache.has_embeddings:
+        print(f'{opt.cache} has no embeddings, {opt.tracking_method} computes them on black frames')
+
+    f = open(opt.save_txt, 'w') if opt.save_txt else None
+    t = time.perf_counter()
+    with torch.no_grad():
+        for frame_id, outputs in replay(cache, tracker, cmc_log=opt.cmc_log):
+            if f is not None:
+                write_mot(f, frame_id, outputs)
+    dt = time.perf_counter() - t
+    if f is not None:
+        f.close()
+    fps = cache.meta.get('fps') or 30
+    print(f'{len(cache)} frames, {cache.meta["detections"]} detections in {dt:.2f}s: {len(cache) / dt:.0f} FPS, '
+          f'{len(cache) / fps / dt:.0f}x realtime at {fps:g} FPS')
+
+
+def parse_opt():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cache', type=Path, required=True, help='directory written by --dump-dets')
+    parser.add_argument('--tracking-method', type=str, default='bytetrack',
+                        help='deepocsort, botsort, strongsort, ocsort, bytetrack')
+    parser.add_argument('--tracking-config', type=Path, default=None)
+    parser.add_argument('--reid-weights', type=Path, default=ROOT / 'weights' / 'osnet_x0_25_msmt17.pt',
+                        help='only loaded, the cached embeddings are used')
+    parser.add_argument('--device', default='cpu', help='cuda device, i.e. cuda:0, or cpu')
+    parser.add_argument('--save-txt', type=Path, default=None, help='write the tracks in MOT format')
+    parser.add_argument('--cmc-log', action='store_true',
+                        help='deepocsort: apply the camera motion the live run logged in the cache')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main(parse_opt())
@@ -0,0 +1,74 @@
+"""
+Display consumer of the detection pipeline.
+
+The detection thread only hands over the raw frame and what has to be drawn on it (submit()
+costs a dict assignment). The display thread keeps the newest item per window and renders
+only the frames it actually shows, so a slow window drops frames instead of stalling detection.
+
+    display = DisplayThread(render=lambda frame, overlay: session.render(frame.copy(), overlay),
+                            on_quit=stop_program)
+    display.start()
+    display.submit('Detection', frame, session.overlay)
+"""
+import platform
+import threading
+
+import cv2
+
+
+class DisplayThread(threading.Thread):
+
+    def __init__(self, render=None, on_quit=None, wait_ms=1):
+        threading.Thread.__init__(self, name='display', daemon=True)
+        self.render = render  # render(frame, *args) -> frame to show, None: show as is
+        self.on_quit = on_quit  # called when 'q' is pressed
+        self.wait_ms = wait_ms
+
+        self._pending = {}  # window -> (frame, args), newest only
+        self._new_frame = threading.Event()
+        self._sizes = {}  # window -> (w, h) it was created with
+        self.stop_thread = False
+
+        self.submitted = 0
+        self.shown = 0
+
+    def submit(self, window, frame, *args):
+        # the frame must not be modified by the caller afterwards
+        self._pending[window] = (frame, args)
+        self.submitted += 1
+        self._new_frame.set()
+
+    def _show(self, window, frame):
+        size = (frame.shape[1], frame.shape[0])
+        if platform.system() == 'Linux' and self._sizes.get(window) != size:  # allow window resize (Linux)
+            # create / resize the window only when the frame size changes, not on every frame
+            if window not in self._sizes:
+                cv2.namedWindow(window, cv2.WINDOW_NORMAL | cv2.WINDOW_KEEPRATIO)
+            cv2.resizeWindow(window, *size)
+            self._sizes[window] = size
+        cv2.imshow(window, frame)
+
+    def run(self):
+        while not self.stop_thread:
+            if not self._new_frame.wait(0.1):
+                continue
+            self._new_frame.clear()
+            for window in list(self._pending):
+                frame, args = self._pending.pop(window)
+                if self.render is not None:
+                    frame = self.render(frame, *args)
+                self._show(window, frame)
+                self.shown += 1
+            if cv2.waitKey(self.wait_ms) == ord('q'):  # 1 millisecond
+                self.stop_thread = True
+                if self.on_quit is not None:
+                    self.on_quit()
+        cv2.destroyAllWindows()
+
+    def stop(self):
+        self.stop_thread = True
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join()
+
+    def stats(self):
+        return {'submitted': self.submitted, 'shown': self.shown, 'skipped': self.submitted - self.shown}
@@ -1,6 +1,6 @@
 import RPi.GPIO as GPIO
 import time
-import json
+from region_config import get_region_config
 # Pin Definitons:
 but_pin_1u = 16  # BOARD pin 16
 but_pin_1d = 18  # BOARD pin 18
@@ -10,13 +10,12 @@ but_pin_2d = 26  # BOARD pin 26
 
 # Define function to update data and save to file
 def update_data():
-    data["type"] = type_var.get()
-    data["number1"] = int(number1_var.get())
-    data["number2"] = int(number2_var.get())
-    with open("region_setting.json", "w") as f:
-        json.dump(data, f)
+    region.set(type=type_var.get(), number1=int(number1_var.get()), number2=int(number2_var.get()))
 
 def main():
+    global region
+    # atomic read-modify-write, the detection process picks the change up through its watcher
+    region = get_region_config(watch=False)
 
     # Pin Setup:
     GPIO.setmode(GPIO.BOARD)  # BOARD pin-numbering scheme
@@ -35,39 +34,19 @@ def main():
             curr_2_down = GPIO.input(but_pin_2d)
             # DOOR 1 UP
             if (curr_1_up != 0):
-                # Read data from file
-                with open("region_setting.json", "r") as f:
-                    data = json.load(f)
-                data["number1"] = data["number1"]+1
-                with open("region_setting.json", "w") as f:
-                    json.dump(data, f)
+                region.modify(lambda data: data.update(number1=data["number1"]+1))
 
             # DOOR 1 DOWN
             if (curr_1_down != 0):
-                # Read data from file
-                with open("region_setting.json", "r") as f:
-                    data = json.load(f)
-                data["number1"] = data["number1"]-1
-                with open("region_setting.json", "w") as f:
-                    json.dump(data, f)
+                region.modify(lambda data: data.update(number1=data["number1"]-1))
 
             # DOOR 2 UP
             if (curr_2_up != 0):
-                # Read data from file
-                with open("region_setting.json", "r") as f:
-                    data = json.load(f)
-                data["number2"] = data["number2"]+1
-                with open("region_setting.json", "w") as f:
-                    json.dump(data, f)
+                region.modify(lambda data: data.update(number2=data["number2"]+1))
 
             # DOOR 2 DOWN
             if (curr_2_down != 0):
-                # Read data from file
-                with open("region_setting.json", "r") as f:
-                    data = json.load(f)
-                data["number2"] = data["number2"]-1
-                with open("region_setting.json", "w") as f:
-                    json.dump(data, f)
+                region.modify(lambda data: data.update(number2=data["number2"]-1))
 
 
             time.sleep(1)
@@ -1,17 +1,13 @@
 import tkinter as tk
-import json
+from region_config import get_region_config
 
 # Read data from file
-with open("region_setting.json", "r") as f:
-    data = json.load(f)
+region = get_region_config(watch=False)
+data = region.get()
 
-# Define function to update data and save to file
+# Define function to update data and save to file (atomically, the detection process watches the file)
 def update_data():
-    data["type"] = type_var.get()
-    data["number1"] = int(number1_var.get())
-    data["number2"] = int(number2_var.get())
-    with open("region_setting.json", "w") as f:
-        json.dump(data, f)
+    region.set(type=type_var.get(), number1=int(number1_var.get()), number2=int(number2_var.get()))
 
 # Create main window
 root = tk.Tk()
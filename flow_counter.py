@@ -0,0 +1,189 @@
+"""
+Entrance counting state of one stream.
+
+Replaces the per-frame `records` strings and the in/out id lists of human_flow_counting with
+integer counters. Past intervals go to a bounded history, ids that have not been seen for
+`max_age` frames are dropped from the centre table, so the state stays the same size however
+long the stream runs. The overlay reads snapshot() instead of parsing strings.
+
+Crossings are computed for all tracks of a frame and all counting regions at once:
+
+    lines     (L, 4) x1, y1, x2, y2 segments, crossing from the left to the right side of the
+              direction x1,y1 -> x2,y2 (in image coordinates) counts as in, the other way as out
+    polygons  list of (K, 2) vertices, entering counts as in, leaving as out
+
+    counter = FlowCounter(video_fps=30, secs_interval=2)
+    counter.update(frame_id, outputs, entrance_lines(entrance, region_type))
+    annotator.record(counter.snapshot())
+"""
+from collections import deque
+
+import numpy as np
+
+
+def entrance_lines(entrance, region_type):
+    """
+    Counting lines of the DOOR1/DOOR2 entrance list. DOOR1 counts downward movement as in,
+    DOOR2 upward movement, so DOOR2 is returned right to left.
+    """
+    assert region_type in [
+        'both', "upper", "under", 'close'
+    ], "region_type should be 'both', 'upper', 'under' or 'close' when do entrance counting."
+    lines = []
+    if region_type in ('upper', 'both'):
+        lines.append(entrance[0:4])
+    if region_type in ('under', 'both'):
+        x1, y1, x2, y2 = entrance[4:8]
+        lines.append([x2, y2, x1, y1])
+    return np.array(lines, dtype=np.float64).reshape(-1, 4)
+
+
+def _cross(d, v):
+    # z component of d x v, broadcast over the leading axes
+    return d[..., 0] * v[..., 1] - d[..., 1] * v[..., 0]
+
+
+def line_crossings(prev, cur, lines):
+    """
+    Crossings of the moves prev -> cur (M, 2) over the segments `lines` (L, 4).
+    Returns the (M, L) boolean in and out matrices.
+    """
+    a, b = lines[None, :, :2], lines[None, :, 2:]
+    p, q = prev[:, None], cur[:, None]
+    d = b - a
+    side0 = _cross(d, p - a)  # > 0: right of the line
+    side1 = _cross(d, q - a)
+    # the move has to pass between the end points of the segment
+    m = q - p
+    within = _cross(m, a - p) * _cross(m, b - p) <= 0
+    crossed_in = (side0 <= 0) & (side1 > 0) & within
+    crossed_out = (side0 >= 0) & (side1 < 0) & within
+    return crossed_in, crossed_out
+
+
+def points_in_polygon(points, polygon):
+    """Even-odd test of the (M, 2) points against one (K, 2) polygon, all edges at once."""
+    x, y = points[:, 0:1], points[:, 1:2]
+    x1, y1 = polygon[:, 0], polygon[:, 1]
+    x2, y2 = np.roll(x1, -1), np.roll(y1, -1)
+    spans = (y1 > y) != (y2 > y)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x_cross = x1 + (y - y1) * (x2 - x1) / (y2 - y1)
+    return np.count_nonzero(spans & (x < x_cross), axis=1) % 2 == 1
+
+
+class FlowCounter(object):
+
+    def __init__(self, video_fps=30, secs_interval=2, history=1800, max_age=300):
+        self.video_fps = video_fps
+        self.secs_interval = secs_interval
+        self.max_age = max_age  # frames, longer than the track buffer of any tracker
+
+        self.frame_id = 0
+        self.total = 0  # distinct track ids
+        self.in_count = 0  # crossings, a person crossing twice counts twice
+        self.out_count = 0
+        self.region_in = np.zeros(0, dtype=np.int64)  # per line, then per polygon
+        self.region_out = np.zeros(0, dtype=np.int64)
+
+        # centre table, sorted by id
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.centers = np.zeros((0, 2))
+        self.last_seen = np.zeros(0, dtype=np.int64)
+
+        self.interval_ids = set()  # ids seen in the current interval only
+        self.interval_count = None  # distinct ids of the last finished interval
+        # one (end frame, distinct ids, in, out) bucket per finished interval
+        self.history = deque(maxlen=history)
+        self._interval_start = (0, 0)  # in/out counts at the start of the interval
+
+    def update(self, frame_id, outputs, lines=None, polygons=()):
+        """
+        Count the tracker output of one frame, (N, 7) rows of x1, y1, x2, y2, id, cls, conf.
+        Returns the number of (in, out) crossings of this frame.
+        """
+        self.frame_id = frame_id
+        outputs = np.asarray(outputs)
+        # StrongSORT rows carry an 8th object column (the track's feature queue)
+        outputs = outputs.reshape(len(outputs), -1)[:, :7].astype(np.float64) if len(outputs) else np.zeros((0, 7))
+        lines = np.zeros((0, 4)) if lines is None else np.asarray(lines, dtype=np.float64).reshape(-1, 4)
+        n_regions = len(lines) + len(polygons)
+        if len(self.region_in) != n_regions:  # regions changed, per-region counts restart
+            self.region_in = np.zeros(n_regions, dtype=np.int64)
+            self.region_out = np.zeros(n_regions, dtype=np.int64)
+
+        outputs = outputs[outputs[:, 4] >= 0]
+        ids = outputs[:, 4].astype(np.int64)
+        centers = (outputs[:, 0:2] + outputs[:, 2:4]) / 2.
+
+        pos = np.searchsorted(self.ids, ids)
+        known = pos < len(self.ids)
+        known[known] = self.ids[pos[known]] == ids[known]
+        pos_known = pos[known]
+
+        n_in = n_out = 0
+        if n_regions and len(pos_known):
+            prev, cur = self.centers[pos_known], centers[known]
+            crossed_in, crossed_out = [], []
+            if len(lines):
+                line_in, line_out = line_crossings(prev, cur, lines)
+                crossed_in.append(line_in.sum(0))
+                crossed_out.append(line_out.sum(0))
+            for polygon in polygons:
+                polygon = np.asarray(polygon, dtype=np.float64)
+                inside0, inside1 = points_in_polygon(prev, polygon), points_in_polygon(cur, polygon)
+                crossed_in.append([np.count_nonzero(~inside0 & inside1)])
+                crossed_out.append([np.count_nonzero(inside0 & ~inside1)])
+            region_in, region_out = np.concatenate(crossed_in), np.concatenate(crossed_out)
+            self.region_in += region_in
+            self.region_out += region_out
+            n_in, n_out = int(region_in.sum()), int(region_out.sum())
+            self.in_count += n_in
+            self.out_count += n_out
+
+        # move the known centres, insert the new ids
+        self.centers[pos_known] = centers[known]
+        self.last_seen[pos_known] = frame_id
+        new = ~known
+        n_new = int(np.count_nonzero(new))
+        if n_new:
+            self.total += n_new
+            order = np.argsort(np.concatenate([self.ids, ids[new]]), kind='stable')
+            self.ids = np.concatenate([self.ids, ids[new]])[order]
+            self.centers = np.concatenate([self.centers, centers[new]])[order]
+            self.last_seen = np.concatenate([self.last_seen, np.full(n_new, frame_id)])[order]
+        self.interval_ids.update(ids.tolist())
+
+        # close the interval every secs_interval seconds of video
+        if frame_id % (self.video_fps * self.secs_interval) == 0 and \
+                not (self.history and self.history[-1][0] == frame_id):
+            self._end_interval(frame_id)
+        return n_in, n_out
+
+    def _end_interval(self, frame_id):
+        in_start, out_start = self._interval_start
+        self.interval_count = len(self.interval_ids)
+        self.history.append((frame_id, self.interval_count, self.in_count - in_start, self.out_count - out_start))
+        self._interval_start = (self.in_count, self.out_count)
+        self.interval_ids.clear()
+        self.evict(frame_id)
+
+    def evict(self, frame_id):
+        # forget the centres of ids that left the scene, they are never matched again
+        keep = self.last_seen >= frame_id - self.max_age
+        self.ids, self.centers, self.last_seen = self.ids[keep], self.centers[keep], self.last_seen[keep]
+
+    def snapshot(self):
+        """Current counts as a dict, what Annotator.record draws."""
+        return {
+            'frame_id': self.frame_id,
+            'total': self.total,
+            'in': self.in_count,
+            'out': self.out_count,
+            'regions': list(zip(self.region_in.tolist(), self.region_out.tolist())),
+            'interval': self.interval_count,
+            'secs_interval': self.secs_interval,
+        }
+
+    def reset(self):
+        self.__init__(self.video_fps, self.secs_interval, self.history.maxlen, self.max_age)
@@ -0,0 +1,178 @@
+"""
+Preallocated frame ring buffer between the capture and the detection thread.
+
+One producer (CameraThread) and one consumer (DetectionThread). A lock is only held while a
+slot is picked, so the producer can never claim the slot the consumer is taking; frames are
+written and read outside of it. The two events are only used to sleep instead of busy-looping.
+
+    mode='latest'  -> the consumer always gets the newest frame, older unread frames are dropped
+    mode='nodrop'  -> the producer waits for a free slot, every frame is consumed in order
+"""
+import threading
+import time
+
+import numpy as np
+
+
+class FrameRingBuffer(object):
+
+    def __init__(self, capacity=3, mode='latest'):
+        assert mode in ('latest', 'nodrop'), "mode should be 'latest' or 'nodrop'"
+        # one slot held by the consumer, one being written, at least one published
+        assert capacity >= 3, 'capacity should be at least 3'
+        self.capacity = capacity
+        self.mode = mode
+
+        self.frames = None  # (capacity, h, w, c), allocated on the first frame
+        self.seqs = np.full(capacity, -1, dtype=np.int64)  # -1: empty or being written
+        self.timestamps = np.zeros(capacity, dtype=np.float64)
+
+        # producer side
+        self.write_seq = 0
+        self._writing = -1
+        # consumer side
+        self.read_seq = 0
+        self._reading = -1
+
+        self.closed = False
+        self._lock = threading.Lock()  # slot selection only
+        self._new_frame = threading.Event()
+        self._space = threading.Event()
+
+        # per-stage drop accounting
+        self.captured = 0
+        self.consumed = 0
+        self.drops = {'capture': 0, 'detection': 0}
+
+    def allocate(self, shape, dtype=np.uint8):
+        self.frames = np.zeros((self.capacity, *shape), dtype=dtype)
+        self.seqs[:] = -1
+
+    def _free_slot(self):
+        # consumed or empty slot first, then (latest mode only) the oldest unread one
+        seqs = self.seqs
+        for i in range(self.capacity):
+            if i != self._reading and seqs[i] < self.read_seq:
+                return i
+        if self.mode == 'latest':
+            unread = [i for i in range(self.capacity) if i != self._reading]
+            return min(unread, key=lambda i: seqs[i])
+        return -1
+
+    def _claim_slot(self):
+        with self._lock:
+            slot = self._free_slot()
+            if slot >= 0:
+                self.seqs[slot] = -1
+                self._writing = slot
+            return slot
+
+    def claim(self, timeout=None):
+        """
+        Return the preallocated array the next frame should be written into, e.g. cap.read(slot).
+        Returns None before allocate() was called, or if no slot was freed in `timeout` (nodrop mode).
+        """
+        if self.frames is None:
+            return None
+        slot = self._claim_slot()
+        while slot < 0:
+            if self.closed:
+                return None
+            self._space.clear()
+            slot = self._claim_slot()  # re-check, the consumer may have freed one before clear()
+            if slot < 0 and not self._space.wait(timeout):
+                return None
+            slot = self._claim_slot()
+        return self.frames[slot]
+
+    def publish(self, timestamp=None):
+        # make the claimed slot visible to the consumer
+        slot = self._writing
+        self.timestamps[slot] = time.time() if timestamp is None else timestamp
+        self.seqs[slot] = self.write_seq
+        self.write_seq += 1
+        self.captured += 1
+        self._writing = -1
+        self._new_frame.set()
+        return self.write_seq - 1
+
+    def cancel(self):
+        # the claimed slot was not filled (failed read)
+        self._writing = -1
+        self.drops['capture'] += 1
+
+    def put(self, frame, timestamp=None, timeout=None):
+        # copying variant of claim()/publish(), (re)allocates on the first frame or a new shape
+        if self.frames is None or self.frames.shape[1:] != frame.shape:
+            self.allocate(frame.shape, frame.dtype)
+        slot = self.claim(timeout)
+        if slot is None:
+            self.drops['capture'] += 1
+            return None
+        slot[...] = frame
+        return self.publish(timestamp)
+
+    def _next_slot(self):
+        seqs = self.seqs
+        if self.mode == 'latest':
+            slot = int(np.argmax(seqs))
+            return slot if seqs[slot] >= self.read_seq else -1
+        hits = np.flatnonzero(seqs == self.read_seq)
+        return int(hits[0]) if len(hits) else -1
+
+    def _take_slot(self):
+        # the slot is held (_reading) before read_seq moves past it, both under the lock claim() takes
+        with self._lock:
+            slot = self._next_slot()
+            if slot >= 0:
+                seq = int(self.seqs[slot])
+                self._reading = slot
+                self.drops['detection'] += seq - self.read_seq
+                self.read_seq = seq + 1
+            return slot
+
+    def get(self, timeout=None):
+        """
+        Return (seq, timestamp, frame) for the next frame, or None on timeout / after close().
+        `frame` is a view of the slot and stays valid until the next get().
+        """
+        self._new_frame.clear()
+        slot = self._take_slot()
+        while slot < 0:
+            if self.closed:
+                return None
+            if not self._new_frame.wait(timeout):
+                return None
+            self._new_frame.clear()
+            slot = self._take_slot()
+
+        seq = self.read_seq - 1
+        self.consumed += 1
+        self._space.set()
+        return seq, float(self.timestamps[slot]), self.frames[slot]
+
+    def close(self):
+        # end of stream, wakes up both sides
+        self.closed = True
+        self._new_frame.set()
+        self._space.set()
+
+    def stats(self):
+        return {
+            'captured': self.captured,
+            'consumed': self.consumed,
+            'dropped_capture': self.drops['capture'],
+            'dropped_detection': self.drops['detection'],
+        }
+
+
+def get_batch(rings, deadline):
+    """
+    Take one frame from each ring, waiting at most `deadline` seconds in total so a slow
+    camera cannot stall the others. Returns a list of (seq, timestamp, frame) or None per ring.
+    """
+    end = time.time() + deadline
+    batch = []
+    for ring in rings:
+        batch.append(ring.get(timeout=max(end - time.time(), 0.)))
+    return batch
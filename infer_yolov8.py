@@ -28,14 +28,293 @@ if str(ROOT / 'trackers' / 'strongsort') not in sys.path:
 
 ROOT = Path(os.path.relpath(ROOT, Path.cwd()))  # relative
 
-from ultralytics.yolo.data.dataloaders.stream_loaders import LoadPilAndNumpy
+from ultralytics.nn.autobackend import AutoBackend
+from ultralytics.yolo.data.augment import LetterBox
 from ultralytics.yolo.utils import LOGGER, SETTINGS, callbacks, colorstr, ops
 from ultralytics.yolo.utils.checks import check_file, check_imgsz, check_imshow, print_args, check_requirements
 from ultralytics.yolo.utils.files import increment_path
 from ultralytics.yolo.utils.ops import Profile, non_max_suppression, scale_boxes, process_mask, process_mask_native
 from ultralytics.yolo.utils.plotting import Annotator, colors, save_one_box
+from ultralytics.yolo.utils.torch_utils import select_device
 
 from trackers.multi_tracker_zoo import create_tracker
+from flow_counter import FlowCounter, entrance_lines
+from metrics import METRICS
+
+
+def observe_stages(dt):
+    # last preprocess, inference and NMS Profile times into the stage histograms
+    for stage, profile in zip(('preprocess', 'inference', 'nms'), dt):
+        METRICS.observe(stage, profile.dt)
+
+
+def instrument_tracker(tracker):
+    # ReID and camera motion run inside tracker.update, time them where the tracker calls them
+    for attr, method, stage in (('model', 'forward', 'reid'),  # StrongSORT, BoT-SORT
+                                ('embedder', 'forward', 'reid'),  # Deep OC-SORT
+                                ('gmc', 'apply', 'cmc'),  # BoT-SORT
+                                ('cmc', 'compute_affine', 'cmc')):  # Deep OC-SORT
+        obj = getattr(tracker, attr, None)
+        if obj is not None and hasattr(obj, method):
+            METRICS.wrap(obj, method, stage)
+
+
+class InferenceSession:
+    """
+    Detector + tracker state of one stream.
+
+    The model warmup, the tracker and the counting state are created once in __init__, so
+    calling step() once per frame only pays for preprocess, inference, NMS and tracking.
+    """
+
+    def __init__(self,
+                 model,
+                 stride,
+                 names,
+                 pt,
+                 reid_weights=WEIGHTS / 'osnet_x1_0_imagenet.pth',  # model.pt path,
+                 tracking_method='bytetrack',
+                 tracking_config=None,
+                 imgsz=(640, 640),  # inference size (height, width)
+                 conf_thres=0.25,  # confidence threshold
+                 iou_thres=0.45,  # NMS IOU threshold
+                 max_det=100,  # maximum detections per image
+                 device=0,  # cuda device, i.e. 0 or 0,1,2,3 or cpu
+                 classes=0,  # filter by class: --class 0, or --class 0 2 3
+                 agnostic_nms=False,  # class-agnostic NMS
+                 augment=False,  # augmented inference
+                 line_thickness=2,  # bounding box thickness (pixels)
+                 hide_labels=False,  # hide labels
+                 hide_conf=False,  # hide confidences
+                 hide_class=False,  # hide IDs
+                 half=True,  # use FP16 half-precision inference
+                 is_seg=False,
+                 video_fps=30,
+                 secs_interval=2,
+                 auto=True,  # minimum-rectangle letterbox, False pads to imgsz (needed for batching)
+                 draw=True  # draw the overlay in update(), False leaves it to render() on a consumer
+                 ):
+        self.model = model
+        self.stride, self.names, self.pt = stride, names, pt
+        self.tracking_method = tracking_method
+        self.imgsz = imgsz
+        self.conf_thres, self.iou_thres, self.max_det = conf_thres, iou_thres, max_det
+        self.device = device
+        self.classes, self.agnostic_nms, self.augment = classes, agnostic_nms, augment
+        self.line_thickness = line_thickness
+        self.hide_labels, self.hide_conf, self.hide_class = hide_labels, hide_conf, hide_class
+        self.half = half
+        self.is_seg = is_seg
+        self.video_fps, self.secs_interval = video_fps, secs_interval
+        self.draw = draw
+        self.overlay = None
+
+        # preprocessing, same as LoadPilAndNumpy but built only once
+        self.transforms = getattr(model.model, 'transforms', None)
+        self.letterbox = LetterBox(imgsz, auto=pt and auto, stride=stride)
+        model.warmup(imgsz=(1, 3, *imgsz))  # warmup
+
+        # one tracker for the whole stream
+        self.tracker = create_tracker(tracking_method, tracking_config, reid_weights, device, half)
+        if hasattr(self.tracker, 'model'):
+            if hasattr(self.tracker.model, 'warmup'):
+                self.tracker.model.warmup()
+        instrument_tracker(self.tracker)
+
+        self.dt = (Profile(), Profile(), Profile(), Profile())
+        self.prev_frame = None
+        self.seen = 0
+
+        # do_entrance_counting
+        self.counter = FlowCounter(video_fps, secs_interval)
+
+    def preprocess(self, im0):
+        if self.transforms:
+            im = self.transforms(im0)
+        else:
+            im = self.letterbox(image=im0)
+            im = im[..., ::-1].transpose((2, 0, 1))  # BGR to RGB, HWC to CHW
+            im = np.ascontiguousarray(im)  # contiguous
+        im = torch.from_numpy(im).to(self.device)
+        im = im.half() if self.half else im.float()  # uint8 to fp16/32
+        im /= 255.0  # 0 - 255 to 0.0 - 1.0
+        if len(im.shape) == 3:
+            im = im[None]  # expand for batch dim
+        return im
+
+    def nms(self, preds):
+        if self.is_seg:
+            preds = preds[0]
+        return non_max_suppression(preds, self.conf_thres, self.iou_thres, self.classes, self.agnostic_nms,
+                                   max_det=self.max_det)
+
+    @torch.no_grad()
+    def step(self, frame, entrance, region_type='both'):
+        """
+        Run detection, tracking and entrance counting on one BGR frame.
+        Returns the frame, annotated unless self.draw is False.
+        """
+        dt = self.dt
+        im0 = frame.copy()
+
+        with dt[0]:
+            im = self.preprocess(im0)
+
+        # Inference
+        with dt[1]:
+            # yolov8 predict
+            preds = self.model(im, augment=self.augment, visualize=False)
+
+        # Apply NMS
+        with dt[2]:
+            det = self.nms(preds)[0]
+        observe_stages(dt[:3])
+
+        return self.update(im0, det, im.shape[2:], entrance, region_type)
+
+    def update(self, im0, det, im_shape, entrance, region_type='both'):
+        """
+        Track and count the NMS output `det` of one frame.
+        `im_shape` is the (h, w) of the network input the boxes refer to.
+        Returns im0 with the overlay drawn into it, or untouched if self.draw is False; the
+        overlay data is kept in self.overlay for render().
+        """
+        dt = self.dt
+        self.seen += 1
+
+        if hasattr(self.tracker, 'tracker') and hasattr(self.tracker.tracker, 'camera_update'):
+            if self.prev_frame is not None:  # camera motion compensation
+                with METRICS.time('cmc'):
+                    self.tracker.tracker.camera_update(self.prev_frame, im0)
+
+        outputs, counts = np.zeros((0, 7)), None
+        if det is not None and len(det):
+            det[:, :4] = scale_boxes(im_shape, det[:, :4], im0.shape).round()  # rescale boxes to im0 size
+
+            # pass detections to tracker
+            with dt[3]:
+                outputs = self.tracker.update(det.cpu(), im0)
+            METRICS.observe('tracker', dt[3].dt)
+
+            if len(outputs) > 0:
+                # entrance counting, all tracks of this frame at once
+                with METRICS.time('counting'):
+                    self.counter.update(self.seen, outputs, entrance_lines(entrance, region_type))
+                counts = self.counter.snapshot()
+
+        self.prev_frame = im0
+        self.overlay = (outputs, counts, entrance, region_type)
+        if self.draw:
+            return self.render(im0, self.overlay)
+        return im0
+
+    def render(self, im0, overlay):
+        """Draw the tracks, counts and door lines of `overlay` (see update) into im0."""
+        with METRICS.time('draw'):
+            return self._render(im0, overlay)
+
+    def _render(self, im0, overlay):
+        outputs, counts, entrance, region_type = overlay
+        annotator = Annotator(im0, line_width=self.line_thickness, example=str(self.names))
+
+        # draw boxes for visualization
+        for output in outputs:
+            bbox = output[0:4]
+            id = int(output[4])
+            c = int(output[5])
+            conf = output[6]
+            bbox_w = output[2] - output[0]
+            bbox_h = output[3] - output[1]
+
+            label = None if self.hide_labels else (f'{id} {self.names[c]}' if self.hide_conf else \
+                (f'{id} {conf:.2f}' if self.hide_class else f'{id} {self.names[c]} {conf:.2f}'))
+            color = colors(c, True)
+            center_x = output[0] + bbox_w / 2.
+            center_y = output[1] + bbox_h / 2.
+            annotator.box_label(bbox, label, color=color)
+            annotator.circle((int(center_x), int(center_y)), radius=4, color=color)
+
+        if counts is not None:
+            annotator.record(counts)
+
+        # add lines to image
+        entrance_line = tuple(map(int, entrance))
+        try:
+            if region_type == "upper":
+                annotator.box_label(entrance_line[0:4], "DOOR1", color=(0, 0, 255))
+            elif region_type == "under":
+                annotator.box_label(entrance_line[4:8], "DOOR2", color=(255, 0, 0))
+            elif region_type == "both":
+                annotator.box_label(entrance_line[0:4], "DOOR1", color=(0, 0, 255))
+                annotator.box_label(entrance_line[4:8], "DOOR2", color=(255, 0, 0))
+        except:
+            pass
+
+        return annotator.result()
+
+    def log_speed(self):
+        # Print results
+        t = tuple(x.t / max(self.seen, 1) * 1E3 for x in self.dt)  # speeds per image
+        LOGGER.info(
+            f'Speed: %.1fms pre-process, %.1fms inference, %.1fms NMS, %.1fms {self.tracking_method} update per image at shape {(1, 3, *self.imgsz)}' % t)
+
+
+class MultiStreamSession:
+    """
+    Several streams sharing one detector. Frames of all streams are letterboxed to the same
+    shape and stacked into one batch, each stream keeps its own InferenceSession for tracking
+    and counting.
+
+    TensorRT engines must be exported with a batch size >= number of streams (or dynamic).
+    """
+
+    def __init__(self, model, stride, names, pt, n_streams, imgsz=(640, 640), **kwargs):
+        self.model = model
+        self.imgsz = imgsz
+        self.sessions = [InferenceSession(model, stride, names, pt, imgsz=imgsz, auto=False, **kwargs)
+                         for _ in range(n_streams)]
+        model.warmup(imgsz=(1 if pt or model.triton else n_streams, 3, *imgsz))  # warmup
+        self.dt = (Profile(), Profile(), Profile())
+        self.batches = 0
+
+    @torch.no_grad()
+    def step(self, frames, entrances, region_types):
+        """
+        `frames` holds one BGR frame per stream, None for streams that missed the batch deadline.
+        Returns the (annotated, see InferenceSession.draw) frames in the same order, None for skipped
+        streams.
+        """
+        dt = self.dt
+        idx = [i for i, frame in enumerate(frames) if frame is not None]
+        results = [None] * len(frames)
+        if not idx:
+            return results
+        im0s = [frames[i].copy() for i in idx]
+
+        with dt[0]:
+            im = torch.cat([self.sessions[i].preprocess(im0) for i, im0 in zip(idx, im0s)])
+
+        # Inference, one forward pass for every stream
+        with dt[1]:
+            preds = self.model(im, augment=self.sessions[0].augment, visualize=False)
+
+        # Apply NMS
+        with dt[2]:
+            p = self.sessions[0].nms(preds)
+        observe_stages(dt)  # per batch
+
+        for i, im0, det in zip(idx, im0s, p):
+            results[i] = self.sessions[i].update(im0, det, im.shape[2:], entrances[i], region_types[i])
+        self.batches += 1
+        return results
+
+    def log_speed(self):
+        t = tuple(x.t / max(self.batches, 1) * 1E3 for x in self.dt)  # speeds per batch
+        LOGGER.info(f'Speed: %.1fms pre-process, %.1fms inference, %.1fms NMS per batch of '
+                    f'{len(self.sessions)} streams at shape {(1, 3, *self.imgsz)}' % t)
+        for i, session in enumerate(self.sessions):
+            LOGGER.info(f'stream {i}: {session.seen} frames, '
+                        f'{session.dt[3].t / max(session.seen, 1) * 1E3:.1f}ms {session.tracking_method} update')
 
 
 @torch.no_grad()
@@ -50,329 +329,64 @@ def run(
         iou_thres=0.45,  # NMS IOU threshold
         max_det=100,  # maximum detections per image
         device=0,  # cuda device, i.e. 0 or 0,1,2,3 or cpu
-        show_vid=False,  # show results
-        save_txt=False,  # save results to *.txt
-        save_conf=False,  # save confidences in --save-txt labels
-        save_crop=False,  # save cropped prediction boxes
-        save_trajectories=False,  # save trajectories for each track
-        save_vid=False,  # save confidences in --save-txt labels
-        nosave=False,  # do not save images/videos
         classes=0,  # filter by class: --class 0, or --class 0 2 3
         agnostic_nms=False,  # class-agnostic NMS
         augment=False,  # augmented inference
-        visualize=False,  # visualize features
-        update=False,  # update all models
-        project=ROOT / 'runs' / 'track',  # save results to project/name
-        name='exp',  # save results to project/name
-        exist_ok=False,  # existing project/name ok, do not increment
         line_thickness=2,  # bounding box thickness (pixels)
         hide_labels=False,  # hide labels
         hide_conf=False,  # hide confidences
         hide_class=False,  # hide IDs
         half=True,  # use FP16 half-precision inference
         dnn=False,  # use OpenCV DNN for ONNX inference
-        vid_stride=1,  # video frame-rate stride
-        retina_masks=False,
         line1=125,
         line2=250,
         region_type='both',
-        do_entrance_counting=True,
-        exp_name='yolov8_infer',
         is_seg=False,
         model=None,
-        stride=None,
-        names=None,
-        pt=None,
-        tracker_list=[],
         entrance=None,
-        id_set=None,
-        interval_id_set=None,
-        in_id_list=None,
-        out_id_list=None,
-        prev_center=None,
-        records=None,
-        seen=0
-
+        **kwargs
 ):
-    source = source
-
-    # Dataloader
-    bs = 1
-
-    dataset = LoadPilAndNumpy(
-        im0=source,
-        imgsz=imgsz,
-        stride=stride,
-        auto=pt,
-        transforms=getattr(model.model, 'transforms', None))
-
-    vid_path, vid_writer, txt_path = [None] * bs, [None] * bs, [None] * bs
-    model.warmup(imgsz=(1 if pt or model.triton else bs, 3, *imgsz))  # warmup
-
-    # Create as many strong sort instances as there are video source
-    # tracker_list = []
-    for i in range(bs):
-        tracker = create_tracker(tracking_method, tracking_config, reid_weights, device, half)
-        tracker_list.append(tracker, )
-        if hasattr(tracker_list[i], 'model'):
-            if hasattr(tracker_list[i].model, 'warmup'):
-                tracker_list[i].model.warmup()
-
-    outputs = [None] * bs
-
-    # Run tracking
-    model.warmup(imgsz=(1 if pt else bs, 3, *imgsz))  # warmup
-    windows, dt = [], (Profile(), Profile(), Profile(), Profile())
-    curr_frames, prev_frames = [None] * bs, [None] * bs
-
-    for frame_num, batch in enumerate(dataset):
-        path, im, im0s, vid_cap, s = batch
-        visualize = False
-        with dt[0]:
-            im = torch.from_numpy(im).to(device)
-            im = im.half() if half else im.float()  # uint8 to fp16/32
-            im /= 255.0  # 0 - 255 to 0.0 - 1.0
-            if len(im.shape) == 3:
-                im = im[None]  # expand for batch dim
-
-        # Inference
-        with dt[1]:
-            # yolov8 predict
-            preds = model(im, augment=augment, visualize=visualize)
-
-        # Apply NMS
-        with dt[2]:
-            if is_seg:
-                masks = []
-                p = non_max_suppression(preds[0], conf_thres, iou_thres, classes, agnostic_nms, max_det=max_det)
-                # nc number of classes
-                proto = preds[1][-1]
-            else:
-                p = non_max_suppression(preds, conf_thres, iou_thres, classes, agnostic_nms, max_det=max_det)
-
-        # Process detections
-        for i, det in enumerate(p):  # detections per image
-            seen += 1
-
-            # p is a fake path
-            p, im0, _ = path, im0s.copy(), getattr(dataset, 'frame', 0)
-            # p = Path(p)  # to Path
-
-            curr_frames[i] = im0
-
-            s += '%gx%g ' % im.shape[2:]  # print string
-            imc = im0.copy() if save_crop else im0  # for save_crop
-
-            annotator = Annotator(im0[0], line_width=line_thickness, example=str(names))
-
-            if hasattr(tracker_list[i], 'tracker') and hasattr(tracker_list[i].tracker, 'camera_update'):
-                if prev_frames[i] is not None and curr_frames[i] is not None:  # camera motion compensation
-                    tracker_list[i].tracker.camera_update(prev_frames[i], curr_frames[i])
-
-            if det is not None and len(det):
-                det[:, :4] = scale_boxes(im.shape[2:], det[:, :4], im0[0].shape).round()  # rescale boxes to im0 size
-
-                # Print results
-                for c in det[:, 5].unique():
-                    n = (det[:, 5] == c).sum()  # detections per class
-                    s += f"{n} {names[int(c)]}{'s' * (n > 1)}, "  # add to string
-
-                # pass detections to strongsort
-                with dt[3]:
-                    outputs[i] = tracker_list[i].update(det.cpu(), im0)
-
-                # draw boxes for visualization
-                if len(outputs[i]) > 0:
-                    # print(outputs[i]) # ONLY WHEN PERSON DETECTED
-
-                    for j, (output) in enumerate(outputs[i]):
-                        bbox = output[0:4]
-                        id = output[4]
-                        cls = output[5]
-                        conf = output[6]
-
-                        # to MOT format
-                        bbox_left = output[0]
-                        bbox_top = output[1]
-                        bbox_w = output[2] - output[0]
-                        bbox_h = output[3] - output[1]
-                        tlwh = [bbox_left, bbox_top, bbox_w, bbox_h]
-
-                    # add annotator -> info to image
-                    if True:  # Add bbox/seg to image
-                        c = int(cls)  # integer class
-                        id = int(id)  # integer id
-                        label = None if hide_labels else (f'{id} {names[c]}' if hide_conf else \
-                                                              (
-                                                                  f'{id} {conf:.2f}' if hide_class else f'{id} {names[c]} {conf:.2f}'))
-                        color = colors(c, True)
-                        center_x = bbox_left + bbox_w / 2.
-                        center_y = bbox_top + bbox_h / 2.
-                        annotator.box_label(bbox, label, color=color)
-                        annotator.circle((int(center_x), int(center_y)), radius=4, color=color)
-
-                        # MOT results
-                        tlwh_mot = [tlwh]
-                        conf_mot = [conf]
-                        id_mot = [id]
-                        mot_result = [seen + 1, tlwh_mot, conf_mot, id_mot]
-                        # entrance counting
-                        statistic = human_flow_counting(True,
-                                                        mot_result,
-                                                        entrance,
-                                                        region_type,
-                                                        id_set,
-                                                        interval_id_set,
-                                                        in_id_list,
-                                                        out_id_list,
-                                                        prev_center,
-                                                        records,
-                                                        30,
-                                                        2
-                                                        )
-                        records = statistic['records']
-                        annotator.record(records)
-            else:
-                pass
-                # tracker_list[i].tracker.pred_n_update_all_tracks()
-
-            # add lines to image
-            entrance_line = tuple(map(int, entrance))
-            try:
-                if region_type == "upper" :
-                    annotator.box_label(entrance_line[0:4], "DOOR1", color=(0, 0, 255))
-                elif region_type == "under":
-                    annotator.box_label(entrance_line[4:8], "DOOR2", color=(255, 0, 0))
-                elif region_type == "both":
-                    annotator.box_label(entrance_line[0:4], "DOOR1", color=(0, 0, 255))
-                    annotator.box_label(entrance_line[4:8], "DOOR2", color=(255, 0, 0))
-            except:
-                pass
-
-            # Stream results
-            im0 = annotator.result()
-
-            prev_frames[i] = curr_frames[i]
-
-    # Print detection results:
-    # Print results
-    t = tuple(x.t / 1 * 1E3 for x in dt)  # speeds per image
-    # Print total time (preprocessing + inference + NMS + tracking)
-    LOGGER.info(
-        f"{s}{'' if len(det) else '(no detections), '}{sum([dt.dt for dt in dt if hasattr(dt, 'dt')]) * 1E3:.1f}ms")
-    LOGGER.info(
-        f'Speed: %.1fms pre-process, %.1fms inference, %.1fms NMS, %.1fms {tracking_method} update per image at shape {(1, 3, *imgsz)}' % t)
-
+    """
+    One-shot inference on a single frame. Streams should keep an InferenceSession instead,
+    this builds (and warms up) a new one on every call.
+    """
+    if isinstance(source, (str, Path)):
+        source = cv2.imread(str(source))
+
+    # Load model
+    if model is None:
+        device = select_device(device)
+        is_seg = '-seg' in str(yolo_weights)
+        model = AutoBackend(yolo_weights, device=device, dnn=dnn, fp16=half)
+    imgsz = check_imgsz(imgsz, stride=model.stride)  # check image size
+
+    if entrance is None:
+        w_img = source.shape[1]
+        entrance = [0, int(line1), w_img, int(line1), 0, int(line2), w_img, int(line2)]
+
+    session = InferenceSession(model, model.stride, model.names, model.pt,
+                               reid_weights=reid_weights,
+                               tracking_method=tracking_method,
+                               tracking_config=tracking_config,
+                               imgsz=imgsz,
+                               conf_thres=conf_thres,
+                               iou_thres=iou_thres,
+                               max_det=max_det,
+                               device=device,
+                               classes=classes,
+                               agnostic_nms=agnostic_nms,
+                               augment=augment,
+                               line_thickness=line_thickness,
+                               hide_labels=hide_labels,
+                               hide_conf=hide_conf,
+                               hide_class=hide_class,
+                               half=half,
+                               is_seg=is_seg)
+    im0 = session.step(source, entrance, region_type)
+    session.log_speed()
     return im0
 
 
-def human_flow_counting(do_entrance_counting,
-                        result,
-                        entrance,
-                        region_type,
-                        id_set,
-                        interval_id_set,
-                        in_id_list,
-                        out_id_list,
-                        prev_center,
-                        records,
-                        video_fps,
-                        secs_interval
-                        ):
-    # Count in/out number:
-    if do_entrance_counting:
-        assert region_type in [
-            'both', "upper", "under", 'close'
-        ], "region_type should be 'horizontal' or 'vertical' or 'custom_1' or 'custom_2' when do entrance counting."
-
-        # test
-        # print(f"Test:{region_type} && {entrance}")
-
-        if region_type == 'upper':
-            entrance_x, entrance_y = entrance[0], entrance[1]
-        elif region_type == 'under':
-            entrance_x, entrance_y = entrance[4], entrance[5]
-        else:
-            entrance_x1, entrance_y1 = entrance[0], entrance[1]
-            entrance_x2, entrance_y2 = entrance[4], entrance[5]
-
-        # print(entrance_x, entrance_y)
-        frame_id, tlwhs, tscores, track_ids = result
-        for tlwh, score, track_id in zip(tlwhs, tscores, track_ids):
-            if track_id < 0: continue
-            x1, y1, w, h = tlwh
-            center_x = x1 + w / 2.
-            center_y = y1 + h / 2.
-            if track_id in prev_center:
-                if region_type == 'under':
-                    if prev_center[track_id][1] >= entrance_y and \
-                            center_y < entrance_y:
-                        in_id_list.append(track_id)
-                    if prev_center[track_id][1] <= entrance_y and \
-                            center_y > entrance_y:
-                        out_id_list.append(track_id)
-                elif region_type == 'upper':
-                    if prev_center[track_id][1] <= entrance_y and \
-                            center_y > entrance_y:
-                        in_id_list.append(track_id)
-                    if prev_center[track_id][1] >= entrance_y and \
-                            center_y < entrance_y:
-                        out_id_list.append(track_id)
-                elif region_type == 'both':
-                    # horizontal customized center lines
-                    # print(entrance_x1, entrance_y1,entrance_x2, entrance_y2)
-                    if prev_center[track_id][1] <= entrance_y1 and \
-                            center_y > entrance_y1:
-                        in_id_list.append(track_id)
-                    if prev_center[track_id][1] >= entrance_y1 and \
-                            center_y < entrance_y1:
-                        out_id_list.append(track_id)
-                    if prev_center[track_id][1] <= entrance_y2 and \
-                            center_y > entrance_y2:
-                        out_id_list.append(track_id)
-                    if prev_center[track_id][1] >= entrance_y2 and \
-                            center_y < entrance_y2:
-                        in_id_list.append(track_id)
-                else:
-                    continue
-                prev_center[track_id][0] = center_x
-                prev_center[track_id][1] = center_y
-            else:
-                prev_center[track_id] = [center_x, center_y]
-
-        # Count totol number, number at a manual-setting interval
-        frame_id, tlwhs, tscores, track_ids = result
-        for tlwh, score, track_id in zip(tlwhs, tscores, track_ids):
-            if track_id < 0: continue
-            id_set.add(track_id)
-            interval_id_set.add(track_id)
-
-        # Reset counting at the interval beginning
-        if frame_id % video_fps == 0 and frame_id / video_fps % secs_interval == 0:
-            curr_interval_count = len(interval_id_set)
-            interval_id_set.clear()
-        info = "Frame id: {}, Total count: {}".format(frame_id, len(id_set))
-        if do_entrance_counting:
-            info += ", In count: {}, Out count: {}".format(
-                len(in_id_list), len(out_id_list))
-        if frame_id % video_fps == 0 and frame_id / video_fps % secs_interval == 0:
-            info += ", Count during {} secs: {}".format(secs_interval,
-                                                        curr_interval_count)
-            interval_id_set.clear()
-        # print(info)
-        info += "\n"
-        records.append(info)
-
-        return {
-            "id_set": id_set,
-            "interval_id_set": interval_id_set,
-            "in_id_list": in_id_list,
-            "out_id_list": out_id_list,
-            "prev_center": prev_center,
-            "records": records,
-        }
-
-
 def parse_opt():
     parser = argparse.ArgumentParser()
     parser.add_argument('--yolo-weights', nargs='+', type=Path, default=WEIGHTS / 'YOLOv8_best.engine',
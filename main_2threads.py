@@ -5,9 +5,7 @@ Allowed two threads
     -> 2. Detection
 """
 import argparse
-import json
 import os
-import platform
 import time
 
 import cv2
@@ -18,6 +16,11 @@ import tkinter as tk
 import sys
 from PyQt5.QtWidgets import QApplication, QWidget, QVBoxLayout, QLabel
 from util_opt import parse_opt, print_arguments
+from frame_buffer import FrameRingBuffer, get_batch
+from region_config import get_region_config
+from video_writer import AsyncVideoWriter
+from display import DisplayThread
+from metrics import METRICS
 
 FILE = Path(__file__).resolve()
 ROOT = FILE.parents[0]  # yolov5 strongsort root directory
@@ -38,37 +41,82 @@ from ultralytics.yolo.utils.checks import check_imgsz
 from ultralytics.nn.autobackend import AutoBackend
 
 
+def build_entrance(region_type, region_line1, region_line2, w_img):
+    if region_type == 'both':
+        return [0, region_line1, w_img, region_line1, 0, region_line2, w_img, region_line2]
+    elif region_type == 'upper':
+        return [0, region_line1, w_img, region_line1]
+    elif region_type == 'under':
+        return [0, 0, 0, 0, 0, region_line2, w_img, region_line2]
+    elif region_type == 'close':
+        return [0, 0, 0, 0, 0, 0, 0, 0]
+    else:
+        raise ValueError("region_type:{} unsupported.".format(
+            region_type))
+
+
+def open_writer(args, path, render=None):
+    return AsyncVideoWriter(path, args.vid_fourcc, 30.0, (1920, 1080),
+                            queue_size=args.vid_queue,
+                            drop=not args.vid_nodrop,
+                            segment_secs=args.vid_segment or None,
+                            render=render)
+
+
+def draw_fps(frame, fps):
+    cv2.putText(frame, f'FPS: {fps:.2f}', (frame.shape[1] - 180, 30), cv2.FONT_HERSHEY_SIMPLEX, 1,
+                (0, 0, 255), 2)
+    return frame
+
+
 class CameraThread(threading.Thread):
 
-    def __init__(self, args):
+    def __init__(self, args, ring, source=None):
         threading.Thread.__init__(self)
-        print(f"camera {args.source}")
-        self.source = args.source  # file/dir/URL/glob, 0 for webcam
+        self.source = args.source if source is None else source  # file/dir/URL/glob, 0 for webcam
+        print(f"camera {self.source}")
         #self.source = 'test_videos/4.mp4'
         self.cap = cv2.VideoCapture(self.source)
-
+        self.ring = ring
 
         self.stop_thread = False
 
     def run(self):
         while not self.stop_thread:
-            ret, frame = self.cap.read()
-            if ret:
-                DetectionThread.frame = frame.copy()
+            slot = self.ring.claim(timeout=1.0)
+            if slot is None:
+                if self.ring.frames is not None:  # no free slot (nodrop), try again
+                    continue
+                # first frame, allocate the ring with its shape
+                ret, frame = self.cap.read()
+                if ret:
+                    self.ring.put(frame)
             else:
-                DetectionThread.frame = None
+                # decode straight into the preallocated slot
+                with METRICS.time('capture'):
+                    ret, frame = self.cap.read(slot)
+                if ret and frame is slot:
+                    self.ring.publish()
+                else:
+                    self.ring.cancel()
+                    if ret:  # resolution changed
+                        self.ring.put(frame)
+            if not ret:
+                # end of stream or camera error
+                self.ring.close()
+                break
+        self.cap.release()
 
     def stop(self):
-        self.cap.release
         self.stop_thread = True
+        self.ring.close()
 
 
 class DetectionThread(threading.Thread):
-    frame = None
-    frame_num = 0
 
-    def __init__(self, args):
+    def __init__(self, args, ring):
         threading.Thread.__init__(self)
+        self.ring = ring
 
         self.stop_thread = False
         # Load a model
@@ -87,130 +135,231 @@ class DetectionThread(threading.Thread):
         self.model = AutoBackend(self.model, device=device, dnn=False, fp16=True)
         self.stride, self.names, self.pt = self.model.stride, self.model.names, self.model.pt
         self.imgsz = check_imgsz(self.imgsz, stride=self.stride)  # check image size
-        self.tracker_list = []
-
-        # entrance count
-        self.entrance, self.records, self.center_traj = None, None, None
-
-
-
-        # do_entrance_counting
-        self.id_set = set()
-        self.interval_id_set = set()
-        self.in_id_list = list()
-        self.out_id_list = list()
-        self.prev_center = dict()
-        self.records = list()
 
+        # entrance count, rebuilt only when the region settings change
+        self.entrance = None
+        self.region = get_region_config()
+        self.region_version = -1
+        self.region_type = None
+        self.entrance_width = None
+
+        # detector, tracker and counting state live for the whole stream
+        self.session = infer_yolov8.InferenceSession(self.model, self.stride, self.names, self.pt,
+                                                     reid_weights=self.tracker,
+                                                     tracking_method=self.tracking_method,
+                                                     tracking_config=self.tracking_config,
+                                                     imgsz=self.imgsz,
+                                                     device=device,
+                                                     is_seg=self.is_seg,
+                                                     draw=False)
 
         # time and FPS
         self.start_time = time.time()
         self.frames = 0
 
-        # save video
-        self.save_vid = True
-        # Define the codec and create VideoWriter object
-        fourcc = cv2.VideoWriter_fourcc(*'XVID')
-        self.out = cv2.VideoWriter(args.out_dir, fourcc, 30.0, (1920, 1080))
+        # headless: no window and no overlay, only tracking and counting run
+        self.headless = args.headless
+        self.display = None
+        if not self.headless:
+            self.display = DisplayThread(render=self.render, on_quit=stop_program)
+            self.display.start()
+
+        # save video, drawn and encoded on the writer thread
+        self.save_vid = not args.nosave
+        self.out = open_writer(args, args.out_dir, render=None if self.headless else self.render)
+
+    def render(self, frame, overlay, fps):
+        # on the display / writer thread, into a copy: the session keeps the frame for camera motion
+        return draw_fps(self.session.render(frame.copy(), overlay), fps)
 
     def run(self):
         while not self.stop_thread:
-            start_runtime = time.time()
-            with open('region_setting.json') as file:
-                data = json.load(file)
-            region_type = data['type']
-            region_line1 = int(data['number1'])
-            region_line2 = int(data['number2'])
-
-            if DetectionThread.frame is not None:
-                h, w_img, c = DetectionThread.frame.shape
-            else:
-                w_img = 4000
-
-            if region_type == 'both':
-                self.entrance = [0, region_line1, w_img, region_line1, 0, region_line2, w_img,
-                                 region_line2]
-            elif region_type == 'upper':
-                self.entrance = [0, region_line1, w_img, region_line1]
-            elif region_type == 'under':
-                self.entrance = [0, 0, 0, 0, 0, region_line2, w_img, region_line2]
-            elif region_type == 'close':
-                self.entrance = [0, 0, 0, 0, 0, 0, 0, 0]
-            else:
-                raise ValueError("region_type:{} unsupported.".format(
-                    region_type))
-
-            if DetectionThread.frame is not None:
-                frame = infer_yolov8.run(source=DetectionThread.frame, yolo_weights=self.model,
-                                         reid_weights=self.tracker,
-                                         tracking_method=self.tracking_method,
-                                         tracking_config=self.tracking_config,
-                                         exp_name='yolov8_infer',
-                                         imgsz=self.imgsz,
-                                         is_seg=self.is_seg,
-                                         model=self.model,
-                                         stride=self.stride,
-                                         names=self.names,
-                                         pt=self.pt,
-                                         tracker_list=self.tracker_list,
-                                         entrance=self.entrance,
-                                         id_set=self.id_set,
-                                         interval_id_set=self.interval_id_set,
-                                         in_id_list=self.in_id_list,
-                                         out_id_list=self.out_id_list,
-                                         prev_center=self.prev_center,
-                                         records=self.records,
-                                         seen=self.frames,
-                                         region_type=region_type,
-                                         )
-
-                if platform.system() == 'Linux':  # allow window resize (Linux)
-                    cv2.namedWindow('Detection', cv2.WINDOW_NORMAL | cv2.WINDOW_KEEPRATIO)
-                    cv2.resizeWindow('Detection', frame.shape[1], frame.shape[0])
-
-                # add FPS
-                self.frames += 1
-                elapsed_time = time.time() - start_runtime
-                fps = 1 / elapsed_time
-
-                cv2.putText(frame, f'FPS: {fps:.2f}', (frame.shape[1] - 180, 30), cv2.FONT_HERSHEY_SIMPLEX, 1,
-                            (0, 0, 255), 2)
-
-                if self.save_vid:
-                    # write the flipped frame
-                    frame_resize = cv2.resize(frame, (1920, 1080))
-                    self.out.write(frame_resize)
-                    #pass
-
-
-                # display frame
-                cv2.imshow('Detection', frame)
-                if cv2.waitKey(1) == ord('q'):  # 1 millisecond
-                    self.out.release()
-                    stop_program()
-                    break
-                # DetectionThread.frame = None
-            else:
+            item = self.ring.get(timeout=1.0)
+            if item is None:
+                if not self.ring.closed:
+                    continue
+                # camera stopped
                 self.out.release()
                 self.stop_thread = True
-                cv2.destroyAllWindows()
                 stop_program()
                 break
+            seq, capture_time, source_frame = item
+
+            start_runtime = time.time()
+            h, w_img, c = source_frame.shape
+            if self.region.version != self.region_version or w_img != self.entrance_width:
+                self.region_version, data = self.region.snapshot()
+                self.region_type = data['type']
+                self.entrance = build_entrance(self.region_type, int(data['number1']), int(data['number2']), w_img)
+                self.entrance_width = w_img
+
+            # raw frame, the overlay is only drawn by the consumers that use it
+            frame = self.session.step(source_frame, self.entrance, self.region_type)
+            overlay = self.session.overlay
+
+            # add FPS
+            self.frames += 1
+            elapsed_time = time.time() - start_runtime
+            fps = 1 / elapsed_time
+
+            if self.save_vid:
+                # queued, drawn and resized to 1920x1080 on the writer thread
+                self.out.write(frame, overlay, fps)
+
+            # display frame, 'q' in the window stops the program
+            if self.display is not None:
+                self.display.submit('Detection', frame, overlay, fps)
 
         return
 
     def stop(self):
         self.stop_thread = True
         self.out.release()
-        cv2.destroyAllWindows()
+        if self.display is not None:
+            self.display.stop()
         # save predicted video
         print(f'Running time: {time.time() - self.start_time}; Detected frames: {self.frames};')
+        print(f'Frame buffer: {self.ring.stats()}')
+        print(f'Video writer: {self.out.stats()}')
+        if self.display is not None:
+            print(f'Display: {self.display.stats()}')
+        self.session.log_speed()
+        print(METRICS.format())
 
         # exit the main process
         # print('Exiting...')
         # os._exit(os.EX_OK)
 
 
+class CameraGroup(object):
+    # start/stop/join several CameraThreads like a single one
+
+    def __init__(self, threads):
+        self.threads = threads
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        for thread in self.threads:
+            thread.stop()
+
+    def join(self):
+        for thread in self.threads:
+            thread.join()
+
+
+class MultiDetectionThread(threading.Thread):
+    """
+    Detection for several cameras with one model: one frame per camera is batched into a
+    single forward pass, tracking and counting stay per camera.
+    """
+
+    def __init__(self, args, rings):
+        threading.Thread.__init__(self)
+        self.rings = rings
+        self.stop_thread = False
+        self.batch_deadline = args.batch_deadline / 1000.  # ms -> s
+
+        # entrance count, rebuilt only when the region settings change
+        self.region = get_region_config()
+        self.region_version = -1
+        self.region_data = None
+        self.region_type = None
+        self.entrances = [None] * len(rings)
+        self.entrance_widths = [None] * len(rings)
+
+        device = select_device(args.device)
+        self.is_seg = '-seg' in str(args.yolo_weights)
+        self.model = AutoBackend(args.yolo_weights, device=device, dnn=False, fp16=True)
+        self.imgsz = check_imgsz(args.imgsz, stride=self.model.stride)  # check image size
+        self.session = infer_yolov8.MultiStreamSession(self.model, self.model.stride, self.model.names, self.model.pt,
+                                                       len(rings),
+                                                       imgsz=self.imgsz,
+                                                       reid_weights=args.reid_weights,
+                                                       tracking_method=args.tracking_method,
+                                                       tracking_config=args.tracking_config,
+                                                       device=device,
+                                                       is_seg=self.is_seg,
+                                                       draw=False)
+
+        # time and FPS
+        self.start_time = time.time()
+        self.frames = [0] * len(rings)
+
+        # headless: no window and no overlay, only tracking and counting run
+        self.headless = args.headless
+        self.display = None
+        if not self.headless:
+            self.display = DisplayThread(render=self.render, on_quit=stop_program)
+            self.display.start()
+
+        # save video, one file and writer thread per camera
+        self.save_vid = not args.nosave
+        out_dir = Path(args.out_dir)
+        self.out = [open_writer(args, out_dir.with_name(f'{out_dir.stem}_{i}{out_dir.suffix}'),
+                                render=None if self.headless else self.render)
+                    for i in range(len(rings))]
+
+    def render(self, frame, stream, overlay, fps):
+        # on the display / writer threads, into a copy: the session keeps the frame for camera motion
+        return draw_fps(self.session.sessions[stream].render(frame.copy(), overlay), fps)
+
+    def run(self):
+        while not self.stop_thread:
+            if all(ring.closed for ring in self.rings):
+                # every camera stopped
+                stop_program()
+                break
+            batch = get_batch(self.rings, self.batch_deadline)
+            frames = [item[2] if item is not None else None for item in batch]
+            if all(frame is None for frame in frames):
+                continue
+
+            start_runtime = time.time()
+            if self.region.version != self.region_version:
+                self.region_version, self.region_data = self.region.snapshot()
+                self.region_type = self.region_data['type']
+                self.entrance_widths = [None] * len(self.rings)
+            for i, frame in enumerate(frames):
+                if frame is not None and frame.shape[1] != self.entrance_widths[i]:
+                    data = self.region_data
+                    self.entrances[i] = build_entrance(self.region_type, int(data['number1']), int(data['number2']),
+                                                       frame.shape[1])
+                    self.entrance_widths[i] = frame.shape[1]
+
+            results = self.session.step(frames, self.entrances, [self.region_type] * len(frames))
+
+            elapsed_time = time.time() - start_runtime
+            fps = 1 / elapsed_time
+            for i, frame in enumerate(results):
+                if frame is None:
+                    continue
+                self.frames[i] += 1
+                overlay = self.session.sessions[i].overlay
+                if self.save_vid:
+                    self.out[i].write(frame, i, overlay, fps)
+                if self.display is not None:
+                    self.display.submit(f'Detection {i}', frame, i, overlay, fps)
+
+        return
+
+    def stop(self):
+        self.stop_thread = True
+        for out in self.out:
+            out.release()
+        if self.display is not None:
+            self.display.stop()
+            print(f'Display: {self.display.stats()}')
+        print(f'Running time: {time.time() - self.start_time}; Detected frames: {self.frames};')
+        for i, ring in enumerate(self.rings):
+            print(f'Frame buffer {i}: {ring.stats()}')
+            print(f'Video writer {i}: {self.out[i].stats()}')
+        self.session.log_speed()
+        print(METRICS.format())
+
+
 def start_program():
     global camera_thread
     global detection_thread
@@ -220,11 +369,14 @@ def start_program():
     opt.yolo_weights = 'weights/yolov8n.engine'
     opt.out_dir = 'runs/yolov8n_engine_true.avi'
 
+    start_metrics(opt)
+
     # Code to start the program goes here
-    camera_thread = CameraThread(opt)
+    ring = FrameRingBuffer(opt.buffer_size, opt.buffer_mode)
+    camera_thread = CameraThread(opt, ring)
     camera_thread.start()
 
-    detection_thread = DetectionThread(opt)
+    detection_thread = DetectionThread(opt, ring)
     detection_thread.start()
 
     camera_thread.join()
@@ -237,20 +389,55 @@ def start_video():
     # parse params from command
     opt = parse_opt()
     opt.source = 'test_videos/2.mp4'
+    opt.buffer_mode = 'nodrop'  # replay every frame of the file
+    opt.vid_nodrop = True
     # opt.yolo_weights = 'weights/yolov5mu.pt'
     # opt.out_dir = 'runs/yolov5mu_pt.avi'
 
+    start_metrics(opt)
+
     # Code to start the program goes here
-    camera_thread = CameraThread(opt)
+    ring = FrameRingBuffer(opt.buffer_size, opt.buffer_mode)
+    camera_thread = CameraThread(opt, ring)
     camera_thread.start()
 
-    detection_thread = DetectionThread(opt)
+    detection_thread = DetectionThread(opt, ring)
     detection_thread.start()
 
     camera_thread.join()
     detection_thread.join()
     pass
 
+def start_multi_program():
+    global camera_thread
+    global detection_thread
+    # parse params from command
+    opt = parse_opt()
+
+    start_metrics(opt)
+
+    # Code to start the program goes here
+    sources = [int(s) if str(s).isnumeric() else s for s in opt.sources]  # webcam ids
+    rings = [FrameRingBuffer(opt.buffer_size, opt.buffer_mode) for _ in sources]
+    camera_threads = [CameraThread(opt, ring, source) for ring, source in zip(rings, sources)]
+    camera_thread = CameraGroup(camera_threads)
+    camera_thread.start()
+
+    detection_thread = MultiDetectionThread(opt, rings)
+    detection_thread.start()
+
+    camera_thread.join()
+    detection_thread.join()
+    pass
+
+def start_metrics(opt):
+    # exporters run once per process, the histograms keep accumulating across restarts
+    if opt.metrics_port:
+        METRICS.serve(opt.metrics_port)
+    if opt.metrics_json:
+        METRICS.start_dump(opt.metrics_json, opt.metrics_interval)
+
+
 def stop_program():
     # Code to stop the program goes here
     camera_thread.stop()
@@ -288,6 +475,10 @@ if __name__ == '__main__':
     video_button.pack(pady=5)
 
 
+    # Add the multi camera button
+    multi_button = tk.Button(window, text="Start Multi Camera", command=start_multi_program)
+    multi_button.pack(pady=5)
+
     # Add the stop button
     stop_button = tk.Button(window, text="Stop Program", command=stop_program)
     stop_button.pack(pady=5)
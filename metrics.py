@@ -0,0 +1,241 @@
+"""
+Per-stage latency histograms of the pipeline.
+
+Every stage (capture, preprocess, inference, nms, tracker, reid, cmc, counting, draw, encode)
+records one duration per frame into a log-linear histogram in the style of HdrHistogram:
+32 linear sub-buckets per power of two of microseconds, so any percentile is within ~3% of the
+recorded value at a fixed memory cost, however long the pipeline runs.
+
+    from metrics import METRICS
+    with METRICS.time('inference'):
+        ...
+    METRICS.observe('nms', dt)          # seconds
+    METRICS.serve(9100)                 # http://127.0.0.1:9100/metrics, Prometheus text format
+    METRICS.start_dump('runs/metrics.json', interval=60)
+"""
+import json
+import os
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STAGES = ('capture', 'preprocess', 'inference', 'nms', 'tracker', 'reid', 'cmc', 'counting', 'draw', 'encode')
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Histogram(object):
+
+    def __init__(self, sub_bits=5, max_seconds=3600.):
+        self.sub_bits = sub_bits
+        self.sub_count = 1 << sub_bits
+        max_value = int(max_seconds * 1E6)
+        self.max_index = self._index(max_value)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def _index(self, v):
+        # v in [0, 2 * sub_count): linear, above: sub_count buckets per power of two
+        e = max(v.bit_length() - self.sub_bits - 1, 0)
+        return e * self.sub_count + (v >> e)
+
+    def _value(self, index):
+        # middle of the bucket, in seconds
+        e = max(index // self.sub_count - 1, 0)
+        m = index - e * self.sub_count
+        return ((m << e) + ((1 << e) - 1) / 2.) / 1E6
+
+    def reset(self):
+        with self._lock:
+            self.counts = [0] * (self.max_index + 1)
+            self.count = 0
+            self.sum = 0.
+            self.min = float('inf')
+            self.max = 0.
+
+    def record(self, seconds):
+        index = min(self._index(max(int(seconds * 1E6), 0)), self.max_index)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += seconds
+            if seconds < self.min:
+                self.min = seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def percentiles(self, quantiles=QUANTILES):
+        with self._lock:
+            counts, count = list(self.counts), self.count
+        if not count:
+            return [0.] * len(quantiles)
+        targets = [max(int(q * count + 0.5), 1) for q in quantiles]  # rank of each quantile
+        result = [None] * len(quantiles)
+        seen = 0
+        for index, n in enumerate(counts):
+            if not n:
+                continue
+            seen += n
+            for i, target in enumerate(targets):
+                if result[i] is None and seen >= target:
+                    result[i] = min(self._value(index), self.max)
+            if all(r is not None for r in result):
+                break
+        return result
+
+    def summary(self):
+        p50, p95, p99 = self.percentiles((0.5, 0.95, 0.99))
+        return {
+            'count': self.count,
+            'mean': self.sum / self.count if self.count else 0.,
+            'min': self.min if self.count else 0.,
+            'p50': p50,
+            'p95': p95,
+            'p99': p99,
+            'max': self.max,
+        }
+
+
+class _Timer(object):
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.dt = time.perf_counter() - self.start
+        self.histogram.record(self.dt)
+
+
+class Metrics(object):
+
+    def __init__(self, prefix='apm'):
+        self.prefix = prefix
+        self.histograms = {stage: Histogram() for stage in STAGES}
+        self._lock = threading.Lock()
+        self._server = None
+        self._dump_thread = None
+        self.start_time = time.time()
+
+    def histogram(self, stage):
+        h = self.histograms.get(stage)
+        if h is None:
+            with self._lock:
+                h = self.histograms.setdefault(stage, Histogram())
+        return h
+
+    def observe(self, stage, seconds):
+        self.histogram(stage).record(seconds)
+
+    def time(self, stage):
+        return _Timer(self.histogram(stage))
+
+    def wrap(self, obj, method, stage):
+        """Time every call of obj.method (instance attribute, the class is not touched)."""
+        fn = getattr(obj, method)
+        if getattr(fn, '_metrics_stage', None) is not None:
+            return
+        h = self.histogram(stage)
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                h.record(time.perf_counter() - start)
+
+        timed._metrics_stage = stage
+        object.__setattr__(obj, method, timed)
+
+    def reset(self):
+        for h in list(self.histograms.values()):
+            h.reset()
+        self.start_time = time.time()
+
+    def snapshot(self):
+        return {
+            'time': time.time(),
+            'uptime': time.time() - self.start_time,
+            'stages': {stage: h.summary() for stage, h in list(self.histograms.items()) if h.count},
+        }
+
+    def prometheus(self):
+        # summary metric, quantiles in seconds
+        name = f'{self.prefix}_stage_seconds'
+        lines = [f'# HELP {name} Per-frame latency of each pipeline stage.', f'# TYPE {name} summary']
+        for stage, h in list(self.histograms.items()):
+            if not h.count:
+                continue
+            for q, v in zip(QUANTILES, h.percentiles(QUANTILES)):
+                lines.append(f'{name}{{stage="{stage}",quantile="{q}"}} {v:.6f}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {h.sum:.6f}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {h.count}')
+        return '\n'.join(lines) + '\n'
+
+    def format(self):
+        lines = [f"{'stage':>10} {'count':>8} {'mean':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}  (ms)"]
+        for stage, s in self.snapshot()['stages'].items():
+            lines.append(f"{stage:>10} {s['count']:8d} " +
+                         ' '.join(f'{s[k] * 1E3:8.2f}' for k in ('mean', 'p50', 'p95', 'p99', 'max')))
+        return '\n'.join(lines)
+
+    def dump(self, path):
+        # temp file + rename, a reader never sees a partial file
+        path = os.path.abspath(path)
+        fd, tmp = tempfile.mkstemp(prefix='.metrics.', dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self.snapshot(), f, indent=1)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def start_dump(self, path, interval=60.):
+        if self._dump_thread is not None:
+            return
+
+        def run():
+            while True:
+                time.sleep(interval)
+                self.dump(path)
+
+        self._dump_thread = threading.Thread(target=run, name='metrics-dump', daemon=True)
+        self._dump_thread.start()
+
+    def serve(self, port=9100, host='127.0.0.1'):
+        """Serve /metrics (Prometheus text) and /metrics.json on a daemon thread."""
+        if self._server is not None:
+            return self._server
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == '/metrics':
+                    body, ctype = metrics.prometheus(), 'text/plain; version=0.0.4'
+                elif self.path == '/metrics.json':
+                    body, ctype = json.dumps(metrics.snapshot()), 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+                body = body.encode()
+                self.send_response(200)
+                self.send_header('Content-Type', ctype)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # no access log on stderr
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name='metrics-http', daemon=True).start()
+        return self._server
+
+
+# process-wide registry, every stage records here
+METRICS = Metrics()
@@ -155,22 +155,21 @@ class Annotator:
         # cv2.circle(img, center, radius, color, thickness)
         cv2.circle(self.im, center, radius, color, thickness)
 
-    def record(self, records):
-        if records is not None:
-            start = records[-1].find('Total')
-            end = records[-1].find('In')
-            text_scale = max(0.5, self.im.shape[1] / 3000.)
-            cv2.putText(
-                self.im,
-                records[-1][start:end], (0, int(40 * text_scale) + 10),
-                cv2.FONT_ITALIC,
-                text_scale, (0, 0, 255),
-                thickness=2)
-        # find start location for entrance counting data
-        start = records[-1].find('In')
+    def record(self, counts):
+        # counts: FlowCounter.snapshot()
+        if counts is None:
+            return
+        text_scale = max(0.5, self.im.shape[1] / 3000.)
         cv2.putText(
             self.im,
-            records[-1][start:-1], (0, int(60 * text_scale) + 10),
+            f"Total count: {counts['total']}", (0, int(40 * text_scale) + 10),
+            cv2.FONT_ITALIC,
+            text_scale, (0, 0, 255),
+            thickness=2)
+        # entrance counting data
+        cv2.putText(
+            self.im,
+            f"In count: {counts['in']}, Out count: {counts['out']}", (0, int(60 * text_scale) + 10),
             cv2.FONT_ITALIC,
             text_scale, (0, 0, 255),
             thickness=2)
@@ -0,0 +1,162 @@
+"""
+In-memory store of the door-line settings in region_setting.json.
+
+The detection loop reads the store instead of parsing the file on every frame. It only has to
+compare `version` with the last one it has seen, and rebuild the entrance lines when it changed.
+Changes made by other processes (door_control.py, door_GPIO.py) are picked up by a watcher
+thread that polls the file's mtime. Every write goes to a temp file and is renamed over
+region_setting.json, so a reader never sees a half-written file. Read-modify-write updates
+hold an flock on region_setting.json.lock, so two writers do not lose each other's changes.
+
+    region = get_region_config()
+    if region.version != seen:
+        seen, data = region.snapshot()
+    region.set(type='upper')
+    region.modify(lambda data: data.update(number1=data['number1'] + 1))
+"""
+import json
+import os
+import stat
+import tempfile
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows, writes are still atomic but not serialised between processes
+    fcntl = None
+
+REGION_SETTING = 'region_setting.json'
+
+
+class RegionConfig(object):
+
+    def __init__(self, path=REGION_SETTING, watch=True, poll_interval=0.2):
+        self.path = os.path.abspath(path)
+        self.poll_interval = poll_interval
+        self.version = 0  # bumped on every change of the data
+        self._lock = threading.Lock()
+        self._data = self._read()
+        self._stat = self._file_stat()
+
+        self._stop = threading.Event()
+        self._watcher = None
+        if watch:
+            self._watcher = threading.Thread(target=self._watch, name='region-config-watch', daemon=True)
+            self._watcher.start()
+
+    def _file_stat(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_ino, st.st_size
+
+    def _read(self):
+        with open(self.path) as f:
+            return json.load(f)
+
+    def _write(self, data):
+        # temp file in the same directory + rename, readers see the old or the new file, never a partial one
+        fd, tmp = tempfile.mkstemp(prefix='.region_setting.', dir=os.path.dirname(self.path))
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f)
+                f.flush()
+                os.fsync(f.fileno())
+            # mkstemp creates the file 0600, keep the mode of the file it replaces
+            try:
+                mode = stat.S_IMODE(os.stat(self.path).st_mode)
+            except FileNotFoundError:
+                mode = 0o644
+            os.chmod(tmp, mode)
+            os.replace(tmp, self.path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def _file_lock(self):
+        if fcntl is None:
+            return None
+        f = open(self.path + '.lock', 'a')
+        fcntl.flock(f, fcntl.LOCK_EX)
+        return f
+
+    def _publish(self, data):
+        # data is never mutated after this, readers may keep the dict they got
+        self._data = data
+        self.version += 1
+
+    def get(self):
+        return self._data
+
+    def snapshot(self):
+        """Return (version, data), consistent with each other."""
+        with self._lock:
+            return self.version, self._data
+
+    def modify(self, fn):
+        """
+        Apply fn(data) to the latest settings on disk and write them back atomically.
+        fn edits the dict in place.
+        """
+        with self._lock:
+            lock = self._file_lock()
+            try:
+                data = self._read()
+                before = dict(data)  # the values are plain scalars
+                fn(data)
+                if data != before:
+                    self._write(data)
+                self._stat = self._file_stat()
+                if data != self._data:
+                    self._publish(data)
+            finally:
+                if lock is not None:
+                    lock.close()  # releases the flock
+            return self.version
+
+    def set(self, **values):
+        # no write if nothing changes, e.g. the door state polled every frame. The store is
+        # reloaded first (one stat), without a watcher it may not have seen another process' edit
+        self.reload()
+        if all(self._data.get(k) == v for k, v in values.items()):
+            return self.version
+        return self.modify(lambda data: data.update(values))
+
+    def reload(self):
+        """Re-read the file if it changed on disk. Returns True if the data changed."""
+        st = self._file_stat()
+        if st is None or st == self._stat:
+            return False
+        try:
+            data = self._read()
+        except ValueError:  # written by a non-atomic writer, retry on the next poll
+            return False
+        with self._lock:
+            self._stat = st
+            if data == self._data:
+                return False
+            self._publish(data)
+        return True
+
+    def _watch(self):
+        while not self._stop.wait(self.poll_interval):
+            self.reload()
+
+    def close(self):
+        self._stop.set()
+        if self._watcher is not None:
+            self._watcher.join()
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_region_config(path=REGION_SETTING, watch=True):
+    """One shared store per settings file and process."""
+    key = os.path.abspath(path)
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = RegionConfig(path, watch=watch)
+        return _stores[key]
@@ -0,0 +1,312 @@
+"""
+Hyperparameter sweep of a tracker config on cached detections.
+
+Every trial replays the detection caches (det_cache.py, written by track.py --dump-dets on the
+sequences of a MOT-style dataset) through the tracker with one sampled configuration and scores
+the tracks against the ground truth with the batched Evaluator.eval_arrays. Trials run in a
+process pool, one per core.
+
+Bad trials are pruned by asynchronous successive halving: a trial is first scored on the first
+1/eta^(rungs-1) of every sequence, and only the best 1/eta of the trials at a rung are continued
+on eta times more frames, up to the full sequences. Trial 0 is the current config, it is always
+scored on the full sequences as the baseline. The best config is written in the schema of
+trackers/<method>/configs/<method>.yaml, with the trial number and scores in the header.
+
+    data/MOT17/train/MOT17-02/gt/gt.txt       ground truth, MOTChallenge format
+    data/MOT17/train/MOT17-02/dets            python track.py --source .../img1 --dump-dets --name ...
+
+    python sweep.py --tracking-method ocsort --data-root data/MOT17/train --trials 200 --workers 8
+"""
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+
+import numpy as np
+import torch
+import yaml
+
+FILE = Path(__file__).resolve()
+ROOT = FILE.parents[0]
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))  # add ROOT to PATH
+if str(ROOT / 'ultralytics') not in sys.path:
+    sys.path.append(str(ROOT / 'ultralytics'))  # add yolov8 ROOT to PATH
+if str(ROOT / 'trackers' / 'strongsort') not in sys.path:
+    sys.path.append(str(ROOT / 'trackers' / 'strongsort'))  # add strong_sort ROOT to PATH
+
+from det_cache import DetectionCache, replay
+
+ASSO_FUNCS = ['iou', 'giou', 'ciou', 'diou', 'ct_dist']
+
+# (kind, low, high) or ('choice', values); the other keys of the YAML are kept as they are
+SEARCH_SPACES = {
+    'bytetrack': {
+        'track_thresh': ('float', 0.3, 0.8),
+        'match_thresh': ('float', 0.5, 0.95),
+        'track_buffer': ('int', 10, 90),
+        'conf_thres': ('float', 0.2, 0.7),
+    },
+    'ocsort': {
+        'det_thresh': ('float', 0, 0.6),
+        'max_age': ('int', 10, 80),
+        'min_hits': ('int', 1, 5),
+        'iou_thresh': ('float', 0.1, 0.5),
+        'delta_t': ('int', 1, 5),
+        'asso_func': ('choice', ASSO_FUNCS),
+        'inertia': ('float', 0.1, 0.5),
+        'use_byte': ('choice', [False, True]),
+        'conf_thres': ('float', 0.2, 0.7),
+    },
+    'deepocsort': {
+        'det_thresh': ('float', 0, 0.6),
+        'max_age': ('int', 10, 80),
+        'min_hits': ('int', 1, 5),
+        'iou_thresh': ('float', 0.1, 0.5),
+        'delta_t': ('int', 1, 5),
+        'asso_func': ('choice', ASSO_FUNCS),
+        'inertia': ('float', 0.1, 0.5),
+        'conf_thres': ('float', 0.2, 0.7),
+    },
+    'strongsort': {
+        'max_dist': ('float', 0.1, 0.4),
+        'max_iou_dist': ('float', 0.5, 0.95),
+        'max_age': ('int', 10, 100),
+        'n_init': ('int', 1, 5),
+        'mc_lambda': ('float', 0.90, 0.999),
+        'ema_alpha': ('float', 0.7, 0.95),
+        'conf_thres': ('float', 0.2, 0.7),
+    },
+    'botsort': {
+        'track_high_thresh': ('float', 0.3, 0.7),
+        'new_track_thresh': ('float', 0.1, 0.8),
+        'track_buffer': ('int', 20, 80),
+        'match_thresh': ('float', 0.1, 0.9),
+        'proximity_thresh': ('float', 0.25, 0.75),
+        'appearance_thresh': ('float', 0.1, 0.8),
+        'lambda_': ('float', 0.97, 0.995),
+        'conf_thres': ('float', 0.2, 0.7),
+    },
+}
+
+
+def sample(space, rng, conf_min=0.):
+    params = {}
+    for key, (kind, *args) in space.items():
+        if kind == 'choice':
+            params[key] = args[0][rng.integers(len(args[0]))]
+        elif kind == 'int':
+            params[key] = int(rng.integers(args[0], args[1] + 1))
+        else:
+            low = max(args[0], conf_min) if key == 'conf_thres' else args[0]  # cannot go below the dump
+            params[key] = float(rng.uniform(low, max(low, args[1])))
+    return params
+
+
+class SuccessiveHalving(object):
+    """
+    Asynchronous successive halving: next() returns the next (trial, rung) to run, promoting a
+    trial to rung r + 1 as soon as it is in the top 1/eta of the trials scored at rung r.
+    """
+
+    def __init__(self, n_trials, rungs=3, eta=3, always=(0,)):
+        self.n_trials = n_trials
+        self.rungs = rungs
+        self.eta = eta
+        self.always = set(always)  # promoted whatever their score
+        self.scores = [{} for _ in range(rungs)]  # rung -> {trial: score}
+        self.promoted = [set() for _ in range(rungs)]
+        self.started = 0
+
+    def fraction(self, rung):
+        return float(self.eta) ** (rung - self.rungs + 1)
+
+    def next(self):
+        for r in reversed(range(self.rungs - 1)):
+            scores = self.scores[r]
+            top = sorted(scores, key=scores.get, reverse=True)[:len(scores) // self.eta]
+            for trial in list(self.always & set(scores)) + top:
+                if trial not in self.promoted[r]:
+                    self.promoted[r].add(trial)
+                    return trial, r + 1
+        if self.started < self.n_trials:
+            self.started += 1
+            return self.started - 1, 0
+        return None
+
+    def report(self, trial, rung, score):
+        self.scores[rung][trial] = score
+
+    def best(self):
+        # highest rung reached, then score
+        for scores in reversed(self.scores):
+            if scores:
+                trial = max(scores, key=scores.get)
+                return trial, scores[trial]
+        return None, None
+
+
+_worker = {}
+
+
+def init_worker(tracking_method, base_config, sequences, reid_weights):
+    from trackers.strongsort.utils.evaluation import Evaluator
+
+    torch.set_num_threads(1)  # one trial per core
+    _worker.update(tracking_method=tracking_method, base_config=base_config, reid_weights=reid_weights)
+    _worker['sequences'] = [(seq, DetectionCache(cache), Evaluator(data_root, seq, 'mot'))
+                            for seq, cache, data_root in sequences]
+
+
+@torch.no_grad()
+def evaluate(params, fraction, metrics=('mota', 'idf1')):
+    """Replay the first `fraction` of every sequence with params, returns the overall metrics."""
+    from trackers.multi_tracker_zoo import create_tracker
+    from trackers.strongsort.utils.evaluation import Evaluator
+
+    m = _worker['tracking_method']
+    config = {m: dict(_worker['base_config'], **params)}
+    fd, path = tempfile.mkstemp(prefix='.sweep.', suffix='.yaml')
+    with os.fdopen(fd, 'w') as f:
+        yaml.safe_dump(config, f)
+
+    t = time.perf_counter()
+    accs, names, frames = [], [], 0
+    try:
+        for seq, cache, evaluator in _worker['sequences']:
+            tracker = create_tracker(m, path, _worker['reid_weights'], torch.device('cpu'), False)
+            n = max(1, math.ceil(len(cache) * fraction))
+            frame_ids, tracks = [], []
+            for frame_id, outputs in replay(cache, tracker, conf_thres=params.get('conf_thres'), max_frames=n):
+                if len(outputs):
+                    outputs = np.asarray(outputs).reshape(len(outputs), -1)[:, :5].astype(np.float64)
+                    frame_ids.append(np.full(len(outputs), frame_id))
+                    tracks.append(outputs)
+            tracks = np.concatenate(tracks) if tracks else np.zeros((0, 5))
+            tlwhs = np.concatenate([tracks[:, :2], tracks[:, 2:4] - tracks[:, :2]], 1)
+            frame_ids = np.concatenate(frame_ids) if frame_ids else np.zeros(0, dtype=np.int64)
+            accs.append(evaluator.eval_arrays(frame_ids, tlwhs, tracks[:, 4].astype(np.int64),
+                                              frames=cache.frame_ids[:n]))
+            names.append(seq)
+            frames += n
+    finally:
+        os.unlink(path)
+    summary = Evaluator.get_summary(accs, names, metrics=metrics)
+    result = {k: float(summary.loc['OVERALL', k]) for k in metrics}
+    result.update(frames=frames, seconds=time.perf_counter() - t)
+    return result
+
+
+def find_sequences(opt):
+    seqs = opt.seqs or sorted(p.name for p in Path(opt.data_root).iterdir() if (p / 'gt' / 'gt.txt').is_file())
+    sequences = []
+    for seq in seqs:
+        cache = Path(opt.cache_root) / seq if opt.cache_root else Path(opt.data_root) / seq / 'dets'
+        assert (cache / 'meta.json').is_file(), f'no detection cache {cache}, run track.py --dump-dets first'
+        sequences.append((seq, str(cache), str(opt.data_root)))
+    assert sequences, f'no sequences with gt/gt.txt in {opt.data_root}'
+    return sequences
+
+
+def write_config(path, tracking_method, config, trial, result):
+    header = (f"# Trial number:      {trial}\n"
+              f"# MOTA, IDF1:        [{result['mota'] * 100:.3f}, {result['idf1'] * 100:.3f}]\n")
+    with open(path, 'w') as f:
+        f.write(header)
+        yaml.safe_dump({tracking_method: config}, f, sort_keys=False)
+
+
+def main(opt):
+    m = opt.tracking_method
+    config_path = opt.tracking_config or ROOT / 'trackers' / m / 'configs' / f'{m}.yaml'
+    with open(config_path) as f:
+        base_config = yaml.safe_load(f)[m]
+    space = SEARCH_SPACES[m]
+    sequences = find_sequences(opt)
+    conf_min = max(float(DetectionCache(c).meta.get('conf_thres') or 0.) for _, c, _ in sequences)
+
+    # all trials are drawn up front, the sweep is reproducible whatever order they finish in
+    rng = np.random.default_rng(opt.seed)
+    trials = [{k: base_config[k] for k in space if k in base_config}]  # trial 0: current config
+    trials += [sample(space, rng, conf_min) for _ in range(opt.trials - 1)]
+
+    sha = SuccessiveHalving(len(trials), opt.rungs, opt.eta)
+    metric = opt.metric
+    records = []
+    context = multiprocessing.get_context('spawn')
+    t = time.time()
+    with ProcessPoolExecutor(opt.workers, mp_context=context, initializer=init_worker,
+                             initargs=(m, base_config, sequences, opt.reid_weights)) as pool:
+        pending = {}
+        while True:
+            while len(pending) < opt.workers:
+                job = sha.next()
+                if job is None:
+                    break
+                trial, rung = job
+                pending[pool.submit(evaluate, trials[trial], sha.fraction(rung))] = job
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                trial, rung = pending.pop(future)
+                try:
+                    result = future.result()
+                    score = result[metric]
+                except Exception as e:  # e.g. a combination the tracker rejects, never promoted
+                    result, score = {'error': f'{type(e).__name__}: {e}'}, -math.inf
+                sha.report(trial, rung, score)
+                records.append(dict(trial=trial, rung=rung, params=trials[trial], **result))
+                print(f'trial {trial:4d} rung {rung} ' + (f"{metric} {score:.4f} ({result['frames']} frames, "
+                      f"{result['seconds']:.1f}s)" if 'error' not in result else result['error']))
+
+    best, score = sha.best()
+    baseline = sha.scores[-1].get(0)
+    full = [r for r in records if r['trial'] == best and r['rung'] == opt.rungs - 1 and 'error' not in r]
+    print(f'\n{len(trials)} trials, {sum(len(s) for s in sha.scores)} evaluations in {time.time() - t:.0f}s, '
+          f'{len(trials) - len(sha.scores[-1])} pruned')
+    print(f'baseline {metric} {baseline:.4f}, best trial {best} {metric} {score:.4f}: {trials[best]}'
+          if baseline is not None else f'best trial {best} {metric} {score:.4f}: {trials[best]}')
+
+    out = Path(opt.out)
+    out.mkdir(parents=True, exist_ok=True)
+    with open(out / f'{m}_sweep.json', 'w') as f:
+        json.dump({'tracking_method': m, 'metric': metric, 'sequences': [s for s, _, _ in sequences],
+                   'best': best, 'trials': records}, f, indent=1, default=float)
+    if full:
+        config = dict(base_config, **trials[best])
+        write_config(out / f'{m}.yaml', m, config, best, full[0])
+        if opt.write_back:
+            write_config(config_path, m, config, best, full[0])
+        print(f"Results saved to {out / f'{m}_sweep.json'} and {out / f'{m}.yaml'}" +
+              (f', config updated {config_path}' if opt.write_back else ''))
+
+
+def parse_opt():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tracking-method', type=str, default='bytetrack', choices=list(SEARCH_SPACES))
+    parser.add_argument('--tracking-config', type=Path, default=None, help='config to start from')
+    parser.add_argument('--data-root', type=Path, required=True, help='MOT-style <root>/<seq>/gt/gt.txt')
+    parser.add_argument('--seqs', nargs='+', default=None, help='sequences, all of data-root by default')
+    parser.add_argument('--cache-root', type=Path, default=None,
+                        help='detection caches <cache-root>/<seq>, <data-root>/<seq>/dets by default')
+    parser.add_argument('--reid-weights', type=Path, default=ROOT / 'weights' / 'osnet_x0_25_msmt17.pt')
+    parser.add_argument('--trials', type=int, default=100)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--rungs', type=int, default=3, help='successive halving rungs, the last on all frames')
+    parser.add_argument('--eta', type=int, default=3, help='1/eta of the trials are continued at each rung')
+    parser.add_argument('--metric', type=str, default='idf1', choices=['idf1', 'mota'])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', type=Path, default=ROOT / 'runs' / 'sweep', help='trials json and best yaml')
+    parser.add_argument('--write-back', action='store_true', help='overwrite the tracking config with the best')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main(parse_opt())
@@ -49,6 +49,9 @@ from ultralytics.yolo.utils.ops import Profile, non_max_suppression, scale_boxes
 from ultralytics.yolo.utils.plotting import Annotator, colors, save_one_box
 
 from trackers.multi_tracker_zoo import create_tracker
+from video_writer import AsyncVideoWriter
+from flow_counter import FlowCounter, entrance_lines
+from det_cache import DetectionRecorder
 
 
 @torch.no_grad()
@@ -64,7 +67,10 @@ def run(
         max_det=1000,  # maximum detections per image
         device='',  # cuda device, i.e. 0 or 0,1,2,3 or cpu
         show_vid=True,  # show results
+        headless=False,  # no window and no overlay drawing, only tracking and counting
         save_txt=False,  # save results to *.txt
+        dump_dets=False,  # dump the detections for tracker-only replays (det_cache.py)
+        dump_embeddings=False,  # dump the ReID embedding of every detection too
         save_conf=False,  # save confidences in --save-txt labels
         save_crop=False,  # save cropped prediction boxes
         save_trajectories=False,  # save trajectories for each track
@@ -114,7 +120,7 @@ def run(
 
     exp_name = name if name else exp_name + "_" + suffix + "_" + reid_weights.stem
 
-    if save_crop or save_trajectories or save_img or save_vid or save_txt:
+    if save_crop or save_trajectories or save_img or save_vid or save_txt or dump_dets:
         print(exp_name)
         save_dir = increment_path(Path(project) / exp_name, exist_ok=exist_ok)  # increment run
         (save_dir / 'tracks' if save_txt else save_dir).mkdir(parents=True, exist_ok=True)  # make dir
@@ -161,13 +167,23 @@ def run(
                 tracker_list[i].model.warmup()
     outputs = [None] * bs
 
+    # detections of every frame the trackers see, replayed by det_cache.py
+    recorders = [None] * bs
+    if dump_dets:
+        for i in range(bs):
+            recorders[i] = DetectionRecorder(save_dir / ('dets' if bs == 1 else f'dets{i}'), tracker_list[i],
+                                             dump_embeddings, reid_weights, device, half,
+                                             source=source, yolo_weights=yolo_weights, imgsz=imgsz,
+                                             conf_thres=conf_thres, iou_thres=iou_thres,
+                                             tracking_method=tracking_method)
+
     # Run tracking
     model.warmup(imgsz=(1 if pt else bs, 3, *imgsz))  # warmup
     seen, windows, dt = 0, [], (Profile(), Profile(), Profile(), Profile())
     curr_frames, prev_frames = [None] * bs, [None] * bs
 
     # entrance count
-    entrance, records, center_traj = None, None, None
+    entrance, center_traj = None, None
 
     # customize door position
     with open('region_setting.json') as file:
@@ -176,12 +192,7 @@ def run(
     region_line1 = int(data['number1'])
     region_line2 = int(data['number2'])
     # do_entrance_counting
-    id_set = set()
-    interval_id_set = set()
-    in_id_list = list()
-    out_id_list = list()
-    prev_center = dict()
-    records = list()
+    counter = FlowCounter(30, 2)
 
     start_runtime = time.time()
     count_frame = 1
@@ -280,6 +291,9 @@ def run(
                     n = (det[:, 5] == c).sum()  # detections per class
                     s += f"{n} {names[int(c)]}{'s' * (n > 1)}, "  # add to string
 
+                if recorders[i] is not None:
+                    recorders[i].write(frame_idx + 1, det[:, :6], im0)
+
                 # pass detections to strongsort
                 with dt[3]:
                     outputs[i] = tracker_list[i].update(det.cpu(), im0)
@@ -331,8 +345,9 @@ def run(
                         color = colors(c, True)
                         center_x = bbox_left + bbox_w / 2.
                         center_y = bbox_top + bbox_h / 2.
-                        annotator.box_label(bbox, label, color=color)
-                        annotator.circle((int(center_x),int(center_y)), radius=4, color=color)
+                        if not headless:
+                            annotator.box_label(bbox, label, color=color)
+                            annotator.circle((int(center_x),int(center_y)), radius=4, color=color)
 
                         if save_trajectories and tracking_method == 'strongsort':
                             q = output[7]
@@ -343,48 +358,33 @@ def run(
                                          file=save_dir / 'crops' / txt_file_name / names[
                                              c] / f'{id}' / f'{p.stem}.jpg', BGR=True)
 
-                        # MOT results
-                        tlwh_mot=[tlwh]
-                        conf_mot = [conf]
-                        id_mot = [id]
-                        mot_result = [frame_idx + 1, tlwh_mot, conf_mot, id_mot]
-                        # entrance counting
-                        statistic = human_flow_counting(True,
-                                            mot_result,
-                                            entrance,
-                                            region_type,
-                                            id_set,
-                                            interval_id_set,
-                                            in_id_list,
-                                            out_id_list,
-                                            prev_center,
-                                            records,
-                                            30,
-                                            2
-                                            )
-                        records = statistic['records']
-                        annotator.record(records)
+                    # entrance counting, all tracks of this frame at once
+                    counter.update(frame_idx + 1, outputs[i], entrance_lines(entrance, region_type))
+                    if not headless:
+                        annotator.record(counter.snapshot())
             else:
-                pass
+                if recorders[i] is not None:
+                    recorders[i].write(frame_idx + 1, det[:, :6], im0)
                 # tracker_list[i].tracker.pred_n_update_all_tracks()
 
             # add lines to image
-            entrance_line = tuple(map(int, entrance))
-            try:
-                if region_type == "upper":
-                    annotator.box_label(entrance_line[0:4], "DOOR1", color=(0, 0, 255))
-                elif region_type == "under":
-                    annotator.box_label(entrance_line[4:8], "DOOR2", color=(255, 0, 0))
-                elif region_type == "both":
-                    annotator.box_label(entrance_line[0:4], "DOOR1", color=(0, 0, 255))
-                    annotator.box_label(entrance_line[4:8], "DOOR2", color=(255, 0, 0))
-            except:
-                pass
+            if not headless:
+                entrance_line = tuple(map(int, entrance))
+                try:
+                    if region_type == "upper":
+                        annotator.box_label(entrance_line[0:4], "DOOR1", color=(0, 0, 255))
+                    elif region_type == "under":
+                        annotator.box_label(entrance_line[4:8], "DOOR2", color=(255, 0, 0))
+                    elif region_type == "both":
+                        annotator.box_label(entrance_line[0:4], "DOOR1", color=(0, 0, 255))
+                        annotator.box_label(entrance_line[4:8], "DOOR2", color=(255, 0, 0))
+                except:
+                    pass
 
             # Stream results
             im0 = annotator.result()
 
-            if True:    # if update: #show_vid
+            if not headless:    # if update: #show_vid
     #     strip_optimizer(yolo_weights)  # update model (to fix SourceChangeWarning)
                 if platform.system() == 'Linux' and p not in windows:
                     windows.append(p)
@@ -401,7 +401,7 @@ def run(
             if save_vid:
                 if vid_path[i] != save_path:  # new video
                     vid_path[i] = save_path
-                    if isinstance(vid_writer[i], cv2.VideoWriter):
+                    if vid_writer[i] is not None:
                         vid_writer[i].release()  # release previous video writer
                     if vid_cap:  # video
                         fps = vid_cap.get(cv2.CAP_PROP_FPS)
@@ -410,7 +410,8 @@ def run(
                     else:  # stream
                         fps, w, h = 30, im0.shape[1], im0.shape[0]
                     save_path = str(Path(save_path).with_suffix('.mp4'))  # force *.mp4 suffix on results videos
-                    vid_writer[i] = cv2.VideoWriter(save_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (w, h))
+                    # encoded on a writer thread, frames of video files are never dropped
+                    vid_writer[i] = AsyncVideoWriter(save_path, 'mp4v', fps, (w, h), drop=not vid_cap)
                 elapsed_time = time.time() - start_runtime
                 fps_s = 1 / elapsed_time
                 cv2.putText(im0, f'FPS: {fps_s:.2f}', (im0.shape[1] - 180, 30), cv2.FONT_HERSHEY_SIMPLEX, 1,
@@ -424,6 +425,14 @@ def run(
             f"{s}{'' if len(det) else '(no detections), '}{sum([dt.dt for dt in dt if hasattr(dt, 'dt')]) * 1E3:.1f}ms")
         start_runtime = time.time()
 
+    # encode the queued frames and close the videos
+    for writer in vid_writer:
+        if writer is not None:
+            writer.release()
+    for recorder in recorders:
+        if recorder is not None:
+            recorder.close()
+
     # Print results
     t = tuple(x.t / seen * 1E3 for x in dt)  # speeds per image
     LOGGER.info(
@@ -434,112 +443,6 @@ def run(
 
 
 
-def human_flow_counting(do_entrance_counting,
-                        result,
-                        entrance,
-                        region_type,
-                        id_set,
-                        interval_id_set,
-                        in_id_list,
-                        out_id_list,
-                        prev_center,
-                        records,
-                        video_fps,
-                        secs_interval
-                        ):
-    # Count in/out number:
-    if do_entrance_counting:
-        assert region_type in [
-            'both', "upper", "under", 'close'
-        ], "region_type should be 'horizontal' or 'vertical' or 'custom_1' or 'custom_2' when do entrance counting."
-
-        # test
-        # print(f"Test:{region_type} && {entrance}")
-
-        if region_type == 'upper':
-            entrance_x, entrance_y = entrance[0], entrance[1]
-        elif region_type == 'under':
-            entrance_x, entrance_y = entrance[4], entrance[5]
-        else:
-            entrance_x1, entrance_y1 = entrance[0], entrance[1]
-            entrance_x2, entrance_y2 = entrance[4], entrance[5]
-
-        # print(entrance_x, entrance_y)
-        frame_id, tlwhs, tscores, track_ids = result
-        for tlwh, score, track_id in zip(tlwhs, tscores, track_ids):
-            if track_id < 0: continue
-            x1, y1, w, h = tlwh
-            center_x = x1 + w / 2.
-            center_y = y1 + h / 2.
-            if track_id in prev_center:
-                if region_type == 'under':
-                    if prev_center[track_id][1] >= entrance_y and \
-                            center_y < entrance_y:
-                        in_id_list.append(track_id)
-                    if prev_center[track_id][1] <= entrance_y and \
-                            center_y > entrance_y:
-                        out_id_list.append(track_id)
-                elif region_type == 'upper':
-                    if prev_center[track_id][1] <= entrance_y and \
-                            center_y > entrance_y:
-                        in_id_list.append(track_id)
-                    if prev_center[track_id][1] >= entrance_y and \
-                            center_y < entrance_y:
-                        out_id_list.append(track_id)
-                elif region_type == 'both':
-                    # horizontal customized center lines
-                    # print(entrance_x1, entrance_y1,entrance_x2, entrance_y2)
-                    if prev_center[track_id][1] <= entrance_y1 and \
-                            center_y > entrance_y1:
-                        in_id_list.append(track_id)
-                    if prev_center[track_id][1] >= entrance_y1 and \
-                            center_y < entrance_y1:
-                        out_id_list.append(track_id)
-                    if prev_center[track_id][1] <= entrance_y2 and \
-                            center_y > entrance_y2:
-                        out_id_list.append(track_id)
-                    if prev_center[track_id][1] >= entrance_y2 and \
-                            center_y < entrance_y2:
-                        in_id_list.append(track_id)
-                else:
-                    continue
-                prev_center[track_id][0] = center_x
-                prev_center[track_id][1] = center_y
-            else:
-                prev_center[track_id] = [center_x, center_y]
-
-        # Count totol number, number at a manual-setting interval
-        frame_id, tlwhs, tscores, track_ids = result
-        for tlwh, score, track_id in zip(tlwhs, tscores, track_ids):
-            if track_id < 0: continue
-            id_set.add(track_id)
-            interval_id_set.add(track_id)
-
-        # Reset counting at the interval beginning
-        if frame_id % video_fps == 0 and frame_id / video_fps % secs_interval == 0:
-            curr_interval_count = len(interval_id_set)
-            interval_id_set.clear()
-        info = "Frame id: {}, Total count: {}".format(frame_id, len(id_set))
-        if do_entrance_counting:
-            info += ", In count: {}, Out count: {}".format(
-                len(in_id_list), len(out_id_list))
-        if frame_id % video_fps == 0 and frame_id / video_fps % secs_interval == 0:
-            info += ", Count during {} secs: {}".format(secs_interval,
-                                                        curr_interval_count)
-            interval_id_set.clear()
-        # print(info)
-        info += "\n"
-        records.append(info)
-
-        return {
-            "id_set": id_set,
-            "interval_id_set": interval_id_set,
-            "in_id_list": in_id_list,
-            "out_id_list": out_id_list,
-            "prev_center": prev_center,
-            "records": records,
-        }
-
 def parse_opt():
     parser = argparse.ArgumentParser()
     parser.add_argument('--yolo-weights', nargs='+', type=Path, default=WEIGHTS / 'weights/sf480.pt', help='model.pt path(s)')
@@ -555,7 +458,10 @@ def parse_opt():
     parser.add_argument('--max-det', type=int, default=1000, help='maximum detections per image')
     parser.add_argument('--device', default='0', help='cuda device, i.e. 0 or 0,1,2,3 or cpu')
     parser.add_argument('--show-vid', action='store_true', help='display tracking video results')
+    parser.add_argument('--headless', action='store_true', help='no window and no overlay drawing')
     parser.add_argument('--save-txt', action='store_true', help='save results to *.txt')
+    parser.add_argument('--dump-dets', action='store_true', help='dump detections for tracker-only replays')
+    parser.add_argument('--dump-embeddings', action='store_true', help='dump ReID embeddings with --dump-dets')
     parser.add_argument('--save-conf', action='store_true', help='save confidences in --save-txt labels')
     parser.add_argument('--save-crop', action='store_true', help='save cropped prediction boxes')
     parser.add_argument('--save-trajectories', action='store_true', help='save trajectories for each track')
@@ -1,5 +1,5 @@
 import numpy as np
-from collections import OrderedDict
+from collections import OrderedDict, deque
 
 
 class TrackState(object):
@@ -32,6 +32,17 @@ class BaseTrack(object):
     def end_frame(self):
         return self.frame_id
 
+    @property
+    def nbytes(self):
+        # size of the numpy state (mean, covariance, features) held by this track
+        n = 0
+        for v in self.__dict__.values():
+            if isinstance(v, np.ndarray):
+                n += v.nbytes
+            elif isinstance(v, deque):
+                n += sum(f.nbytes for f in v if isinstance(f, np.ndarray))
+        return n
+
     @staticmethod
     def next_id():
         BaseTrack._count += 1
@@ -90,6 +90,28 @@ class STrack(BaseTrack):
                 stracks[i].mean = mean
                 stracks[i].covariance = cov
 
+    @staticmethod
+    def multi_update(stracks, new_tracks, frame_id):
+        """
+        Kalman-correct all matched tracks in one batch, then update them (or re-activate the ones
+        that were not Tracked). Returns the (activated, refind) tracks.
+        """
+        activated, refind = [], []
+        if len(stracks) > 0:
+            multi_mean = np.asarray([st.mean for st in stracks])
+            multi_covariance = np.asarray([st.covariance for st in stracks])
+            measurement = np.asarray([STrack.tlwh_to_xywh(det.tlwh) for det in new_tracks])
+            multi_mean, multi_covariance = STrack.shared_kalman.multi_update(multi_mean, multi_covariance, measurement)
+            for st, det, mean, cov in zip(stracks, new_tracks, multi_mean, multi_covariance):
+                st.mean, st.covariance = mean, cov
+                if st.state == TrackState.Tracked:
+                    st.update(det, frame_id, update_kalman=False)
+                    activated.append(st)
+                else:
+                    st.re_activate(det, frame_id, new_id=False, update_kalman=False)
+                    refind.append(st)
+        return activated, refind
+
     @staticmethod
     def multi_gmc(stracks, H=np.eye(2, 3)):
         if len(stracks) > 0:
@@ -122,9 +144,10 @@ class STrack(BaseTrack):
         self.frame_id = frame_id
         self.start_frame = frame_id
 
-    def re_activate(self, new_track, frame_id, new_id=False):
+    def re_activate(self, new_track, frame_id, new_id=False, update_kalman=True):
 
-        self.mean, self.covariance = self.kalman_filter.update(self.mean, self.covariance, self.tlwh_to_xywh(new_track.tlwh))
+        if update_kalman:
+            self.mean, self.covariance = self.kalman_filter.update(self.mean, self.covariance, self.tlwh_to_xywh(new_track.tlwh))
         if new_track.curr_feat is not None:
             self.update_features(new_track.curr_feat)
         self.tracklet_len = 0
@@ -137,12 +160,12 @@ class STrack(BaseTrack):
 
         self.update_cls(new_track.cls, new_track.score)
 
-    def update(self, new_track, frame_id):
+    def update(self, new_track, frame_id, update_kalman=True):
         """
         Update a matched track
         :type new_track: STrack
         :type frame_id: int
-        :type update_feature: bool
+        :type update_kalman: bool, False when the Kalman step was already done by multi_update
         :return:
         """
         self.frame_id = frame_id
@@ -150,7 +173,8 @@ class STrack(BaseTrack):
 
         new_tlwh = new_track.tlwh
 
-        self.mean, self.covariance = self.kalman_filter.update(self.mean, self.covariance, self.tlwh_to_xywh(new_tlwh))
+        if update_kalman:
+            self.mean, self.covariance = self.kalman_filter.update(self.mean, self.covariance, self.tlwh_to_xywh(new_tlwh))
 
         if new_track.curr_feat is not None:
             self.update_features(new_track.curr_feat)
@@ -241,12 +265,14 @@ class BoTSORT(object):
                 appearance_thresh:float = 0.25,
                 cmc_method:str = 'sparseOptFlow',
                 frame_rate=30,
-                lambda_=0.985
+                lambda_=0.985,
+                removed_buffer:int = 100
                 ):
 
         self.tracked_stracks = []  # type: list[STrack]
         self.lost_stracks = []  # type: list[STrack]
-        self.removed_stracks = []  # type: list[STrack]
+        # only needed to filter lost_stracks on the next frame, keep the latest ones in a ring
+        self.removed_stracks = deque(maxlen=removed_buffer)  # type: deque[STrack]
         BaseTrack.clear_count()
 
         self.frame_id = 0
@@ -358,15 +384,10 @@ class BoTSORT(object):
     
         matches, u_track, u_detection = matching.linear_assignment(dists, thresh=self.match_thresh)
 
-        for itracked, idet in matches:
-            track = strack_pool[itracked]
-            det = detections[idet]
-            if track.state == TrackState.Tracked:
-                track.update(detections[idet], self.frame_id)
-                activated_starcks.append(track)
-            else:
-                track.re_activate(det, self.frame_id, new_id=False)
-                refind_stracks.append(track)
+        activated, refind = STrack.multi_update(
+            [strack_pool[i] for i, _ in matches], [detections[i] for _, i in matches], self.frame_id)
+        activated_starcks.extend(activated)
+        refind_stracks.extend(refind)
 
         ''' Step 3: Second association, with low score detection boxes'''
         # if len(scores):
@@ -392,15 +413,10 @@ class BoTSORT(object):
         r_tracked_stracks = [strack_pool[i] for i in u_track if strack_pool[i].state == TrackState.Tracked]
         dists = matching.iou_distance(r_tracked_stracks, detections_second)
         matches, u_track, u_detection_second = matching.linear_assignment(dists, thresh=0.5)
-        for itracked, idet in matches:
-            track = r_tracked_stracks[itracked]
-            det = detections_second[idet]
-            if track.state == TrackState.Tracked:
-                track.update(det, self.frame_id)
-                activated_starcks.append(track)
-            else:
-                track.re_activate(det, self.frame_id, new_id=False)
-                refind_stracks.append(track)
+        activated, refind = STrack.multi_update(
+            [r_tracked_stracks[i] for i, _ in matches], [detections_second[i] for _, i in matches], self.frame_id)
+        activated_starcks.extend(activated)
+        refind_stracks.extend(refind)
 
         for it in u_track:
             track = r_tracked_stracks[it]
@@ -422,9 +438,9 @@ class BoTSORT(object):
         dists = np.minimum(ious_dists, emb_dists)
     
         matches, u_unconfirmed, u_detection = matching.linear_assignment(dists, thresh=0.7)
-        for itracked, idet in matches:
-            unconfirmed[itracked].update(detections[idet], self.frame_id)
-            activated_starcks.append(unconfirmed[itracked])
+        activated, _ = STrack.multi_update(
+            [unconfirmed[i] for i, _ in matches], [detections[i] for _, i in matches], self.frame_id)
+        activated_starcks.extend(activated)
         for it in u_unconfirmed:
             track = unconfirmed[it]
             track.mark_removed()
@@ -452,6 +468,11 @@ class BoTSORT(object):
         self.lost_stracks = sub_stracks(self.lost_stracks, self.tracked_stracks)
         self.lost_stracks.extend(lost_stracks)
         self.lost_stracks = sub_stracks(self.lost_stracks, self.removed_stracks)
+        for track in removed_stracks:
+            # the appearance history is never used again once a track is removed; smooth_feat
+            # stays, the track is still in lost_stracks (and matched against) for one more frame
+            track.features.clear()
+            track.curr_feat = None
         self.removed_stracks.extend(removed_stracks)
         self.tracked_stracks, self.lost_stracks = remove_duplicate_stracks(self.tracked_stracks, self.lost_stracks)
 
@@ -473,6 +494,19 @@ class BoTSORT(object):
 
         return outputs
 
+    def memory_usage(self):
+        """
+        Number of tracked / lost / removed tracks and the bytes of state they hold.
+        """
+        lists = {
+            'tracked': self.tracked_stracks,
+            'lost': self.lost_stracks,
+            'removed': self.removed_stracks,
+        }
+        usage = {name: len(tracks) for name, tracks in lists.items()}
+        usage['bytes'] = sum(t.nbytes for tracks in lists.values() for t in tracks)
+        return usage
+
     def _xywh_to_xyxy(self, bbox_xywh):
         x, y, w, h = bbox_xywh
         x1 = max(int(x - w / 2), 0)
@@ -482,13 +516,10 @@ class BoTSORT(object):
         return x1, y1, x2, y2
 
     def _get_features(self, bbox_xywh, ori_img):
-        im_crops = []
-        for box in bbox_xywh:
-            x1, y1, x2, y2 = self._xywh_to_xyxy(box)
-            im = ori_img[y1:y2, x1:x2]
-            im_crops.append(im)
-        if im_crops:
-            features = self.model(im_crops)
+        # all crops are cut and resized on device from the one uploaded frame
+        xyxys = [self._xywh_to_xyxy(box) for box in bbox_xywh]
+        if xyxys:
+            features = self.model(ori_img, xyxys=np.array(xyxys))
         else:
             features = np.array([])
         return features
@@ -205,30 +205,38 @@ def bbox_ious(boxes, query_boxes):
     -------
     overlaps: (N, K) ndarray of overlap between boxes and query_boxes
     """
-    N = boxes.shape[0]
-    K = query_boxes.shape[0]
-    overlaps = np.zeros((N, K), dtype=np.float32)
-    
-    for k in range(K):
-        box_area = (
-            (query_boxes[k, 2] - query_boxes[k, 0] + 1) *
-            (query_boxes[k, 3] - query_boxes[k, 1] + 1)
-        )
-        for n in range(N):
-            iw = (
-                min(boxes[n, 2], query_boxes[k, 2]) -
-                max(boxes[n, 0], query_boxes[k, 0]) + 1
-            )
-            if iw > 0:
-                ih = (
-                    min(boxes[n, 3], query_boxes[k, 3]) -
-                    max(boxes[n, 1], query_boxes[k, 1]) + 1
-                )
-                if ih > 0:
-                    ua = float(
-                        (boxes[n, 2] - boxes[n, 0] + 1) *
-                        (boxes[n, 3] - boxes[n, 1] + 1) +
-                        box_area - iw * ih
-                    )
-                    overlaps[n, k] = iw * ih / ua
-    return overlaps
\ No newline at end of file
+    # broadcast (N, 1) against (1, K), same +1 pixel convention as the original loop
+    iw = (
+        np.minimum(boxes[:, None, 2], query_boxes[None, :, 2]) -
+        np.maximum(boxes[:, None, 0], query_boxes[None, :, 0]) + 1
+    )
+    ih = (
+        np.minimum(boxes[:, None, 3], query_boxes[None, :, 3]) -
+        np.maximum(boxes[:, None, 1], query_boxes[None, :, 1]) + 1
+    )
+    inter = np.clip(iw, 0, None) * np.clip(ih, 0, None)
+    boxes_area = (boxes[:, 2] - boxes[:, 0] + 1) * (boxes[:, 3] - boxes[:, 1] + 1)
+    query_area = (query_boxes[:, 2] - query_boxes[:, 0] + 1) * (query_boxes[:, 3] - query_boxes[:, 1] + 1)
+    ua = boxes_area[:, None].astype(np.float64) + query_area[None, :] - inter
+
+    overlaps = np.zeros(inter.shape, dtype=np.float32)
+    np.divide(inter, ua, out=overlaps, where=inter > 0, casting='unsafe')
+    return overlaps
+
+
+def bbox_ious_torch(boxes, query_boxes, device='cuda'):
+    """
+    Same as bbox_ious, computed with torch on `device`. Only pays off for large N x K
+    (crowded scenes) where the transfer is cheaper than the numpy broadcast.
+    """
+    import torch
+    b = torch.as_tensor(boxes, dtype=torch.float32, device=device)
+    q = torch.as_tensor(query_boxes, dtype=torch.float32, device=device)
+    iw = (torch.min(b[:, None, 2], q[None, :, 2]) - torch.max(b[:, None, 0], q[None, :, 0]) + 1).clamp_(min=0)
+    ih = (torch.min(b[:, None, 3], q[None, :, 3]) - torch.max(b[:, None, 1], q[None, :, 1]) + 1).clamp_(min=0)
+    inter = iw * ih
+    b_area = (b[:, 2] - b[:, 0] + 1) * (b[:, 3] - b[:, 1] + 1)
+    q_area = (q[:, 2] - q[:, 0] + 1) * (q[:, 3] - q[:, 1] + 1)
+    ua = b_area[:, None] + q_area[None, :] - inter
+    overlaps = torch.where(inter > 0, inter / ua, torch.zeros_like(inter))
+    return overlaps.cpu().numpy()
@@ -1,10 +1,5 @@
 import numpy as np
 from collections import deque
-import os
-import os.path as osp
-import copy
-import torch
-import torch.nn.functional as F
 
 from ultralytics.yolo.utils.ops import xywh2xyxy, xyxy2xywh
 
@@ -13,150 +8,104 @@ from trackers.bytetrack.kalman_filter import KalmanFilter
 from trackers.bytetrack import matching
 from trackers.bytetrack.basetrack import BaseTrack, TrackState
 
-class STrack(BaseTrack):
-    shared_kalman = KalmanFilter()
-    def __init__(self, tlwh, score, cls):
-
-        # wait activate
-        self._tlwh = np.asarray(tlwh, dtype=np.float32)
-        self.kalman_filter = None
-        self.mean, self.covariance = None, None
-        self.is_activated = False
-
-        self.score = score
-        self.tracklet_len = 0
-        self.cls = cls
-
-    def predict(self):
-        mean_state = self.mean.copy()
-        if self.state != TrackState.Tracked:
-            mean_state[7] = 0
-        self.mean, self.covariance = self.kalman_filter.predict(mean_state, self.covariance)
-
-    @staticmethod
-    def multi_predict(stracks):
-        if len(stracks) > 0:
-            multi_mean = np.asarray([st.mean.copy() for st in stracks])
-            multi_covariance = np.asarray([st.covariance for st in stracks])
-            for i, st in enumerate(stracks):
-                if st.state != TrackState.Tracked:
-                    multi_mean[i][7] = 0
-            multi_mean, multi_covariance = STrack.shared_kalman.multi_predict(multi_mean, multi_covariance)
-            for i, (mean, cov) in enumerate(zip(multi_mean, multi_covariance)):
-                stracks[i].mean = mean
-                stracks[i].covariance = cov
-
-    def activate(self, kalman_filter, frame_id):
-        """Start a new tracklet"""
-        self.kalman_filter = kalman_filter
-        self.track_id = self.next_id()
-        self.mean, self.covariance = self.kalman_filter.initiate(self.tlwh_to_xyah(self._tlwh))
-
-        self.tracklet_len = 0
-        self.state = TrackState.Tracked
-        if frame_id == 1:
-            self.is_activated = True
-        # self.is_activated = True
-        self.frame_id = frame_id
-        self.start_frame = frame_id
-
-    def re_activate(self, new_track, frame_id, new_id=False):
-        self.mean, self.covariance = self.kalman_filter.update(
-            self.mean, self.covariance, self.tlwh_to_xyah(new_track.tlwh)
-        )
-        self.tracklet_len = 0
-        self.state = TrackState.Tracked
-        self.is_activated = True
-        self.frame_id = frame_id
-        if new_id:
-            self.track_id = self.next_id()
-        self.score = new_track.score
-        self.cls = new_track.cls
-
-    def update(self, new_track, frame_id):
-        """
-        Update a matched track
-        :type new_track: STrack
-        :type frame_id: int
-        :type update_feature: bool
-        :return:
-        """
-        self.frame_id = frame_id
-        self.tracklet_len += 1
-        # self.cls = cls
 
-        new_tlwh = new_track.tlwh
-        self.mean, self.covariance = self.kalman_filter.update(
-            self.mean, self.covariance, self.tlwh_to_xyah(new_tlwh))
-        self.state = TrackState.Tracked
-        self.is_activated = True
-
-        self.score = new_track.score
+class TrackTable(object):
+    """
+    Struct-of-arrays storage for all ByteTrack tracks.
+
+    Every track is a row (slot) of contiguous columns: (N, 8) means, (N, 8, 8) covariances and
+    the state / id / score columns. The tracker works on arrays of slot indices, so prediction,
+    association and output never touch per-track Python objects. Slots of tracks that left both
+    the tracked and the lost list are reused.
+    """
+    columns = ('mean', 'covariance', 'track_id', 'state', 'is_activated', 'score', 'cls',
+               'frame_id', 'start_frame', 'tracklet_len', 'used')
+
+    def __init__(self, capacity=64):
+        self.mean = np.zeros((capacity, 8), dtype=np.float64)
+        self.covariance = np.zeros((capacity, 8, 8), dtype=np.float64)
+        self.track_id = np.zeros(capacity, dtype=np.int64)
+        self.state = np.zeros(capacity, dtype=np.int8)
+        self.is_activated = np.zeros(capacity, dtype=bool)
+        self.score = np.zeros(capacity, dtype=np.float32)
+        self.cls = np.zeros(capacity, dtype=np.float32)
+        self.frame_id = np.zeros(capacity, dtype=np.int64)
+        self.start_frame = np.zeros(capacity, dtype=np.int64)
+        self.tracklet_len = np.zeros(capacity, dtype=np.int64)
+        self.used = np.zeros(capacity, dtype=bool)
 
     @property
-    # @jit(nopython=True)
-    def tlwh(self):
-        """Get current position in bounding box format `(top left x, top left y,
-                width, height)`.
-        """
-        if self.mean is None:
-            return self._tlwh.copy()
-        ret = self.mean[:4].copy()
-        ret[2] *= ret[3]
-        ret[:2] -= ret[2:] / 2
-        return ret
+    def capacity(self):
+        return len(self.used)
 
     @property
-    # @jit(nopython=True)
-    def tlbr(self):
-        """Convert bounding box to format `(min x, min y, max x, max y)`, i.e.,
-        `(top left, bottom right)`.
+    def nbytes(self):
+        return sum(getattr(self, c).nbytes for c in self.columns)
+
+    def _grow(self, capacity):
+        for c in self.columns:
+            old = getattr(self, c)
+            new = np.zeros((capacity, *old.shape[1:]), dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, c, new)
+
+    def allocate(self, n):
+        free = np.flatnonzero(~self.used)
+        if len(free) < n:
+            capacity = self.capacity
+            self._grow(max(2 * capacity, capacity + n))
+            free = np.flatnonzero(~self.used)
+        slots = free[:n]
+        self.used[slots] = True
+        return slots
+
+    def release(self, slots):
+        self.used[slots] = False
+
+    def tlwh(self, slots):
+        """Get current positions in bounding box format `(top left x, top left y,
+        width, height)`.
         """
-        ret = self.tlwh.copy()
-        ret[2:] += ret[:2]
+        ret = self.mean[slots, :4].copy()
+        ret[:, 2] *= ret[:, 3]
+        ret[:, :2] -= ret[:, 2:] / 2
         return ret
 
-    @staticmethod
-    # @jit(nopython=True)
-    def tlwh_to_xyah(tlwh):
-        """Convert bounding box to format `(center x, center y, aspect ratio,
-        height)`, where the aspect ratio is `width / height`.
+    def tlbr(self, slots):
+        """Convert bounding boxes to format `(min x, min y, max x, max y)`.
         """
-        ret = np.asarray(tlwh).copy()
-        ret[:2] += ret[2:] / 2
-        ret[2] /= ret[3]
+        ret = self.tlwh(slots)
+        ret[:, 2:] += ret[:, :2]
         return ret
 
-    def to_xyah(self):
-        return self.tlwh_to_xyah(self.tlwh)
 
-    @staticmethod
-    # @jit(nopython=True)
-    def tlbr_to_tlwh(tlbr):
-        ret = np.asarray(tlbr).copy()
-        ret[2:] -= ret[:2]
-        return ret
+def tlwh_to_xyah(tlwh):
+    """Convert bounding boxes to format `(center x, center y, aspect ratio,
+    height)`, where the aspect ratio is `width / height`.
+    """
+    ret = np.asarray(tlwh).copy()
+    ret[..., :2] += ret[..., 2:] / 2
+    ret[..., 2] /= ret[..., 3]
+    return ret
 
-    @staticmethod
-    # @jit(nopython=True)
-    def tlwh_to_tlbr(tlwh):
-        ret = np.asarray(tlwh).copy()
-        ret[2:] += ret[:2]
-        return ret
 
-    def __repr__(self):
-        return 'OT_{}_({}-{})'.format(self.track_id, self.start_frame, self.end_frame)
+def tlwh_to_tlbr(tlwh):
+    ret = np.asarray(tlwh).copy()
+    ret[..., 2:] += ret[..., :2]
+    return ret
 
 
 class BYTETracker(object):
-    def __init__(self, track_thresh=0.45, match_thresh=0.8, track_buffer=25, frame_rate=30):
-        self.tracked_stracks = []  # type: list[STrack]
-        self.lost_stracks = []  # type: list[STrack]
-        self.removed_stracks = []  # type: list[STrack]
+    def __init__(self, track_thresh=0.45, match_thresh=0.8, track_buffer=25, frame_rate=30, removed_buffer=100):
+        self.tracks = TrackTable()
+        self.tracked_stracks = np.empty(0, dtype=np.int64)  # slots, in list order
+        self.lost_stracks = np.empty(0, dtype=np.int64)  # slots, in list order
+        # only needed to filter lost_stracks on the next frame, keep the latest ids in a ring
+        self.removed_stracks = deque(maxlen=removed_buffer)  # type: deque[int]
 
         self.frame_id = 0
         self.track_buffer=track_buffer
-        
+
         self.track_thresh = track_thresh
         self.match_thresh = match_thresh
         self.det_thresh = track_thresh + 0.1
@@ -164,18 +113,57 @@ class BYTETracker(object):
         self.max_time_lost = self.buffer_size
         self.kalman_filter = KalmanFilter()
 
+    def multi_predict(self, slots):
+        if len(slots) > 0:
+            tracks = self.tracks
+            multi_mean = tracks.mean[slots]
+            multi_mean[tracks.state[slots] != TrackState.Tracked, 7] = 0
+            tracks.mean[slots], tracks.covariance[slots] = self.kalman_filter.multi_predict(
+                multi_mean, tracks.covariance[slots])
+
+    def update_tracks(self, slots, det_tlwh, det_scores, det_cls):
+        """
+        Update matched tracks with their detections. Tracks that were not in the Tracked state
+        are re-activated. Returns the (activated, refind) slots.
+        """
+        tracks = self.tracks
+        if len(slots):
+            tracks.mean[slots], tracks.covariance[slots] = self.kalman_filter.multi_update(
+                tracks.mean[slots], tracks.covariance[slots], tlwh_to_xyah(det_tlwh))
+        refind = tracks.state[slots] != TrackState.Tracked
+        tracks.frame_id[slots] = self.frame_id
+        tracks.tracklet_len[slots] = np.where(refind, 0, tracks.tracklet_len[slots] + 1)
+        tracks.state[slots] = TrackState.Tracked
+        tracks.is_activated[slots] = True
+        tracks.score[slots] = det_scores
+        tracks.cls[slots[refind]] = det_cls[refind]
+        return slots[~refind], slots[refind]
+
+    def activate(self, det_tlwh, det_scores, det_cls):
+        """Start new tracklets"""
+        tracks = self.tracks
+        slots = tracks.allocate(len(det_tlwh))
+        for slot, tlwh in zip(slots, det_tlwh):
+            tracks.track_id[slot] = BaseTrack.next_id()
+            tracks.mean[slot], tracks.covariance[slot] = self.kalman_filter.initiate(tlwh_to_xyah(tlwh))
+        tracks.score[slots] = det_scores
+        tracks.cls[slots] = det_cls
+        tracks.tracklet_len[slots] = 0
+        tracks.state[slots] = TrackState.Tracked
+        tracks.is_activated[slots] = self.frame_id == 1
+        tracks.frame_id[slots] = self.frame_id
+        tracks.start_frame[slots] = self.frame_id
+        return slots
+
     def update(self, dets, _):
         self.frame_id += 1
-        activated_starcks = []
-        refind_stracks = []
-        lost_stracks = []
-        removed_stracks = []
+        tracks = self.tracks
 
         xyxys = dets[:, 0:4]
         xywh = xyxy2xywh(xyxys.numpy())
         confs = dets[:, 4]
         clss = dets[:, 5]
-        
+
         classes = clss.numpy()
         xyxys = xyxys.numpy()
         confs = confs.numpy()
@@ -185,170 +173,144 @@ class BYTETracker(object):
         inds_high = confs < self.track_thresh
 
         inds_second = np.logical_and(inds_low, inds_high)
-        
-        dets_second = xywh[inds_second]
-        dets = xywh[remain_inds]
-        
+
+        # detections are only arrays, they become tracks in Step 4
+        dets_second = np.asarray(xywh[inds_second], dtype=np.float32)
+        dets = np.asarray(xywh[remain_inds], dtype=np.float32)
+
         scores_keep = confs[remain_inds]
         scores_second = confs[inds_second]
-        
+
         clss_keep = classes[remain_inds]
         clss_second = classes[inds_second]
-        
-
-        if len(dets) > 0:
-            '''Detections'''
-            detections = [STrack(xyxy, s, c) for 
-                (xyxy, s, c) in zip(dets, scores_keep, clss_keep)]
-        else:
-            detections = []
 
         ''' Add newly detected tracklets to tracked_stracks'''
-        unconfirmed = []
-        tracked_stracks = []  # type: list[STrack]
-        for track in self.tracked_stracks:
-            if not track.is_activated:
-                unconfirmed.append(track)
-            else:
-                tracked_stracks.append(track)
+        activated = tracks.is_activated[self.tracked_stracks]
+        unconfirmed = self.tracked_stracks[~activated]
+        tracked_stracks = self.tracked_stracks[activated]
 
         ''' Step 2: First association, with high score detection boxes'''
         strack_pool = joint_stracks(tracked_stracks, self.lost_stracks)
         # Predict the current location with KF
-        STrack.multi_predict(strack_pool)
-        dists = matching.iou_distance(strack_pool, detections)
+        self.multi_predict(strack_pool)
+        dists = matching.iou_distance(tracks.tlbr(strack_pool), tlwh_to_tlbr(dets))
         #if not self.args.mot20:
-        dists = matching.fuse_score(dists, detections)
+        dists = fuse_score(dists, scores_keep)
         matches, u_track, u_detection = matching.linear_assignment(dists, thresh=self.match_thresh)
+        matches = np.asarray(matches, dtype=np.int64).reshape(-1, 2)
 
-        for itracked, idet in matches:
-            track = strack_pool[itracked]
-            det = detections[idet]
-            if track.state == TrackState.Tracked:
-                track.update(detections[idet], self.frame_id)
-                activated_starcks.append(track)
-            else:
-                track.re_activate(det, self.frame_id, new_id=False)
-                refind_stracks.append(track)
+        activated_starcks, refind_stracks = self.update_tracks(
+            strack_pool[matches[:, 0]], dets[matches[:, 1]], scores_keep[matches[:, 1]], clss_keep[matches[:, 1]])
 
         ''' Step 3: Second association, with low score detection boxes'''
         # association the untrack to the low score detections
-        if len(dets_second) > 0:
-            '''Detections'''
-            detections_second = [STrack(xywh, s, c) for (xywh, s, c) in zip(dets_second, scores_second, clss_second)]
-        else:
-            detections_second = []
-        r_tracked_stracks = [strack_pool[i] for i in u_track if strack_pool[i].state == TrackState.Tracked]
-        dists = matching.iou_distance(r_tracked_stracks, detections_second)
+        r_tracked_stracks = strack_pool[np.asarray(u_track, dtype=np.int64)]
+        r_tracked_stracks = r_tracked_stracks[tracks.state[r_tracked_stracks] == TrackState.Tracked]
+        dists = matching.iou_distance(tracks.tlbr(r_tracked_stracks), tlwh_to_tlbr(dets_second))
         matches, u_track, u_detection_second = matching.linear_assignment(dists, thresh=0.5)
-        for itracked, idet in matches:
-            track = r_tracked_stracks[itracked]
-            det = detections_second[idet]
-            if track.state == TrackState.Tracked:
-                track.update(det, self.frame_id)
-                activated_starcks.append(track)
-            else:
-                track.re_activate(det, self.frame_id, new_id=False)
-                refind_stracks.append(track)
-
-        for it in u_track:
-            track = r_tracked_stracks[it]
-            if not track.state == TrackState.Lost:
-                track.mark_lost()
-                lost_stracks.append(track)
+        matches = np.asarray(matches, dtype=np.int64).reshape(-1, 2)
+        activated_second, refind_second = self.update_tracks(
+            r_tracked_stracks[matches[:, 0]], dets_second[matches[:, 1]], scores_second[matches[:, 1]],
+            clss_second[matches[:, 1]])
+
+        u_track = r_tracked_stracks[np.asarray(u_track, dtype=np.int64)]
+        lost_stracks = u_track[tracks.state[u_track] != TrackState.Lost]
+        tracks.state[lost_stracks] = TrackState.Lost
 
         '''Deal with unconfirmed tracks, usually tracks with only one beginning frame'''
-        detections = [detections[i] for i in u_detection]
-        dists = matching.iou_distance(unconfirmed, detections)
+        u_detection = np.asarray(u_detection, dtype=np.int64)
+        dets, scores_keep, clss_keep = dets[u_detection], scores_keep[u_detection], clss_keep[u_detection]
+        dists = matching.iou_distance(tracks.tlbr(unconfirmed), tlwh_to_tlbr(dets))
         #if not self.args.mot20:
-        dists = matching.fuse_score(dists, detections)
+        dists = fuse_score(dists, scores_keep)
         matches, u_unconfirmed, u_detection = matching.linear_assignment(dists, thresh=0.7)
-        for itracked, idet in matches:
-            unconfirmed[itracked].update(detections[idet], self.frame_id)
-            activated_starcks.append(unconfirmed[itracked])
-        for it in u_unconfirmed:
-            track = unconfirmed[it]
-            track.mark_removed()
-            removed_stracks.append(track)
+        matches = np.asarray(matches, dtype=np.int64).reshape(-1, 2)
+        activated_unconfirmed, _ = self.update_tracks(
+            unconfirmed[matches[:, 0]], dets[matches[:, 1]], scores_keep[matches[:, 1]], clss_keep[matches[:, 1]])
+        removed_stracks = unconfirmed[np.asarray(u_unconfirmed, dtype=np.int64)]
+        tracks.state[removed_stracks] = TrackState.Removed
 
         """ Step 4: Init new stracks"""
-        for inew in u_detection:
-            track = detections[inew]
-            if track.score < self.det_thresh:
-                continue
-            track.activate(self.kalman_filter, self.frame_id)
-            activated_starcks.append(track)
+        u_detection = np.asarray(u_detection, dtype=np.int64)
+        u_detection = u_detection[scores_keep[u_detection] >= self.det_thresh]
+        new_stracks = self.activate(dets[u_detection], scores_keep[u_detection], clss_keep[u_detection])
+
         """ Step 5: Update state"""
-        for track in self.lost_stracks:
-            if self.frame_id - track.end_frame > self.max_time_lost:
-                track.mark_removed()
-                removed_stracks.append(track)
+        expired = self.lost_stracks[self.frame_id - tracks.frame_id[self.lost_stracks] > self.max_time_lost]
+        tracks.state[expired] = TrackState.Removed
+        removed_stracks = np.concatenate([removed_stracks, expired])
 
         # print('Ramained match {} s'.format(t4-t3))
 
-        self.tracked_stracks = [t for t in self.tracked_stracks if t.state == TrackState.Tracked]
+        # same order as the original track lists: activated = step 2, step 3, unconfirmed, new
+        activated_starcks = np.concatenate([activated_starcks, activated_second, activated_unconfirmed, new_stracks])
+        refind_stracks = np.concatenate([refind_stracks, refind_second])
+
+        self.tracked_stracks = self.tracked_stracks[tracks.state[self.tracked_stracks] == TrackState.Tracked]
         self.tracked_stracks = joint_stracks(self.tracked_stracks, activated_starcks)
         self.tracked_stracks = joint_stracks(self.tracked_stracks, refind_stracks)
         self.lost_stracks = sub_stracks(self.lost_stracks, self.tracked_stracks)
-        self.lost_stracks.extend(lost_stracks)
-        self.lost_stracks = sub_stracks(self.lost_stracks, self.removed_stracks)
-        self.removed_stracks.extend(removed_stracks)
-        self.tracked_stracks, self.lost_stracks = remove_duplicate_stracks(self.tracked_stracks, self.lost_stracks)
+        self.lost_stracks = np.concatenate([self.lost_stracks, lost_stracks])
+        self.lost_stracks = self.lost_stracks[~np.isin(tracks.track_id[self.lost_stracks],
+                                                        np.fromiter(self.removed_stracks, dtype=np.int64))]
+        self.removed_stracks.extend(tracks.track_id[removed_stracks].tolist())
+        self.tracked_stracks, self.lost_stracks = remove_duplicate_stracks(
+            tracks, self.tracked_stracks, self.lost_stracks)
+
+        # free the slots of tracks that left both lists
+        alive = np.zeros(tracks.capacity, dtype=bool)
+        alive[self.tracked_stracks] = True
+        alive[self.lost_stracks] = True
+        tracks.release(~alive)
+
         # get scores of lost tracks
-        output_stracks = [track for track in self.tracked_stracks if track.is_activated]
-        outputs = []
-        for t in output_stracks:
-            output= []
-            tlwh = t.tlwh
-            tid = t.track_id
-            tlwh = np.expand_dims(tlwh, axis=0)
-            xyxy = xywh2xyxy(tlwh)
-            xyxy = np.squeeze(xyxy, axis=0)
-            output.extend(xyxy)
-            output.append(tid)
-            output.append(t.cls)
-            output.append(t.score)
-            outputs.append(output)
+        output_stracks = self.tracked_stracks[tracks.is_activated[self.tracked_stracks]]
+        outputs = np.empty((len(output_stracks), 7), dtype=np.float64)
+        outputs[:, :4] = xywh2xyxy(tracks.tlwh(output_stracks))
+        outputs[:, 4] = tracks.track_id[output_stracks]
+        outputs[:, 5] = tracks.cls[output_stracks]
+        outputs[:, 6] = tracks.score[output_stracks]
 
         return outputs
-#track_id, class_id, conf
+#xyxy, track_id, class_id, conf
+
+    def memory_usage(self):
+        """
+        Number of tracked / lost / removed tracks and the bytes of state they hold.
+        """
+        return {
+            'tracked': len(self.tracked_stracks),
+            'lost': len(self.lost_stracks),
+            'removed': len(self.removed_stracks),
+            'bytes': self.tracks.nbytes + 8 * len(self.removed_stracks),
+        }
+
+
+def fuse_score(cost_matrix, det_scores):
+    if cost_matrix.size == 0:
+        return cost_matrix
+    iou_sim = 1 - cost_matrix
+    fuse_sim = iou_sim * det_scores[None, :]
+    fuse_cost = 1 - fuse_sim
+    return fuse_cost
+
 
 def joint_stracks(tlista, tlistb):
-    exists = {}
-    res = []
-    for t in tlista:
-        exists[t.track_id] = 1
-        res.append(t)
-    for t in tlistb:
-        tid = t.track_id
-        if not exists.get(tid, 0):
-            exists[tid] = 1
-            res.append(t)
-    return res
+    # slots of tlista followed by the slots of tlistb not already in it
+    return np.concatenate([tlista, tlistb[~np.isin(tlistb, tlista)]])
 
 
 def sub_stracks(tlista, tlistb):
-    stracks = {}
-    for t in tlista:
-        stracks[t.track_id] = t
-    for t in tlistb:
-        tid = t.track_id
-        if stracks.get(tid, 0):
-            del stracks[tid]
-    return list(stracks.values())
-
-
-def remove_duplicate_stracks(stracksa, stracksb):
-    pdist = matching.iou_distance(stracksa, stracksb)
-    pairs = np.where(pdist < 0.15)
-    dupa, dupb = list(), list()
-    for p, q in zip(*pairs):
-        timep = stracksa[p].frame_id - stracksa[p].start_frame
-        timeq = stracksb[q].frame_id - stracksb[q].start_frame
-        if timep > timeq:
-            dupb.append(q)
-        else:
-            dupa.append(p)
-    resa = [t for i, t in enumerate(stracksa) if not i in dupa]
-    resb = [t for i, t in enumerate(stracksb) if not i in dupb]
+    return tlista[~np.isin(tlista, tlistb)]
+
+
+def remove_duplicate_stracks(tracks, stracksa, stracksb):
+    pdist = matching.iou_distance(tracks.tlbr(stracksa), tracks.tlbr(stracksb))
+    p, q = np.where(pdist < 0.15)
+    timep = tracks.frame_id[stracksa[p]] - tracks.start_frame[stracksa[p]]
+    timeq = tracks.frame_id[stracksb[q]] - tracks.start_frame[stracksb[q]]
+    dupb = q[timep > timeq]
+    dupa = p[timep <= timeq]
+    resa = np.delete(stracksa, dupa)
+    resb = np.delete(stracksb, dupb)
     return resa, resb
@@ -1,26 +1,132 @@
 import pdb
-import pickle
 import os
+from collections import OrderedDict
+from pathlib import Path
+import time
 
 import cv2
 import numpy as np
 
 
+class AffineLog:
+    """
+    Append-only on-disk log of 2x3 affines keyed by (stream, frame), one file per stream under `root`
+    of records int64 frame, float64 (2, 3) affine. Nothing is rewritten; a record half written by a
+    crash is cut off before the next append. A frame logged twice reads as its last record.
+
+    Lookups go through an LRU of `capacity` affines. On a miss the file of the stream is memory-mapped
+    and its frame column sorted once; affines appended after that sit in a side table of at most
+    `capacity` entries, when it fills up the file is mapped again on the next miss. Memory stays
+    bounded however long a stream runs.
+    """
+
+    RECORD = np.dtype([("frame", "<i8"), ("affine", "<f8", (2, 3))])
+
+    def __init__(self, root="./cache/affines", capacity=4096):
+        self.root = Path(root)
+        self.capacity = capacity
+        self._lru = OrderedDict()
+        self._mapped = {}  # stream -> (sorted frames, order, records)
+        self._new = {}  # stream -> {frame: affine} appended since the stream was mapped
+        self._files = {}
+
+    def _path(self, stream):
+        return self.root / (stream.replace(os.sep, "_") + ".bin")
+
+    def _map(self, stream):
+        if stream in self._files:
+            self._files[stream].flush()
+        path = self._path(stream)
+        n = os.path.getsize(path) // self.RECORD.itemsize if path.exists() else 0
+        records = np.memmap(path, dtype=self.RECORD, mode="r", shape=(n,)) if n else np.zeros(0, self.RECORD)
+        order = np.argsort(records["frame"], kind="stable")
+        self._mapped[stream] = (np.asarray(records["frame"][order]), order, records)
+        self._new[stream] = {}
+
+    def _remember(self, key, A):
+        self._lru[key] = A
+        self._lru.move_to_end(key)
+        if len(self._lru) > self.capacity:
+            self._lru.popitem(last=False)
+
+    def get(self, stream, frame):
+        """The affine of `frame` of `stream`, None if it was never logged."""
+        key = (stream, frame)
+        A = self._lru.get(key)
+        if A is not None:
+            self._lru.move_to_end(key)
+            return A
+        if stream not in self._mapped:
+            self._map(stream)
+        A = self._new[stream].get(frame)
+        if A is None:
+            frames, order, records = self._mapped[stream]
+            i = np.searchsorted(frames, frame, side="right") - 1  # the last record of the frame
+            if i < 0 or frames[i] != frame:
+                return None
+            A = np.array(records["affine"][order[i]])
+        self._remember(key, A)
+        return A
+
+    def put(self, stream, frame, A):
+        f = self._files.get(stream)
+        if f is None:
+            self.root.mkdir(parents=True, exist_ok=True)
+            f = open(self._path(stream), "ab")
+            f.truncate(f.tell() // self.RECORD.itemsize * self.RECORD.itemsize)
+            self._files[stream] = f
+        record = np.zeros(1, dtype=self.RECORD)
+        record["frame"], record["affine"] = frame, A
+        f.write(record.tobytes())
+        if stream in self._mapped:
+            new = self._new[stream]
+            new[frame] = A
+            if len(new) > self.capacity:
+                del self._mapped[stream], self._new[stream]
+        if (stream, frame) in self._lru:
+            self._remember((stream, frame), A)
+
+    def __len__(self):
+        return len(self._lru)
+
+    def flush(self):
+        for f in self._files.values():
+            f.flush()
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+
+
 class CMCComputer:
-    def __init__(self, minimum_features=10, method="sparse"):
+    """
+    Camera motion compensation of Deep OC-SORT, the affine warp from the previous frame.
+
+    The frame is estimated at 1/downscale of its size (the translation is scaled back), optical flow
+    runs over `pyramid_levels` levels. The sparse method tracks its keypoints from frame to frame and
+    only runs goodFeaturesToTrack again when fewer than `redetect_ratio` of the last detected ones are
+    still tracked. Per-frame cost is kept in `frame_stats`, totals in stats().
+
+    The affines of tags "<stream>:<frame>" are appended to an AffineLog under `cache_dir`, other tags
+    are not logged. Estimation never reads the log back. With `cached_only` nothing is estimated,
+    the affines are looked up in the log instead and a frame missing from it is the identity.
+    """
+
+    def __init__(self, minimum_features=10, method="sparse", downscale=2, pyramid_levels=3, max_corners=3000,
+                 redetect_ratio=0.5, cache_dir="./cache/affines", cache_size=4096):
         assert method in ["file", "sparse", "sift"]
 
-        os.makedirs("./cache", exist_ok=True)
-        self.cache_path = "./cache/affine_ocsort.pkl"
-        self.cache = {}
-        if os.path.exists(self.cache_path):
-            with open(self.cache_path, "rb") as fp:
-                self.cache = pickle.load(fp)
+        self.cache = AffineLog(cache_dir, capacity=cache_size)
+        self.cached_only = False
         self.minimum_features = minimum_features
+        self.downscale = max(1, int(downscale))
+        self.pyramid_levels = pyramid_levels
+        self.redetect_ratio = redetect_ratio
         self.prev_img = None
         self.prev_desc = None
         self.sparse_flow_param = dict(
-            maxCorners=3000,
+            maxCorners=max_corners,
             qualityLevel=0.01,
             minDistance=1,
             blockSize=3,
@@ -28,6 +134,16 @@ class CMCComputer:
             k=0.04,
         )
         self.file_computed = {}
+        self._mask = None
+        self._detected = 0  # keypoints found by the last goodFeaturesToTrack
+
+        # cost accounting
+        self.frame_stats = {}
+        self.frames = 0
+        self.redetections = 0
+        self.time_total = 0.
+        self.time_max = 0.
+        self.keypoints_total = 0
 
         self.comp_function = None
         if method == "sparse":
@@ -62,24 +178,78 @@ class CMCComputer:
                     continue
                 f_name = os.path.join("./cache/cmc_files/MOTChallenge/", f_name)
                 self.file_names[tag] = f_name
+        self.method = method
 
     def compute_affine(self, img, bbox, tag):
-        img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        if tag in self.cache:
-            A = self.cache[tag]
-            return A
-        mask = np.ones_like(img, dtype=np.uint8)
-        if bbox.shape[0] > 0:
-            bbox = np.round(bbox).astype(np.int32)
-            bbox[bbox < 0] = 0
-            for bb in bbox:
-                mask[bb[1] : bb[3], bb[0] : bb[2]] = 0
-
-        A = self.comp_function(img, mask, tag)
-        self.cache[tag] = A
+        stream, _, frame = tag.partition(":")
+        key = (stream, int(frame)) if frame.isdigit() else None
+        if self.cached_only:
+            A = self.cache.get(*key) if key is not None else None
+            return A if A is not None else np.eye(2, 3)
+        t = time.perf_counter()
+        self.frame_stats = {}
+        if self.method == "file":
+            A = self._affine_file(None, None, tag)
+        else:
+            frame = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+            h, w = frame.shape
+            if self.downscale > 1:
+                frame = cv2.resize(frame, (w // self.downscale, h // self.downscale))
+            boxes = np.zeros((0, 4), dtype=np.int32)
+            if bbox.shape[0] > 0:
+                boxes = np.round(np.asarray(bbox, dtype=np.float64)[:, :4] / self.downscale).astype(np.int32)
+                boxes[boxes < 0] = 0
+            A = self.comp_function(frame, boxes, tag)
+            A = np.array(A, dtype=np.float64)
+            A[:, 2] *= self.downscale
 
+        if key is not None:
+            self.cache.put(*key, A)
+        dt = time.perf_counter() - t
+        self.frame_stats["ms"] = dt * 1E3
+        self.frames += 1
+        self.time_total += dt
+        self.time_max = max(self.time_max, dt)
+        self.keypoints_total += self.frame_stats.get("keypoints", 0)
         return A
 
+    def stats(self):
+        n = max(self.frames, 1)
+        return {
+            "frames": self.frames,
+            "ms": self.time_total / n * 1E3,
+            "max_ms": self.time_max * 1E3,
+            "keypoints": self.keypoints_total / n,
+            "redetections": self.redetections,
+        }
+
+    def _box_mask(self, shape, boxes):
+        """uint8 mask of the frame, 0 inside the boxes. One buffer is reused, filled box by box."""
+        if self._mask is None or self._mask.shape != shape:
+            self._mask = np.empty(shape, dtype=np.uint8)
+        self._mask.fill(1)
+        for x1, y1, x2, y2 in boxes.tolist():
+            self._mask[y1:y2, x1:x2] = 0
+        return self._mask
+
+    @staticmethod
+    def _outside_boxes(points, boxes, shape):
+        """Mask of the (N, 2) points inside the frame and outside all boxes."""
+        x, y = points[:, 0:1], points[:, 1:2]
+        keep = (points[:, 0] >= 0) & (points[:, 1] >= 0) & (points[:, 0] < shape[1]) & (points[:, 1] < shape[0])
+        if len(boxes):
+            keep &= ~((x >= boxes[:, 0]) & (x < boxes[:, 2]) & (y >= boxes[:, 1]) & (y < boxes[:, 3])).any(1)
+        return keep
+
+    def _detect(self, frame, boxes):
+        keypoints = cv2.goodFeaturesToTrack(frame, mask=self._box_mask(frame.shape, boxes), **self.sparse_flow_param)
+        if keypoints is None:
+            keypoints = np.zeros((0, 1, 2), dtype=np.float32)
+        self._detected = len(keypoints)
+        self.redetections += 1
+        self.frame_stats["redetected"] = True
+        return keypoints
+
     def _load_file(self, name):
         affines = []
         with open(self.file_names[name], "r") as fp:
@@ -104,10 +274,11 @@ class CMCComputer:
 
         return self.file_affines[name][int(num) - 1]
 
-    def _affine_sift(self, frame, mask, tag):
+    def _affine_sift(self, frame, boxes, tag):
         A = np.eye(2, 3)
         detector = cv2.SIFT_create()
-        kp, desc = detector.detectAndCompute(frame, mask)
+        kp, desc = detector.detectAndCompute(frame, self._box_mask(frame.shape, boxes))
+        self.frame_stats["keypoints"] = len(kp)
         if self.prev_desc is None:
             self.prev_desc = [kp, desc]
             return A
@@ -133,38 +304,45 @@ class CMCComputer:
         self.prev_desc = [kp, desc]
         return A
 
-    def _affine_sparse_flow(self, frame, mask, tag):
+    def _affine_sparse_flow(self, frame, boxes, tag):
         # Initialize
         A = np.eye(2, 3)
 
-        # find the keypoints
-        keypoints = cv2.goodFeaturesToTrack(frame, mask=mask, **self.sparse_flow_param)
-
-        # Handle first frame
-        if self.prev_img is None:
+        # Handle first frame, or a frame without anything to track
+        if self.prev_img is None or len(self.prev_desc) == 0:
             self.prev_img = frame
-            self.prev_desc = keypoints
+            self.prev_desc = self._detect(frame, boxes)
+            self.frame_stats["keypoints"] = len(self.prev_desc)
             return A
 
-        matched_kp, status, err = cv2.calcOpticalFlowPyrLK(self.prev_img, frame, self.prev_desc, None)
-        matched_kp = matched_kp.reshape(-1, 2)
-        status = status.reshape(-1)
-        prev_points = self.prev_desc.reshape(-1, 2)
-        prev_points = prev_points[status]
-        curr_points = matched_kp[status]
+        matched_kp, status, err = cv2.calcOpticalFlowPyrLK(self.prev_img, frame, self.prev_desc, None,
+                                                           maxLevel=self.pyramid_levels)
+        status = status.reshape(-1).astype(bool)
+        prev_points = self.prev_desc.reshape(-1, 2)[status]
+        curr_points = matched_kp.reshape(-1, 2)[status]
+        self.frame_stats["keypoints"] = len(curr_points)
 
         # Find rigid matrix
+        inliers = None
         if prev_points.shape[0] > self.minimum_features:
-            A, _ = cv2.estimateAffinePartial2D(prev_points, curr_points, method=cv2.RANSAC)
+            A, inliers = cv2.estimateAffinePartial2D(prev_points, curr_points, method=cv2.RANSAC)
         else:
             print("Warning: not enough matching points")
         if A is None:
             A = np.eye(2, 3)
 
+        # keep tracking the background points, detect again when too many were lost
+        keep = self._outside_boxes(curr_points, boxes, frame.shape)
+        if inliers is not None:
+            keep &= inliers.reshape(-1).astype(bool)
+        keypoints = curr_points[keep].reshape(-1, 1, 2)
+        if len(keypoints) <= self.minimum_features or len(keypoints) < self.redetect_ratio * self._detected:
+            keypoints = self._detect(frame, boxes)
+
         self.prev_img = frame
         self.prev_desc = keypoints
         return A
 
     def dump_cache(self):
-        with open(self.cache_path, "wb") as fp:
-            pickle.dump(self.cache, fp)
+        # the log is appended as affines are computed, only flush it
+        self.cache.flush()
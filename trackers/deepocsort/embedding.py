@@ -1,47 +1,151 @@
 import pdb
 from collections import OrderedDict
+import json
 import os
-import pickle
+from pathlib import Path
 
 import torch
 import cv2
 import torchvision
 import numpy as np
-
+from torchvision.ops import roi_align
+
+
+class EmbeddingStore:
+    """
+    Append-only embedding store of one sequence, keyed by (frame, box):
+
+        meta.json     embedding dim and dtype, written once when the store is created
+        index.bin     int32 (N, 5)   frame, x1, y1, x2, y2
+        emb.bin       dtype (N, D)
+
+    Rows are appended to both files as they are computed, nothing is rewritten. Opening a store
+    memory-maps the files and sorts the frame column once, so a store of a whole dataset reopens
+    in the time of an argsort instead of unpickling every embedding into RAM. A row half written
+    by a crash is dropped when the store is opened again.
+
+    Rows appended after that are looked up in memory until there are more than `capacity` of
+    them, then the files are mapped again, so memory stays bounded on long sequences.
+    """
+
+    def __init__(self, path, capacity=4096):
+        self.path = Path(path)
+        self.capacity = capacity
+        self.dim = None
+        self.dtype = None
+        self._files = None
+        if (self.path / "meta.json").exists():
+            with open(self.path / "meta.json") as f:
+                meta = json.load(f)
+            self.dim, self.dtype = meta["dim"], np.dtype(meta["dtype"])
+        self._map()
+
+    def _map(self):
+        self._rows = 0
+        self._index = np.zeros((0, 5), dtype=np.int32)
+        self._embs = None
+        self._new = {}  # frame -> [(boxes, embs)] appended since the files were mapped
+        self._new_rows = 0
+        if self.dim is not None:
+            row_bytes = self.dim * self.dtype.itemsize
+            self._rows = min(os.path.getsize(self.path / "index.bin") // 20,
+                             os.path.getsize(self.path / "emb.bin") // row_bytes)
+            if self._rows:
+                self._index = np.memmap(self.path / "index.bin", dtype=np.int32, mode="r", shape=(self._rows, 5))
+                self._embs = np.memmap(self.path / "emb.bin", dtype=self.dtype, mode="r",
+                                       shape=(self._rows, self.dim))
+        self._order = np.argsort(self._index[:, 0], kind="stable")
+        self._frames = np.asarray(self._index[self._order, 0])
+
+    def __len__(self):
+        return self._rows + self._new_rows
+
+    def get(self, frame, boxes):
+        """Embeddings of the (N, 4) int boxes of `frame`, and the mask of the boxes found."""
+        boxes = np.asarray(boxes, dtype=np.int32).reshape(-1, 4)
+        found = np.zeros(len(boxes), dtype=bool)
+        if self.dim is None:
+            return None, found
+        embs = np.zeros((len(boxes), self.dim), dtype=self.dtype)
+
+        lo, hi = np.searchsorted(self._frames, [frame, frame + 1])
+        rows = self._order[lo:hi]
+        candidates = [(self._index[rows, 1:], self._embs[rows] if len(rows) else None)]
+        candidates += self._new.get(frame, [])
+        for cand_boxes, cand_embs in candidates:
+            if not len(cand_boxes):
+                continue
+            same = (boxes[:, None] == cand_boxes[None]).all(2) & ~found[:, None]
+            hit = same.any(1)
+            embs[hit] = cand_embs[same[hit].argmax(1)]
+            found |= hit
+        return embs, found
+
+    def put(self, frame, boxes, embs):
+        boxes = np.asarray(boxes, dtype=np.int32).reshape(-1, 4)
+        embs = np.asarray(embs)
+        if self.dim is None:
+            self.dim, self.dtype = embs.shape[1], embs.dtype
+            self.path.mkdir(parents=True, exist_ok=True)
+            with open(self.path / "meta.json", "w") as f:
+                json.dump({"dim": self.dim, "dtype": self.dtype.name}, f)
+        if self._files is None:
+            # cut a half written row off before appending behind it
+            for name, row_bytes in (("index.bin", 20), ("emb.bin", self.dim * self.dtype.itemsize)):
+                with open(self.path / name, "ab") as f:
+                    f.truncate(self._rows * row_bytes)
+            self._files = [open(self.path / "index.bin", "ab"), open(self.path / "emb.bin", "ab")]
+        embs = embs.astype(self.dtype, copy=False)
+        index = np.concatenate([np.full((len(boxes), 1), frame, dtype=np.int32), boxes], axis=1)
+        self._files[0].write(index.tobytes())
+        self._files[1].write(np.ascontiguousarray(embs).tobytes())
+        self._new.setdefault(frame, []).append((boxes, embs))
+        self._new_rows += len(boxes)
+        if self._new_rows > self.capacity:
+            self.flush()
+            self._map()
+
+    def flush(self):
+        if self._files is not None:
+            for f in self._files:
+                f.flush()
+
+    def close(self):
+        if self._files is not None:
+            for f in self._files:
+                f.close()
+            self._files = None
 
 
 class EmbeddingComputer:
-    def __init__(self, dataset):
-        self.model = None
+    def __init__(self, dataset, model=None, device=None, half=None, cache_dir="./cache/embeddings/"):
+        self.model = model
         self.dataset = dataset
         self.crop_size = (128, 384)
-        os.makedirs("./cache/embeddings/", exist_ok=True)
-        self.cache_path = "./cache/embeddings/{}_embedding.pkl"
-        self.cache = {}
+        self.device = torch.device(device if device is not None else "cuda" if torch.cuda.is_available() else "cpu")
+        self.half = self.device.type != "cpu" if half is None else half
+        os.makedirs(cache_dir, exist_ok=True)
+        self.cache_dir = cache_dir
+        self.cache = None  # EmbeddingStore of the current sequence
         self.cache_name = ""
 
     def load_cache(self, path):
+        if self.cache is not None:
+            self.cache.close()
         self.cache_name = path
-        cache_path = self.cache_path.format(path)
-        if os.path.exists(cache_path):
-            with open(cache_path, "rb") as fp:
-                self.cache = pickle.load(fp)
+        self.cache = EmbeddingStore(os.path.join(self.cache_dir, path))
 
     def compute_embedding(self, img, bbox, tag, is_numpy=True):
-        if self.cache_name != tag.split(":")[0]:
-            self.load_cache(tag.split(":")[0])
-
-        if tag in self.cache:
-            embs = self.cache[tag]
-            if embs.shape[0] != bbox.shape[0]:
-                raise RuntimeError(
-                    "ERROR: The number of cached embeddings don't match the "
-                    "number of detections.\nWas the detector model changed? Delete cache if so."
-                )
-            return embs
-
-        if self.model is None:
-            self.initialize_model()
+        """
+        Embeddings of the boxes of one frame. `tag` is "<sequence>:<frame>", the embeddings are kept in
+        the store of the sequence under (frame, clipped box) and only the boxes not in it yet are run
+        through the model. A tag without a frame number is not cached.
+        """
+        name, _, frame = tag.partition(":")
+        if not frame.isdigit():
+            name = None
+        elif self.cache_name != name:
+            self.load_cache(name)
 
         # Make sure bbox is within image frame
         if is_numpy:
@@ -54,33 +158,50 @@ class EmbeddingComputer:
         results[:, 2] = results[:, 2].clip(0, w)
         results[:, 3] = results[:, 3].clip(0, h)
 
-        # Generate all the crops
-        crops = []
-        for p in results:
-            if is_numpy:
-                crop = img[p[1] : p[3], p[0] : p[2]]
-                crop = cv2.cvtColor(crop, cv2.COLOR_BGR2RGB)
-                crop = cv2.resize(crop, self.crop_size, interpolation=cv2.INTER_LINEAR)
-                crop = torch.as_tensor(crop.astype("float32").transpose(2, 0, 1))
-                crop = crop.unsqueeze(0)
-            else:
-                crop = img[:, :, p[1] : p[3], p[0] : p[2]]
-                crop = torchvision.transforms.functional.resize(crop, self.crop_size)
+        if name is None:
+            return self._embed(img, results, is_numpy)
+        embs, found = self.cache.get(int(frame), results)
+        if found.all():
+            return embs
+        new = self._embed(img, results[~found], is_numpy)
+        self.cache.put(int(frame), results[~found], new)
+        if embs is None:
+            return new
+        embs[~found] = new
+        return embs
 
-            crops.append(crop)
+    def _crops(self, img, boxes, is_numpy):
+        """
+        RGB crops of all boxes resized to crop_size in one batch. On GPU the frame is uploaded once and
+        resampled by a single roi_align; on CPU, where roi_align is slower than cv2, the crops are
+        resized by cv2 and uploaded together.
+        """
+        w, h = self.crop_size
+        if is_numpy and self.device.type == "cpu":
+            crops = np.stack([cv2.resize(cv2.cvtColor(img[y1:y2, x1:x2], cv2.COLOR_BGR2RGB), self.crop_size,
+                                         interpolation=cv2.INTER_LINEAR) for x1, y1, x2, y2 in boxes])
+            return torch.from_numpy(crops).permute(0, 3, 1, 2).float()
+        if is_numpy:
+            frame = torch.from_numpy(np.ascontiguousarray(img)).to(self.device)
+            frame = frame.permute(2, 0, 1).flip(0).unsqueeze(0).float()  # BGR to RGB
+        else:
+            frame = img.to(self.device).float()
+        rois = torch.as_tensor(boxes, dtype=torch.float32, device=self.device)
+        rois = torch.cat([rois.new_zeros((len(rois), 1)), rois], dim=1)  # all boxes from image 0
+        return roi_align(frame, rois, output_size=(h, w), spatial_scale=1., sampling_ratio=-1, aligned=True)
 
-        crops = torch.cat(crops, dim=0)
+    def _embed(self, img, boxes, is_numpy):
+        if self.model is None:
+            self.initialize_model()
 
         # Create embeddings and l2 normalize them
         with torch.no_grad():
-            crops = crops.cuda()
-            crops = crops.half()
+            crops = self._crops(img, boxes, is_numpy).to(self.device)
+            if self.half:
+                crops = crops.half()
             embs = self.model(crops)
         embs = torch.nn.functional.normalize(embs)
-        embs = embs.cpu().numpy()
-
-        self.cache[tag] = embs
-        return embs
+        return embs.cpu().numpy()
 
     def initialize_model(self):
         """
@@ -106,11 +227,12 @@ class EmbeddingComputer:
 
         model = FastReID(path)
         model.eval()
-        model.cuda()
-        model.half()
+        model.to(self.device)
+        if self.half:
+            model.half()
         self.model = model
 
     def dump_cache(self):
-        if self.cache_name:
-            with open(self.cache_path.format(self.cache_name), "wb") as fp:
-                pickle.dump(self.cache, fp)
+        # the store is written as embeddings are computed, only flush it
+        if self.cache is not None:
+            self.cache.flush()
@@ -338,6 +338,7 @@ class OCSort(object):
         cmc_off=False,
         aw_off=False,
         new_kf_off=False,
+        cmc_downscale=2,
         **kwargs
     ):
         """
@@ -358,9 +359,12 @@ class OCSort(object):
         KalmanBoxTracker.count = 0
 
         self.embedder = ReIDDetectMultiBackend(weights=model_weights, device=device, fp16=fp16)
-        self.cmc = CMCComputer()
+        self.cmc = CMCComputer(downscale=cmc_downscale)
         self.embedding_off = embedding_off
         self.cmc_off = cmc_off
+        # set by det_cache: the affine of the next update is logged as "<cmc_stream>:<cmc_frame>"
+        self.cmc_stream = None
+        self.cmc_frame = None
         self.aw_off = aw_off
         self.new_kf_off = new_kf_off
 
@@ -399,6 +403,8 @@ class OCSort(object):
 
         # CMC
         if not self.cmc_off:
+            if self.cmc_stream is not None and tag == 'blub':
+                tag = f"{self.cmc_stream}:{self.cmc_frame}"
             transform = self.cmc.compute_affine(img_numpy, dets[:, :4], tag)
             for trk in self.trackers:
                 trk.apply_affine_correction(transform)
@@ -532,13 +538,10 @@ class OCSort(object):
         return x1, y1, x2, y2
     
     def _get_features(self, bbox_xywh, ori_img):
-        im_crops = []
-        for box in bbox_xywh:
-            x1, y1, x2, y2 = self._xywh_to_xyxy(box)
-            im = ori_img[y1:y2, x1:x2]
-            im_crops.append(im)
-        if im_crops:
-            features = self.embedder(im_crops).cpu()
+        # all crops are cut and resized on device from the one uploaded frame
+        xyxys = [self._xywh_to_xyxy(box) for box in bbox_xywh]
+        if xyxys:
+            features = self.embedder(ori_img, xyxys=np.array(xyxys)).cpu()
         else:
             features = np.array([])
         
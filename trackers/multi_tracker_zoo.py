@@ -19,7 +19,7 @@ def create_tracker(tracker_type, tracker_config, reid_weights, device, half):
             nn_budget=cfg.strongsort.nn_budget,
             mc_lambda=cfg.strongsort.mc_lambda,
             ema_alpha=cfg.strongsort.ema_alpha,
-
+            cmc_method=cfg.strongsort.cmc_method,
         )
         return strongsort
     
@@ -43,7 +43,8 @@ def create_tracker(tracker_type, tracker_config, reid_weights, device, half):
             track_thresh=cfg.bytetrack.track_thresh,
             match_thresh=cfg.bytetrack.match_thresh,
             track_buffer=cfg.bytetrack.track_buffer,
-            frame_rate=cfg.bytetrack.frame_rate
+            frame_rate=cfg.bytetrack.frame_rate,
+            removed_buffer=cfg.bytetrack.removed_buffer
         )
         return bytetracker
     
@@ -61,7 +62,8 @@ def create_tracker(tracker_type, tracker_config, reid_weights, device, half):
             appearance_thresh=cfg.botsort.appearance_thresh,
             cmc_method =cfg.botsort.cmc_method,
             frame_rate=cfg.botsort.frame_rate,
-            lambda_=cfg.botsort.lambda_
+            lambda_=cfg.botsort.lambda_,
+            removed_buffer=cfg.botsort.removed_buffer
         )
         return botsort
     elif tracker_type == 'deepocsort':
@@ -77,6 +79,7 @@ def create_tracker(tracker_type, tracker_config, reid_weights, device, half):
             delta_t=cfg.deepocsort.delta_t,
             asso_func=cfg.deepocsort.asso_func,
             inertia=cfg.deepocsort.inertia,
+            cmc_downscale=cfg.deepocsort.get('cmc_downscale', 2),
         )
         return botsort
     else:
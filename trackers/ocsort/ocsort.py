@@ -5,6 +5,7 @@ from __future__ import print_function
 
 import numpy as np
 from .association import *
+from .kalmanfilter import KalmanFilter
 from yolov8.ultralytics.yolo.utils.ops import xywh2xyxy
 
 
@@ -60,31 +61,20 @@ class KalmanBoxTracker(object):
     This class represents the internal state of individual tracked objects observed as bbox.
     """
     count = 0
+    kf = KalmanFilter()  # stateless, shared by all trackers
 
-    def __init__(self, bbox, cls, delta_t=3, orig=False):
+    def __init__(self, bbox, cls, delta_t=3):
         """
         Initialises a tracker using initial bounding box.
 
         """
-        # define constant velocity model
-        if not orig:
-          from .kalmanfilter import KalmanFilterNew as KalmanFilter
-          self.kf = KalmanFilter(dim_x=7, dim_z=4)
-        else:
-          from filterpy.kalman import KalmanFilter
-          self.kf = KalmanFilter(dim_x=7, dim_z=4)
-        self.kf.F = np.array([[1, 0, 0, 0, 1, 0, 0], [0, 1, 0, 0, 0, 1, 0], [0, 0, 1, 0, 0, 0, 1], [
-                            0, 0, 0, 1, 0, 0, 0],  [0, 0, 0, 0, 1, 0, 0], [0, 0, 0, 0, 0, 1, 0], [0, 0, 0, 0, 0, 0, 1]])
-        self.kf.H = np.array([[1, 0, 0, 0, 0, 0, 0], [0, 1, 0, 0, 0, 0, 0],
-                            [0, 0, 1, 0, 0, 0, 0], [0, 0, 0, 1, 0, 0, 0]])
-
-        self.kf.R[2:, 2:] *= 10.
-        self.kf.P[4:, 4:] *= 1000.  # give high uncertainty to the unobservable initial velocities
-        self.kf.P *= 10.
-        self.kf.Q[-1, -1] *= 0.01
-        self.kf.Q[4:, 4:] *= 0.01
-
-        self.kf.x[:4] = convert_bbox_to_z(bbox)
+        # constant velocity model on (x, y, s, r, x', y', s')
+        self.mean, self.covariance = self.kf.initiate(convert_bbox_to_z(bbox))
+        # state of the first missed frame and the last observation, kept for the ORU
+        self.frozen = None
+        self.observed = False
+        self.last_z = None
+
         self.time_since_update = 0
         self.id = KalmanBoxTracker.count
         KalmanBoxTracker.count += 1
@@ -109,60 +99,116 @@ class KalmanBoxTracker(object):
         """
         Updates the state vector with observed bbox.
         """
-        
         if bbox is not None:
-            self.conf = bbox[-1]
-            self.cls = cls
-            if self.last_observation.sum() >= 0:  # no previous observation
-                previous_box = None
-                for i in range(self.delta_t):
-                    dt = self.delta_t - i
-                    if self.age - dt in self.observations:
-                        previous_box = self.observations[self.age-dt]
-                        break
-                if previous_box is None:
-                    previous_box = self.last_observation
-                """
-                  Estimate the track speed direction with observations \Delta t steps away
-                """
-                self.velocity = speed_direction(previous_box, bbox)
-            
+            KalmanBoxTracker.multi_update([self], [bbox], [cls])
+        else:
+            self.mark_missed()
+
+    def observe(self, bbox, cls):
+        """
+        Observation bookkeeping of update(), without the Kalman step.
+        """
+        self.conf = bbox[-1]
+        self.cls = cls
+        if self.last_observation.sum() >= 0:  # no previous observation
+            previous_box = None
+            for i in range(self.delta_t):
+                dt = self.delta_t - i
+                if self.age - dt in self.observations:
+                    previous_box = self.observations[self.age-dt]
+                    break
+            if previous_box is None:
+                previous_box = self.last_observation
             """
-              Insert new observations. This is a ugly way to maintain both self.observations
-              and self.history_observations. Bear it for the moment.
+              Estimate the track speed direction with observations \Delta t steps away
             """
-            self.last_observation = bbox
-            self.observations[self.age] = bbox
-            self.history_observations.append(bbox)
-
-            self.time_since_update = 0
-            self.history = []
-            self.hits += 1
-            self.hit_streak += 1
-            self.kf.update(convert_bbox_to_z(bbox))
-        else:
-            self.kf.update(bbox)
+            self.velocity = speed_direction(previous_box, bbox)
+
+        """
+          Insert new observations. This is a ugly way to maintain both self.observations
+          and self.history_observations. Bear it for the moment.
+        """
+        self.last_observation = bbox
+        self.observations[self.age] = bbox
+        self.history_observations.append(bbox)
+
+        self.time_since_update = 0
+        self.history = []
+        self.hits += 1
+        self.hit_streak += 1
+
+    def mark_missed(self):
+        """
+        No observation this frame, freeze the state for a later re-update.
+        """
+        if self.observed:
+            self.frozen = (self.mean.copy(), self.covariance.copy(), self.last_z)
+        self.observed = False
+
+    @staticmethod
+    def multi_update(trackers, bboxes, clss):
+        """
+        Update matched trackers with their observed bboxes, the Kalman correction (and the ORU of
+        trackers coming back from a gap) runs batched over all of them.
+        """
+        if len(trackers) == 0:
+            return
+        z = np.array([convert_bbox_to_z(bbox).reshape(-1) for bbox in bboxes])
+        # the gap is counted before observe() resets time_since_update
+        reupdate = [i for i, trk in enumerate(trackers) if not trk.observed and trk.frozen is not None]
+        gap = np.array([trackers[i].time_since_update for i in reupdate], dtype=float)
+        for trk, bbox, cls in zip(trackers, bboxes, clss):
+            trk.observe(bbox, cls)
+
+        mean = np.array([trk.mean for trk in trackers])
+        covariance = np.array([trk.covariance for trk in trackers])
+        if len(reupdate):
+            frozen = [trackers[i].frozen for i in reupdate]
+            mean[reupdate], covariance[reupdate] = KalmanBoxTracker.kf.multi_reupdate(
+                np.array([f[0] for f in frozen]), np.array([f[1] for f in frozen]),
+                np.array([f[2] for f in frozen]), z[reupdate], gap)
+        mean, covariance = KalmanBoxTracker.kf.multi_update(mean, covariance, z)
+        for i, trk in enumerate(trackers):
+            trk.mean, trk.covariance = mean[i], covariance[i]
+            trk.last_z = z[i]
+            trk.frozen = None
+            trk.observed = True
+
+    @staticmethod
+    def multi_predict(trackers):
+        """
+        Advances the state vectors of all trackers and returns their predicted bounding boxes (Nx4).
+        """
+        if len(trackers) == 0:
+            return np.empty((0, 4))
+        mean = np.array([trk.mean for trk in trackers])
+        covariance = np.array([trk.covariance for trk in trackers])
+        mean[mean[:, 6] + mean[:, 2] <= 0, 6] = 0.
+        mean, covariance = KalmanBoxTracker.kf.multi_predict(mean, covariance)
+        w = np.sqrt(mean[:, 2] * mean[:, 3])
+        h = mean[:, 2] / w
+        boxes = np.stack([mean[:, 0] - w/2., mean[:, 1] - h/2., mean[:, 0] + w/2., mean[:, 1] + h/2.], axis=1)
+        for i, trk in enumerate(trackers):
+            trk.mean, trk.covariance = mean[i], covariance[i]
+            trk.age += 1
+            if(trk.time_since_update > 0):
+                trk.hit_streak = 0
+            trk.time_since_update += 1
+            trk.history.append(boxes[i:i + 1])
+        return boxes
 
     def predict(self):
         """
         Advances the state vector and returns the predicted bounding box estimate.
         """
-        if((self.kf.x[6]+self.kf.x[2]) <= 0):
-            self.kf.x[6] *= 0.0
-
-        self.kf.predict()
-        self.age += 1
-        if(self.time_since_update > 0):
-            self.hit_streak = 0
-        self.time_since_update += 1
-        self.history.append(convert_x_to_bbox(self.kf.x))
+        KalmanBoxTracker.multi_predict([self])
         return self.history[-1]
 
     def get_state(self):
         """
         Returns the current bounding box estimate.
         """
-        return convert_x_to_bbox(self.kf.x)
+        return convert_x_to_bbox(self.mean)
 
 
 """
@@ -224,15 +270,11 @@ class OCSort(object):
         remain_inds = confs > self.det_thresh
         dets = output_results[remain_inds]
 
-        # get predicted locations from existing trackers.
+        # get predicted locations from existing trackers, all in one batch.
         trks = np.zeros((len(self.trackers), 5))
-        to_del = []
+        trks[:, :4] = KalmanBoxTracker.multi_predict(self.trackers)
         ret = []
-        for t, trk in enumerate(trks):
-            pos = self.trackers[t].predict()[0]
-            trk[:] = [pos[0], pos[1], pos[2], pos[3], 0]
-            if np.any(np.isnan(pos)):
-                to_del.append(t)
+        to_del = np.flatnonzero(np.isnan(trks).any(axis=1))
         trks = np.ma.compress_rows(np.ma.masked_invalid(trks))
         for t in reversed(to_del):
             self.trackers.pop(t)
@@ -248,8 +290,10 @@ class OCSort(object):
         """
         matched, unmatched_dets, unmatched_trks = associate(
             dets, trks, self.iou_threshold, velocities, k_observations, self.inertia)
-        for m in matched:
-            self.trackers[m[1]].update(dets[m[0], :5], dets[m[0], 5])
+        # matches of all rounds are collected and updated in one batch at the end, the association
+        # rounds only read the predictions and observations gathered above.
+        upd_trks = [m[1] for m in matched]
+        upd_dets = [dets[m[0]] for m in matched]
 
         """
             Second round of associaton by OCR
@@ -271,7 +315,8 @@ class OCSort(object):
                     det_ind, trk_ind = m[0], unmatched_trks[m[1]]
                     if iou_left[m[0], m[1]] < self.iou_threshold:
                         continue
-                    self.trackers[trk_ind].update(dets_second[det_ind, :5], dets_second[det_ind, 5])
+                    upd_trks.append(trk_ind)
+                    upd_dets.append(dets_second[det_ind])
                     to_remove_trk_indices.append(trk_ind)
                 unmatched_trks = np.setdiff1d(unmatched_trks, np.array(to_remove_trk_indices))
 
@@ -293,12 +338,15 @@ class OCSort(object):
                     det_ind, trk_ind = unmatched_dets[m[0]], unmatched_trks[m[1]]
                     if iou_left[m[0], m[1]] < self.iou_threshold:
                         continue
-                    self.trackers[trk_ind].update(dets[det_ind, :5], dets[det_ind, 5])
+                    upd_trks.append(trk_ind)
+                    upd_dets.append(dets[det_ind])
                     to_remove_det_indices.append(det_ind)
                     to_remove_trk_indices.append(trk_ind)
                 unmatched_dets = np.setdiff1d(unmatched_dets, np.array(to_remove_det_indices))
                 unmatched_trks = np.setdiff1d(unmatched_trks, np.array(to_remove_trk_indices))
 
+        KalmanBoxTracker.multi_update(
+            [self.trackers[t] for t in upd_trks], [d[:5] for d in upd_dets], [d[5] for d in upd_dets])
         for m in unmatched_trks:
             self.trackers[m].update(None, None)
 
@@ -7,6 +7,7 @@ import torchvision.transforms as transforms
 import cv2
 import sys
 import torchvision.transforms as T
+from torchvision.ops import roi_align
 from collections import OrderedDict, namedtuple
 import gdown
 from os.path import exists as file_exists
@@ -41,16 +42,8 @@ class ReIDDetectMultiBackend(nn.Module):
         self.fp16 &= self.pt or self.jit or self.engine  # FP16
 
         # Build transform functions
-        self.device = device
-        self.image_size=(256, 128)
-        self.pixel_mean=[0.485, 0.456, 0.406]
-        self.pixel_std=[0.229, 0.224, 0.225]
-        self.transforms = []
-        self.transforms += [T.Resize(self.image_size)]
-        self.transforms += [T.ToTensor()]
-        self.transforms += [T.Normalize(mean=self.pixel_mean, std=self.pixel_std)]
-        self.preprocess = T.Compose(self.transforms)
-        self.to_pil = T.ToPILImage()
+        device = self.device = torch.device(device)  # also given as a string, e.g. 'cpu'
+        self._build_transforms()
 
         model_name = get_model_name(w)
 
@@ -161,6 +154,21 @@ class ReIDDetectMultiBackend(nn.Module):
             exit()
         
         
+    def _build_transforms(self):
+        self.image_size=(256, 128)
+        self.pixel_mean=[0.485, 0.456, 0.406]
+        self.pixel_std=[0.229, 0.224, 0.225]
+        self.transforms = []
+        self.transforms += [T.Resize(self.image_size)]
+        self.transforms += [T.ToTensor()]
+        self.transforms += [T.Normalize(mean=self.pixel_mean, std=self.pixel_std)]
+        self.preprocess = T.Compose(self.transforms)
+        self.to_pil = T.ToPILImage()
+        # tensor path: (x / 255 - mean) / std folded into one scale and bias
+        std = torch.tensor(self.pixel_std).view(1, 3, 1, 1)
+        self.norm_scale = (1. / (255. * std)).to(self.device)
+        self.norm_bias = (-torch.tensor(self.pixel_mean).view(1, 3, 1, 1) / std).to(self.device)
+
     @staticmethod
     def model_type(p='path/to/model.pt'):
         # Return model type from model path, i.e. path='path/to/model.onnx' -> type=onnx
@@ -182,12 +190,38 @@ class ReIDDetectMultiBackend(nn.Module):
         images = images.to(self.device)
 
         return images
-    
-    
-    def forward(self, im_batch):
-        
+
+    def _preprocess_boxes(self, im, xyxys):
+        """
+        Crops of all boxes of one frame, without PIL, normalised by one addcmul.
+        On GPU the frame is uploaded once and every box is resampled to image_size by a single
+        roi_align. On CPU roi_align is slower than PIL, the crops are resized by cv2 instead and
+        uploaded as one batch.
+        im: HxWx3 uint8 frame, xyxys: Nx4 pixel boxes, the same region as im[y1:y2, x1:x2]
+        """
+        if self.device.type == 'cpu':
+            h, w = self.image_size
+            crops = np.stack([cv2.resize(im[y1:y2, x1:x2], (w, h), interpolation=cv2.INTER_LINEAR)
+                              for x1, y1, x2, y2 in np.asarray(xyxys, dtype=int)])
+            crops = torch.from_numpy(crops).permute(0, 3, 1, 2).float()
+        else:
+            frame = torch.from_numpy(np.ascontiguousarray(im)).to(self.device)
+            frame = frame.permute(2, 0, 1).unsqueeze(0).float()
+            boxes = torch.as_tensor(np.asarray(xyxys), dtype=torch.float32, device=self.device).view(-1, 4)
+            boxes = torch.cat([boxes.new_zeros((len(boxes), 1)), boxes], dim=1)  # all boxes from image 0
+            crops = roi_align(frame, boxes, output_size=self.image_size, spatial_scale=1., sampling_ratio=-1,
+                              aligned=True)
+        return torch.addcmul(self.norm_bias, crops, self.norm_scale)
+
+    def forward(self, im_batch, xyxys=None):
+        """
+        im_batch: list of HxWx3 crops, or the full frame when the boxes are given in xyxys
+        """
         # preprocess batch
-        im_batch = self._preprocess(im_batch)
+        if xyxys is not None:
+            im_batch = self._preprocess_boxes(im_batch, xyxys)
+        else:
+            im_batch = self._preprocess(im_batch)
 
         # batch to half
         if self.fp16 and im_batch.dtype != torch.float16:
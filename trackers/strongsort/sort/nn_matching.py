@@ -50,51 +50,13 @@ def _cosine_distance(a, b, data_is_normalized=False):
     return 1. - np.dot(a, b.T)
 
 
-def _nn_euclidean_distance(x, y):
-    """ Helper function for nearest neighbor distance metric (Euclidean).
-    Parameters
-    ----------
-    x : ndarray
-        A matrix of N row-vectors (sample points).
-    y : ndarray
-        A matrix of M row-vectors (query points).
-    Returns
-    -------
-    ndarray
-        A vector of length M that contains for each entry in `y` the
-        smallest Euclidean distance to a sample in `x`.
-    """
-    # x_ = torch.from_numpy(np.asarray(x) / np.linalg.norm(x, axis=1, keepdims=True))
-    # y_ = torch.from_numpy(np.asarray(y) / np.linalg.norm(y, axis=1, keepdims=True))
-    distances = distances = _pdist(x, y)
-    return np.maximum(0.0, torch.min(distances, axis=0)[0].numpy())
-
-
-def _nn_cosine_distance(x, y):
-    """ Helper function for nearest neighbor distance metric (cosine).
-    Parameters
-    ----------
-    x : ndarray
-        A matrix of N row-vectors (sample points).
-    y : ndarray
-        A matrix of M row-vectors (query points).
-    Returns
-    -------
-    ndarray
-        A vector of length M that contains for each entry in `y` the
-        smallest cosine distance to a sample in `x`.
-    """
-    x_ = torch.from_numpy(np.asarray(x))
-    y_ = torch.from_numpy(np.asarray(y))
-    distances = _cosine_distance(x_, y_)
-    distances = distances
-    return distances.min(axis=0)
-
-
 class NearestNeighborDistanceMetric(object):
     """
     A nearest neighbor distance metric that, for each target, returns
     the closest distance to any sample that has been observed so far.
+    The samples of all targets live in one preallocated gallery tensor, one
+    row per target and a ring of `budget` samples per row, so the cost matrix
+    of all targets is a single batched matmul and a masked min.
     Parameters
     ----------
     metric : str
@@ -105,24 +67,76 @@ class NearestNeighborDistanceMetric(object):
     budget : Optional[int]
         If not None, fix samples per class to at most this number. Removes
         the oldest samples when the budget is reached.
+    device : Optional[str | torch.device]
+        Device of the gallery.
     Attributes
     ----------
-    samples : Dict[int -> List[ndarray]]
-        A dictionary that maps from target identities to the list of samples
-        that have been observed so far.
+    samples : Dict[int -> ndarray]
+        A dictionary that maps from target identities to the samples that
+        have been observed so far (a copy of the gallery, in ring order).
     """
 
-    def __init__(self, metric, matching_threshold, budget=None):
-        if metric == "euclidean":
-            self._metric = _nn_euclidean_distance
-        elif metric == "cosine":
-            self._metric = _nn_cosine_distance
-        else:
+    def __init__(self, metric, matching_threshold, budget=None, device='cpu'):
+        if metric not in ("euclidean", "cosine"):
             raise ValueError(
                 "Invalid metric; must be either 'euclidean' or 'cosine'")
+        self.metric = metric
         self.matching_threshold = matching_threshold
         self.budget = budget
-        self.samples = {}
+        self.device = torch.device(device)
+
+        self._rows = {}  # target -> gallery row
+        self._free = []  # rows of targets that left
+        self._gallery = None  # (rows, samples, dim) float32, unit length for the cosine metric
+        self._valid = None  # (rows, samples) bool
+        self._count = np.zeros(0, dtype=np.int64)  # samples written per row, the ring position is count % samples
+
+    @property
+    def num_targets(self):
+        return len(self._rows)
+
+    @property
+    def nbytes(self):
+        """Allocated bytes of the gallery, spare rows included."""
+        if self._gallery is None:
+            return 0
+        return (self._gallery.element_size() * self._gallery.nelement() + self._valid.nelement() +
+                self._count.nbytes)
+
+    @property
+    def samples(self):
+        return {target: self._gallery[row][self._valid[row]].cpu().numpy() for target, row in self._rows.items()}
+
+    def _normalize(self, features):
+        features = np.asarray(features, dtype=np.float32)
+        if self.metric == "cosine":
+            features = features / np.linalg.norm(features, axis=1, keepdims=True)
+        return features
+
+    def _reserve(self, rows, samples, dim):
+        # grow the gallery by doubling, existing samples keep their place
+        if self._gallery is None:
+            self._gallery = torch.zeros((max(rows, 32), samples, dim), dtype=torch.float32, device=self.device)
+            self._valid = torch.zeros((max(rows, 32), samples), dtype=torch.bool, device=self.device)
+            self._count = np.zeros(max(rows, 32), dtype=np.int64)
+            return
+        n, s, _ = self._gallery.shape
+        if rows > n or samples > s:
+            n = max(rows, 2 * n) if rows > n else n
+            s = max(samples, 2 * s) if samples > s else s
+            gallery = torch.zeros((n, s, dim), dtype=torch.float32, device=self.device)
+            valid = torch.zeros((n, s), dtype=torch.bool, device=self.device)
+            gallery[:self._gallery.shape[0], :self._gallery.shape[1]] = self._gallery
+            valid[:self._valid.shape[0], :self._valid.shape[1]] = self._valid
+            self._gallery, self._valid = gallery, valid
+            self._count = np.concatenate([self._count, np.zeros(n - len(self._count), dtype=np.int64)])
+
+    def _row(self, target):
+        row = self._rows.get(target)
+        if row is None:
+            row = self._free.pop() if self._free else len(self._rows)
+            self._rows[target] = row
+        return row
 
     def partial_fit(self, features, targets, active_targets):
         """Update the distance metric with new data.
@@ -135,11 +149,37 @@ class NearestNeighborDistanceMetric(object):
         active_targets : List[int]
             A list of targets that are currently present in the scene.
         """
-        for feature, target in zip(features, targets):
-            self.samples.setdefault(target, []).append(feature)
-            if self.budget is not None:
-                self.samples[target] = self.samples[target][-self.budget:]
-        self.samples = {k: self.samples[k] for k in active_targets}
+        active_targets = set(active_targets)
+        for target in [t for t in self._rows if t not in active_targets]:
+            row = self._rows.pop(target)
+            self._valid[row] = False
+            self._count[row] = 0
+            self._free.append(row)
+
+        keep = np.array([t in active_targets for t in targets], dtype=bool)
+        if not keep.any():
+            return
+        features = self._normalize(np.asarray(features).reshape(len(targets), -1)[keep])
+        rows = np.array([self._row(t) for t in np.asarray(targets)[keep]], dtype=np.int64)
+
+        self._reserve(int(rows.max()) + 1, self.budget or 16, features.shape[1])
+        n = np.bincount(rows, minlength=len(self._count))
+        if self.budget is None:
+            self._reserve(len(self._count), int((self._count + n).max()), features.shape[1])
+        size = self._gallery.shape[1]
+
+        # rank of every feature among the new ones of its row, only the last `size` are written
+        order = np.argsort(rows, kind='stable')
+        rank = np.empty(len(rows), dtype=np.int64)
+        rank[order] = np.arange(len(rows)) - (np.cumsum(n) - n)[rows[order]]
+        keep = rank >= n[rows] - size
+        rows, rank, features = rows[keep], rank[keep], features[keep]
+        position = (self._count[rows] + rank) % size
+        rows_t = torch.from_numpy(rows).to(self.device)
+        position_t = torch.from_numpy(position).to(self.device)
+        self._gallery[rows_t, position_t] = torch.from_numpy(features).to(self.device)
+        self._valid[rows_t, position_t] = True
+        self._count += n
 
     def distance(self, features, targets):
         """Compute distance between features and targets.
@@ -156,7 +196,20 @@ class NearestNeighborDistanceMetric(object):
             element (i, j) contains the closest squared distance between
             `targets[i]` and `features[j]`.
         """
-        cost_matrix = np.zeros((len(targets), len(features)))
-        for i, target in enumerate(targets):
-            cost_matrix[i, :] = self._metric(self.samples[target], features)
-        return cost_matrix
\ No newline at end of file
+        if len(targets) == 0 or len(features) == 0:
+            return np.zeros((len(targets), len(features)))
+        rows = torch.as_tensor([self._rows[target] for target in targets], device=self.device)
+        y = torch.from_numpy(self._normalize(features)).to(self.device)
+        n, s, dim = self._gallery.shape
+        if 2 * len(rows) >= n:
+            # one matmul over the whole gallery, cheaper than gathering the rows of the targets first
+            dot = torch.matmul(self._gallery.view(n * s, dim), y.T).view(n, s, -1)[rows]
+        else:
+            dot = torch.matmul(self._gallery[rows], y.T)  # (targets, samples, features)
+        if self.metric == "cosine":
+            distances = 1. - dot
+        else:
+            distances = -2. * dot + self._gallery[rows].square().sum(2, keepdim=True) + y.square().sum(1)
+            distances = distances.clamp_(min=0.)
+        distances.masked_fill_(~self._valid[rows].unsqueeze(2), float('inf'))
+        return distances.min(1)[0].cpu().numpy().astype(np.float64)
@@ -61,9 +61,9 @@ class Track:
         Total number of frames since last measurement update.
     state : TrackState
         The current track state.
-    features : List[ndarray]
-        A cache of features. On each measurement update, the associated feature
-        vector is added to this list.
+    feature : Optional[ndarray]
+        Unit length exponential moving average of the detection features, updated
+        in place. The history of it is kept by the distance metric's gallery only.
 
     """
 
@@ -79,10 +79,9 @@ class Track:
         self.ema_alpha = ema_alpha
 
         self.state = TrackState.Tentative
-        self.features = []
+        self.feature = None
         if feature is not None:
-            feature /= np.linalg.norm(feature)
-            self.features.append(feature)
+            self.feature = feature / np.linalg.norm(feature)
 
         self.conf = conf
         self._n_init = n_init
@@ -124,7 +123,8 @@ class Track:
         return ret
 
 
-    def ECC(self, src, dst, warp_mode = cv2.MOTION_EUCLIDEAN, eps = 1e-5,
+    @staticmethod
+    def ECC(src, dst, warp_mode = cv2.MOTION_EUCLIDEAN, eps = 1e-5,
         max_iter = 100, scale = 0.1, align = False):
         """Compute the warp matrix from src to dst.
         Parameters
@@ -216,7 +216,8 @@ class Track:
             return warp_matrix, None
 
 
-    def get_matrix(self, matrix):
+    @staticmethod
+    def get_matrix(matrix):
         eye = np.eye(3)
         dist = np.linalg.norm(eye - matrix)
         if dist < 100:
@@ -224,21 +225,24 @@ class Track:
         else:
             return eye
 
-    def camera_update(self, previous_frame, next_frame):
-        warp_matrix, src_aligned = self.ECC(previous_frame, next_frame)
-        if warp_matrix is None and src_aligned is None:
+    @staticmethod
+    def multi_camera_update(tracks, warp_matrix):
+        """Warp the kf estimated boxes of all tracks with one camera motion
+        estimate (2x3 matrix from `ECC` or the BoT-SORT `GMC`).
+        """
+        if len(tracks) == 0:
             return
-        [a,b] = warp_matrix
-        warp_matrix=np.array([a,b,[0,0,1]])
-        warp_matrix = warp_matrix.tolist()
-        matrix = self.get_matrix(warp_matrix)
+        matrix = Track.get_matrix(np.vstack([warp_matrix, [0, 0, 1]]))
 
-        x1, y1, x2, y2 = self.to_tlbr()
-        x1_, y1_, _ = matrix @ np.array([x1, y1, 1]).T
-        x2_, y2_, _ = matrix @ np.array([x2, y2, 1]).T
-        w, h = x2_ - x1_, y2_ - y1_
-        cx, cy = x1_ + w / 2, y1_ + h / 2
-        self.mean[:4] = [cx, cy, w / h, h]
+        xyah = np.array([t.mean[:4] for t in tracks])
+        wh = np.stack([xyah[:, 2] * xyah[:, 3], xyah[:, 3]], axis=1)
+        p1 = (xyah[:, :2] - wh / 2) @ matrix[:2, :2].T + matrix[:2, 2]
+        p2 = (xyah[:, :2] + wh / 2) @ matrix[:2, :2].T + matrix[:2, 2]
+        wh = p2 - p1
+        c = p1 + wh / 2
+        xyah = np.stack([c[:, 0], c[:, 1], wh[:, 0] / wh[:, 1], wh[:, 1]], axis=1)
+        for t, box in zip(tracks, xyah):
+            t.mean[:4] = box
 
 
     def increment_age(self):
@@ -267,23 +271,26 @@ class Track:
         y_c = int((tlbr[1] + tlbr[3]) / 2)
         self.q.append(('predupdate', (x_c, y_c)))
 
-    def update(self, detection, class_id, conf):
+    def update(self, detection, class_id, conf, update_kalman=True):
         """Perform Kalman filter measurement update step and update the feature
         cache.
         Parameters
         ----------
         detection : Detection
             The associated detection.
+        update_kalman : bool
+            False when the Kalman step was already done by `KalmanFilter.multi_update`.
         """
         self.conf = conf
         self.class_id = class_id.int()
-        self.mean, self.covariance = self.kf.update(self.mean, self.covariance, detection.to_xyah(), detection.confidence)
+        if update_kalman:
+            self.mean, self.covariance = self.kf.update(self.mean, self.covariance, detection.to_xyah(), detection.confidence)
 
         feature = detection.feature / np.linalg.norm(detection.feature)
 
-        smooth_feat = self.ema_alpha * self.features[-1] + (1 - self.ema_alpha) * feature
-        smooth_feat /= np.linalg.norm(smooth_feat)
-        self.features = [smooth_feat]
+        self.feature *= self.ema_alpha
+        self.feature += (1 - self.ema_alpha) * feature
+        self.feature /= np.linalg.norm(self.feature)
 
         self.hits += 1
         self.time_since_update = 0
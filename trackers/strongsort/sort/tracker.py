@@ -21,6 +21,10 @@ class Tracker:
         Number of consecutive detections before the track is confirmed. The
         track state is set to `Deleted` if a miss occurs within the first
         `n_init` frames.
+    cmc_method : str
+        Camera motion compensation. 'ecc' runs the track ECC, any other value
+        ('sparseOptFlow', 'orb', 'sift', 'none') goes through the BoT-SORT GMC.
+        Either way the warp is estimated once per frame.
     Attributes
     ----------
     metric : nn_matching.NearestNeighborDistanceMetric
@@ -36,7 +40,7 @@ class Tracker:
     """
     GATING_THRESHOLD = np.sqrt(kalman_filter.chi2inv95[4])
 
-    def __init__(self, metric, max_iou_dist=0.9, max_age=30, max_unmatched_preds=7, n_init=3, _lambda=0, ema_alpha=0.9, mc_lambda=0.995):
+    def __init__(self, metric, max_iou_dist=0.9, max_age=30, max_unmatched_preds=7, n_init=3, _lambda=0, ema_alpha=0.9, mc_lambda=0.995, cmc_method='ecc'):
         self.metric = metric
         self.max_iou_dist = max_iou_dist
         self.max_age = max_age
@@ -50,6 +54,11 @@ class Tracker:
         self.tracks = []
         self._next_id = 1
 
+        self.gmc = None
+        if cmc_method != 'ecc':
+            from trackers.botsort.gmc import GMC
+            self.gmc = GMC(method=cmc_method, verbose=[None, False])
+
     def predict(self):
         """Propagate track state distributions one time step forward.
 
@@ -64,8 +73,16 @@ class Tracker:
             track.mark_missed()
 
     def camera_update(self, previous_img, current_img):
-        for track in self.tracks:
-            track.camera_update(previous_img, current_img)
+        """Estimate the camera motion between both frames once and apply it to
+        all tracks.
+        """
+        if self.gmc is not None:
+            warp_matrix = self.gmc.apply(current_img)
+        else:
+            warp_matrix, _ = Track.ECC(previous_img, current_img)
+            if warp_matrix is None:
+                return
+        Track.multi_camera_update(self.tracks, warp_matrix)
             
     def pred_n_update_all_tracks(self):
         """Perform predictions and updates for all tracks by its own predicted state.
@@ -90,10 +107,20 @@ class Tracker:
         matches, unmatched_tracks, unmatched_detections = \
             self._match(detections)
 
-        # Update track set.
+        # Update track set, the Kalman correction of all matched tracks is done in one batch.
+        if len(matches) > 0:
+            matched = [self.tracks[track_idx] for track_idx, _ in matches]
+            means, covariances = self.kf.multi_update(
+                np.asarray([t.mean for t in matched]),
+                np.asarray([t.covariance for t in matched]),
+                np.asarray([detections[detection_idx].to_xyah() for _, detection_idx in matches]),
+                np.asarray([detections[detection_idx].confidence for _, detection_idx in matches]))
+            for track, mean, covariance in zip(matched, means, covariances):
+                track.mean, track.covariance = mean, covariance
         for track_idx, detection_idx in matches:
             self.tracks[track_idx].update(
-                detections[detection_idx], classes[detection_idx], confidences[detection_idx])
+                detections[detection_idx], classes[detection_idx], confidences[detection_idx],
+                update_kalman=False)
         for track_idx in unmatched_tracks:
             self.tracks[track_idx].mark_missed()
             if self.max_unmatched_preds != 0 and self.tracks[track_idx].updates_wo_assignment < self.tracks[track_idx].max_num_updates_wo_assignment:
@@ -103,15 +130,21 @@ class Tracker:
             self._initiate_track(detections[detection_idx], classes[detection_idx].item(), confidences[detection_idx].item())
         self.tracks = [t for t in self.tracks if not t.is_deleted()]
 
-        # Update distance metric.
-        active_targets = [t.track_id for t in self.tracks if t.is_confirmed()]
-        features, targets = [], []
-        for track in self.tracks:
-            if not track.is_confirmed():
-                continue
-            features += track.features
-            targets += [track.track_id for _ in track.features]
-        self.metric.partial_fit(np.asarray(features), np.asarray(targets), active_targets)
+        # Update distance metric, the smoothed feature of every confirmed track goes into its gallery ring.
+        confirmed = [t for t in self.tracks if t.is_confirmed() and t.feature is not None]
+        features = np.stack([t.feature for t in confirmed]) if confirmed else np.zeros((0, 0), dtype=np.float32)
+        targets = [t.track_id for t in confirmed]
+        self.metric.partial_fit(features, targets, targets)
+
+    def memory(self):
+        """Bytes held for appearance features, the metric gallery and the feature of every track."""
+        total = self.metric.nbytes + sum(t.feature.nbytes for t in self.tracks if t.feature is not None)
+        return {
+            'tracks': len(self.tracks),
+            'gallery_targets': self.metric.num_targets,
+            'bytes': total,
+            'bytes_per_track': total / max(len(self.tracks), 1),
+        }
 
     def _full_cost_metric(self, tracks, dets, track_indices, detection_indices):
         """
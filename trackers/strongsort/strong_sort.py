@@ -27,16 +27,18 @@ class StrongSORT(object):
                  n_init=3,
                  nn_budget=100,
                  mc_lambda=0.995,
-                 ema_alpha=0.9
+                 ema_alpha=0.9,
+                 cmc_method='ecc'
                 ):
 
         self.model = ReIDDetectMultiBackend(weights=model_weights, device=device, fp16=fp16)
         
         self.max_dist = max_dist
         metric = NearestNeighborDistanceMetric(
-            "cosine", self.max_dist, nn_budget)
+            "cosine", self.max_dist, nn_budget, device=device)
         self.tracker = Tracker(
-            metric, max_iou_dist=max_iou_dist, max_age=max_age, n_init=n_init, max_unmatched_preds=max_unmatched_preds, mc_lambda=mc_lambda, ema_alpha=ema_alpha)
+            metric, max_iou_dist=max_iou_dist, max_age=max_age, n_init=n_init, max_unmatched_preds=max_unmatched_preds, mc_lambda=mc_lambda, ema_alpha=ema_alpha,
+            cmc_method=cmc_method)
 
     def update(self, dets,  ori_img):
         
@@ -130,13 +132,10 @@ class StrongSORT(object):
         return t, l, w, h
 
     def _get_features(self, bbox_xywh, ori_img):
-        im_crops = []
-        for box in bbox_xywh:
-            x1, y1, x2, y2 = self._xywh_to_xyxy(box)
-            im = ori_img[y1:y2, x1:x2]
-            im_crops.append(im)
-        if im_crops:
-            features = self.model(im_crops)
+        # all crops are cut and resized on device from the one uploaded frame
+        xyxys = [self._xywh_to_xyxy(box) for box in bbox_xywh]
+        if xyxys:
+            features = self.model(ori_img, xyxys=np.array(xyxys))
         else:
             features = np.array([])
         return features
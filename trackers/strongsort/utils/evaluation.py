@@ -3,7 +3,126 @@ import numpy as np
 import copy
 import motmetrics as mm
 mm.lap.default_solver = 'lap'
-from utils.io import read_results, unzip_objs
+from scipy.optimize import linear_sum_assignment
+from utils.io import read_results, unzip_objs, read_mot_table, load_mot_results
+
+# metrics the batched evaluator computes, the others need the motmetrics event log
+COUNT_METRICS = ('num_frames', 'num_objects', 'num_predictions', 'num_matches', 'num_switches',
+                 'num_false_positives', 'num_misses', 'num_detections', 'num_unique_objects', 'idfp', 'idfn', 'idtp')
+RATIO_METRICS = ('mota', 'motp', 'precision', 'recall', 'idp', 'idr', 'idf1')
+
+
+def iou_distance(a, b):
+    """1 - IoU of paired tlwh rows of a and b, the same arithmetic as mm.distances.iou_matrix."""
+    a_min, b_min = a[:, :2], b[:, :2]
+    a_max, b_max = a_min + a[:, 2:], b_min + b[:, 2:]
+    i_size = np.maximum(np.minimum(a_max, b_max) - np.maximum(a_min, b_min), 0)
+    a_size, b_size = np.maximum(a_max - a_min, 0), np.maximum(b_max - b_min, 0)
+    i_vol = i_size[:, 0] * i_size[:, 1]
+    a_vol = a_size[:, 0] * a_size[:, 1]
+    b_vol = b_size[:, 0] * b_size[:, 1]
+    iou = np.where(i_vol == 0, 0., mm.math_util.quiet_divide(i_vol, a_vol + b_vol - i_vol))
+    return 1 - iou
+
+
+def frame_overlaps(frames, a_frames, a_tlwhs, b_frames, b_tlwhs, max_iou=0.5, block=1 << 22):
+    """
+    All pairs of a and b rows in the same frame with an IoU distance <= max_iou, for frame-sorted arrays.
+    Returns the [start, stop) rows of every frame in a and b, and the pairs (i, j, distance) in frame,
+    then row-major order. IoUs are computed for at most `block` pairs at a time.
+    """
+    a0, a1 = np.searchsorted(a_frames, frames, 'left'), np.searchsorted(a_frames, frames, 'right')
+    b0, b1 = np.searchsorted(b_frames, frames, 'left'), np.searchsorted(b_frames, frames, 'right')
+    nb = b1 - b0
+    counts = (a1 - a0) * nb
+    ends = np.cumsum(counts)
+    starts = ends - counts
+    pairs = []
+    start = 0
+    while start < len(frames):
+        stop = max(int(np.searchsorted(ends, starts[start] + block, 'right')), start + 1)
+        c = counts[start:stop]
+        f = np.repeat(np.arange(start, stop), c)
+        r = np.arange(ends[stop - 1] - starts[start]) + starts[start] - starts[f]  # pair index within its frame
+        i = a0[f] + r // nb[f]
+        j = b0[f] + r % nb[f]
+        d = iou_distance(a_tlwhs[i], b_tlwhs[j])
+        keep = ~(d > max_iou)
+        pairs.append((i[keep], j[keep], d[keep]))
+        start = stop
+    i, j, d = (np.concatenate(x) for x in zip(*pairs)) if pairs else (np.zeros(0, int),) * 2 + (np.zeros(0),)
+    return (a0, a1), (b0, b1), (i, j, d)
+
+
+def assign(rows, cols, dists, n_rows, n_cols):
+    """
+    mm.lap.linear_sum_assignment on the n_rows x n_cols matrix holding dists at (rows, cols), nan elsewhere.
+    Pairs that share no row or column are the assignment already, the solver only runs on conflicts.
+    """
+    if len(set(rows.tolist())) == len(rows) and len(set(cols.tolist())) == len(cols):
+        return rows, cols, dists
+    costs = np.full((n_rows, n_cols), np.nan)
+    costs[rows, cols] = dists
+    rids, cids = mm.lap.linear_sum_assignment(costs)
+    rids, cids = np.asarray(rids, dtype=int), np.asarray(cids, dtype=int)
+    d = costs[rids, cids]
+    keep = np.isfinite(d)
+    return rids[keep], cids[keep], d[keep]
+
+
+def _count_unique(ids, frame_ids):
+    # number of distinct (id, frame) pairs
+    if not len(ids):
+        return 0
+    ids = ids.astype(np.int64) - ids.min()
+    return len(np.unique(ids * (int(frame_ids.max()) + 1) + frame_ids))
+
+
+class MOTCounts(object):
+    """
+    CLEAR MOT and identity counts of one sequence, as the batched Evaluator.eval_arrays computes them.
+    get_summary takes them in place of motmetrics accumulators.
+    """
+
+    def __init__(self):
+        self.num_frames = 0
+        self.num_objects = 0
+        self.num_predictions = 0
+        self.num_matches = 0
+        self.num_switches = 0
+        self.num_false_positives = 0
+        self.num_misses = 0
+        self.num_unique_objects = 0
+        self.distance = 0.  # sum of the IoU distances of matches and switches
+        self.idfp = 0
+        self.idfn = 0
+
+    @property
+    def num_detections(self):
+        return self.num_matches + self.num_switches
+
+    @property
+    def idtp(self):
+        return self.num_objects - self.idfn
+
+    def __add__(self, other):
+        total = MOTCounts()
+        for k in vars(total):
+            setattr(total, k, getattr(self, k) + getattr(other, k))
+        return total
+
+    def metrics(self, names):
+        divide = mm.math_util.quiet_divide
+        values = {
+            'mota': 1. - divide(self.num_misses + self.num_switches + self.num_false_positives, self.num_objects),
+            'motp': divide(self.distance, self.num_detections),
+            'precision': divide(self.num_detections, self.num_false_positives + self.num_detections),
+            'recall': divide(self.num_detections, self.num_objects),
+            'idp': divide(self.idtp, self.idtp + self.idfp),
+            'idr': divide(self.idtp, self.idtp + self.idfn),
+            'idf1': divide(2 * self.idtp, self.num_objects + self.num_predictions),
+        }
+        return [values[k] if k in values else getattr(self, k) for k in names]
 
 
 class Evaluator(object):
@@ -23,6 +142,12 @@ class Evaluator(object):
         self.gt_frame_dict = read_results(gt_filename, self.data_type, is_gt=True)
         self.gt_ignore_frame_dict = read_results(gt_filename, self.data_type, is_ignore=True)
 
+        # frame-sorted arrays for eval_arrays
+        table = read_mot_table(gt_filename)
+        self.gt_frames = np.unique(table[:, 0]).astype(np.int64)
+        self.gt_arrays = load_mot_results(gt_filename, is_gt=True, table=table)[:3]
+        self.gt_ignore_arrays = load_mot_results(gt_filename, is_ignore=True, table=table)[:3]
+
     def reset_accumulator(self):
         self.acc = mm.MOTAccumulator(auto_id=True)
 
@@ -66,18 +191,135 @@ class Evaluator(object):
             events = None
         return events
 
-    def eval_file(self, filename):
+    def eval_file(self, filename, batch=False):
+        """
+        Evaluate a MOT result file into the motmetrics accumulator. With `batch` it goes through
+        eval_arrays and returns MOTCounts instead, which get_summary only takes for the metrics
+        MOTCounts.metrics() computes.
+        """
+        if batch:
+            frame_ids, tlwhs, ids = load_mot_results(filename)[:3]
+            return self.eval_arrays(frame_ids, tlwhs, ids, frames=np.union1d(self.gt_frames, frame_ids))
+        result_frame_dict = read_results(filename, self.data_type, is_gt=False)
+        return self.eval_results(result_frame_dict)
+
+    def eval_results(self, result_frame_dict, frames=None):
+        """
+        Evaluate results held in memory, {frame_id: [(tlwh, id, score), ...]} as read_results returns
+        them. `frames` restricts the evaluation to these frame ids, all frames by default.
+        """
         self.reset_accumulator()
 
-        result_frame_dict = read_results(filename, self.data_type, is_gt=False)
-        frames = sorted(list(set(self.gt_frame_dict.keys()) | set(result_frame_dict.keys())))
-        for frame_id in frames:
+        if frames is None:
+            frames = set(self.gt_frame_dict.keys()) | set(result_frame_dict.keys())
+        for frame_id in sorted(frames):
             trk_objs = result_frame_dict.get(frame_id, [])
             trk_tlwhs, trk_ids = unzip_objs(trk_objs)[:2]
             self.eval_frame(frame_id, trk_tlwhs, trk_ids, rtn_events=False)
 
         return self.acc
 
+    def eval_arrays(self, frame_ids, tlwhs, ids, frames=None):
+        """
+        Batched eval_results on frame-sorted arrays (as load_mot_results returns them), returns MOTCounts.
+        The IoUs of all frames are computed at once, the frame loop left only carries the track
+        correspondences, with the same matching rules as mm.MOTAccumulator.update, so the counts are
+        the ones motmetrics gives for the same inputs.
+        """
+        frame_ids, tlwhs, ids = np.asarray(frame_ids, dtype=np.int64), np.asarray(tlwhs, dtype=float), np.asarray(ids)
+        if frames is None:
+            frames = np.union1d(self.gt_frames, frame_ids)
+        frames = np.unique(np.asarray(frames, dtype=np.int64))
+        keep = np.isin(frame_ids, frames)
+        order = np.argsort(frame_ids[keep], kind='stable')
+        frame_ids, tlwhs, ids = frame_ids[keep][order], tlwhs[keep][order], ids[keep][order]
+        gt_frame_ids, gt_tlwhs, gt_ids = self.gt_arrays
+
+        # drop results matched to ignore boxes
+        ign_frame_ids, ign_tlwhs = self.gt_ignore_arrays[:2]
+        if len(ign_frame_ids) and len(frame_ids):
+            (g0, g1), (t0, t1), (pi, pj, pd) = frame_overlaps(frames, ign_frame_ids, ign_tlwhs, frame_ids, tlwhs)
+            keep = np.ones(len(frame_ids), dtype=bool)
+            bounds = np.searchsorted(pi, np.stack([g0, g1]), 'left')  # pairs are sorted by frame, so by i
+            for f in np.flatnonzero(bounds[1] > bounds[0]):
+                s = slice(bounds[0, f], bounds[1, f])
+                rids, cids, _ = assign(pi[s] - g0[f], pj[s] - t0[f], pd[s], g1[f] - g0[f], t1[f] - t0[f])
+                keep[cids + t0[f]] = False
+            frame_ids, tlwhs, ids = frame_ids[keep], tlwhs[keep], ids[keep]
+
+        (g0, g1), (t0, t1), (pi, pj, pd) = frame_overlaps(frames, gt_frame_ids, gt_tlwhs, frame_ids, tlwhs)
+        bounds = np.searchsorted(pi, np.stack([g0, g1]), 'left').T.tolist()
+        oids, hids = gt_ids.tolist(), ids.tolist()
+        g0, g1, t0, t1 = g0.tolist(), g1.tolist(), t0.tolist(), t1.tolist()
+
+        counts = MOTCounts()
+        counts.num_frames = len(frames)
+        m = {}  # object id -> hypothesis id of the last match
+        for f, (p0, p1) in enumerate(bounds):
+            no, nh = g1[f] - g0[f], t1[f] - t0[f]
+            if not no * nh:
+                counts.num_misses += no
+                counts.num_false_positives += nh
+                continue
+            frame_oids, frame_hids = oids[g0[f]:g1[f]], hids[t0[f]:t1[f]]
+            rows, cols, dists = pi[p0:p1] - g0[f], pj[p0:p1] - t0[f], pd[p0:p1]
+            pairs = dict(zip(zip(rows.tolist(), cols.tolist()), dists.tolist()))
+            o_used, h_used = [False] * no, [False] * nh
+            matched = 0
+
+            # 1. keep the previous correspondences that still overlap
+            columns = {}
+            for j, h in enumerate(frame_hids):
+                columns.setdefault(h, []).append(j)
+            for i, o in enumerate(frame_oids):
+                if o not in m:
+                    continue
+                j = next((j for j in columns.get(m[o], ()) if not h_used[j]), None)
+                if j is not None and (i, j) in pairs:
+                    o_used[i] = h_used[j] = True
+                    counts.num_matches += 1
+                    counts.distance += pairs[i, j]
+                    matched += 1
+
+            # 2. assign the rest
+            if matched:
+                free = np.array([not o_used[i] and not h_used[j] for i, j in pairs], dtype=bool)
+                rows, cols, dists = rows[free], cols[free], dists[free]
+            if len(rows):
+                for i, j, d in zip(*(x.tolist() for x in assign(rows, cols, dists, no, nh))):
+                    o, h = frame_oids[i], frame_hids[j]
+                    if o in m and m[o] != h:
+                        counts.num_switches += 1
+                    else:
+                        counts.num_matches += 1
+                    counts.distance += d
+                    m[o] = h
+                    matched += 1
+            counts.num_misses += no - matched
+            counts.num_false_positives += nh - matched
+
+        # identity measures: the min-cost assignment motmetrics solves on (no + nh)^2 fp/fn costs is the
+        # id matching with the most overlapping frames (idtp), solved here on the ids that overlap at all
+        in_frames = np.isin(gt_frame_ids, frames)
+        # frames each id is present in, an id listed twice in a frame counts once
+        oc = _count_unique(gt_ids[in_frames], gt_frame_ids[in_frames])
+        hc = _count_unique(ids, frame_ids)
+        counts.num_objects = int(in_frames.sum())
+        counts.num_predictions = len(ids)
+        counts.num_unique_objects = len(np.unique(gt_ids[in_frames]))
+        if len(pi):
+            o_idx, o_inv = np.unique(gt_ids[pi], return_inverse=True)
+            h_idx, h_inv = np.unique(ids[pj], return_inverse=True)
+            tps = np.zeros((len(o_idx), len(h_idx)))
+            np.add.at(tps, (o_inv, h_inv), 1)
+            rids, cids = linear_sum_assignment(tps, maximize=True)
+            idtp = int(tps[rids, cids].sum())
+        else:
+            idtp = 0
+        counts.idfn = oc - idtp
+        counts.idfp = hc - idtp
+        return counts
+
     @staticmethod
     def get_summary(accs, names, metrics=('mota', 'num_switches', 'idp', 'idr', 'idf1', 'precision', 'recall')):
         names = copy.deepcopy(names)
@@ -85,6 +327,15 @@ class Evaluator(object):
             metrics = mm.metrics.motchallenge_metrics
         metrics = copy.deepcopy(metrics)
 
+        if accs and all(isinstance(acc, MOTCounts) for acc in accs):
+            unknown = set(metrics) - set(COUNT_METRICS + RATIO_METRICS)
+            if unknown:
+                raise ValueError(f'{sorted(unknown)} need motmetrics accumulators, use eval_file(batch=False)')
+            import pandas as pd
+            rows = [acc.metrics(metrics) for acc in accs]
+            rows.append(sum(accs[1:], accs[0]).metrics(metrics))
+            return pd.DataFrame(rows, index=list(names) + ['OVERALL'], columns=list(metrics))
+
         mh = mm.metrics.create()
         summary = mh.compute_many(
             accs,
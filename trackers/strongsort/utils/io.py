@@ -1,6 +1,7 @@
 import os
 from typing import Dict
 import numpy as np
+import pandas as pd
 
 # from utils.log import get_logger
 
@@ -81,44 +82,53 @@ labels={'ped', ...			% 1
 """
 
 
+def read_mot_table(filename):
+    """
+    All rows of a MOT text file with at least 7 fields and a frame id >= 1, as a float64 (N, 10) array
+    sorted by frame (file order within a frame), missing fields are nan. Fields are separated by
+    commas or, as track.py --save-txt writes them, by whitespace.
+    """
+    if not os.path.isfile(filename):
+        return np.zeros((0, 10))
+    with open(filename, 'r') as f:
+        first = f.readline()
+    if not first.strip():
+        return np.zeros((0, 10))
+    table = pd.read_csv(filename, header=None, names=range(10), sep=',' if ',' in first else r'\s+',
+                        skip_blank_lines=True, dtype=np.float64).to_numpy()
+    table = table[~np.isnan(table[:, 6]) & (table[:, 0] >= 1)]
+    return table[np.argsort(table[:, 0], kind='stable')]
+
+
+def load_mot_results(filename, is_gt=False, is_ignore=False, table=None):
+    """
+    Frame-sorted arrays (frame_ids, tlwhs, ids, scores) of a MOT file, filtered as read_mot_results does.
+    """
+    if table is None:
+        table = read_mot_table(filename)
+    mot1x = 'MOT16-' in filename or 'MOT17-' in filename
+    if is_gt:
+        if mot1x:
+            table = table[(table[:, 6].astype(int) != 0) & (table[:, 7].astype(int) == 1)]
+        scores = np.ones(len(table))
+    elif is_ignore:
+        if mot1x:
+            table = table[np.isin(table[:, 7].astype(int), (2, 7, 8, 12)) | (table[:, 8] < 0)]
+        else:
+            table = table[:0]
+        scores = np.ones(len(table))
+    else:
+        scores = table[:, 6]
+    return table[:, 0].astype(np.int64), table[:, 2:6].copy(), table[:, 1].astype(np.int64), scores
+
+
 def read_mot_results(filename, is_gt, is_ignore):
-    valid_labels = {1}
-    ignore_labels = {2, 7, 8, 12}
-    results_dict = dict()
-    if os.path.isfile(filename):
-        with open(filename, 'r') as f:
-            for line in f.readlines():
-                linelist = line.split(',')
-                if len(linelist) < 7:
-                    continue
-                fid = int(linelist[0])
-                if fid < 1:
-                    continue
-                results_dict.setdefault(fid, list())
-
-                if is_gt:
-                    if 'MOT16-' in filename or 'MOT17-' in filename:
-                        label = int(float(linelist[7]))
-                        mark = int(float(linelist[6]))
-                        if mark == 0 or label not in valid_labels:
-                            continue
-                    score = 1
-                elif is_ignore:
-                    if 'MOT16-' in filename or 'MOT17-' in filename:
-                        label = int(float(linelist[7]))
-                        vis_ratio = float(linelist[8])
-                        if label not in ignore_labels and vis_ratio >= 0:
-                            continue
-                    else:
-                        continue
-                    score = 1
-                else:
-                    score = float(linelist[6])
-
-                tlwh = tuple(map(float, linelist[2:6]))
-                target_id = int(linelist[1])
-
-                results_dict[fid].append((tlwh, target_id, score))
+    table = read_mot_table(filename)
+    # a frame is listed even if all of its rows are filtered out
+    results_dict = {fid: [] for fid in np.unique(table[:, 0]).astype(int).tolist()}
+    frame_ids, tlwhs, ids, scores = load_mot_results(filename, is_gt, is_ignore, table=table)
+    for fid, tlwh, target_id, score in zip(frame_ids.tolist(), tlwhs.tolist(), ids.tolist(), scores.tolist()):
+        results_dict[fid].append((tuple(tlwh), target_id, score))
 
     return results_dict
 
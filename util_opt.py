@@ -60,6 +60,7 @@ def parse_opt():
     parser.add_argument('--max-det', type=int, default=1000, help='maximum detections per image')
     parser.add_argument('--device', default='', help='cuda device, i.e. 0 or 0,1,2,3 or cpu')
     parser.add_argument('--show-vid', action='store_true', help='display tracking video results')
+    parser.add_argument('--headless', action='store_true', help='no window and no overlay drawing')
     parser.add_argument('--save-txt', action='store_true', help='save results to *.txt')
     parser.add_argument('--save-conf', action='store_true', help='save confidences in --save-txt labels')
     parser.add_argument('--save-crop', action='store_true', help='save cropped prediction boxes')
@@ -84,6 +85,18 @@ def parse_opt():
     parser.add_argument('--vid-stride', type=int, default=1, help='video frame-rate stride')
     parser.add_argument('--retina-masks', action='store_true', help='whether to plot masks in native resolution')
     parser.add_argument('--out-dir', type=str, default='runs/output.avi')
+    parser.add_argument('--vid-fourcc', type=str, default='XVID', help='codec of the saved video')
+    parser.add_argument('--vid-queue', type=int, default=32, help='frames queued for the video writer')
+    parser.add_argument('--vid-nodrop', action='store_true', help='wait for the video writer instead of dropping frames')
+    parser.add_argument('--vid-segment', type=float, default=3600, help='start a new video file every N secs, 0: one file')
+    parser.add_argument('--buffer-size', type=int, default=3, help='number of frame slots between camera and detection')
+    parser.add_argument('--sources', nargs='+', default=[0], help='cameras for the multi camera pipeline')
+    parser.add_argument('--batch-deadline', type=float, default=20.,
+                        help='max time (ms) to wait for the cameras when collecting a batch')
+    parser.add_argument('--buffer-mode', type=str, default='latest', help='latest: drop stale frames, nodrop: keep all')
+    parser.add_argument('--metrics-port', type=int, default=0, help='serve stage latencies on 127.0.0.1:PORT/metrics, 0: off')
+    parser.add_argument('--metrics-json', type=str, default='', help='dump stage latencies to this JSON file')
+    parser.add_argument('--metrics-interval', type=float, default=60., help='secs between JSON dumps')
 
     # entrance count
     parser.add_argument(
@@ -0,0 +1,152 @@
+"""
+Video writer running on its own thread, so encoding does not stall the detection loop.
+
+write() only puts the frame into a bounded queue. When the encoder falls behind and the queue is
+full, the frame is dropped (drop=True, live cameras) or write() waits for a free slot
+(drop=False, every frame of a video file is kept). Frames are resized only if they do not
+already have the output size. With `render` the overlay is drawn on the writer thread too, so
+dropped frames are never drawn. With segment_secs the output is split into files starting on
+multiples of that period (hourly by default), named <stem>_<YYYYmmdd-HHMMSS><suffix>.
+
+If encoding or rendering raises, the writer thread stops and the error is raised again from
+the next write() and from release().
+
+cv2.VideoWriter releases the GIL while encoding. Hardware encoders are reached through the
+fourcc, or a GStreamer pipeline as `path` with api=cv2.CAP_GSTREAMER (no segments then).
+
+    out = AsyncVideoWriter('runs/output.avi', 'XVID', 30., (1920, 1080))
+    out.write(frame)  # frame must not be modified afterwards
+    out.release()
+"""
+import queue
+import threading
+import time
+from pathlib import Path
+
+import cv2
+
+from metrics import METRICS
+
+
+class AsyncVideoWriter(object):
+
+    def __init__(self, path, fourcc='XVID', fps=30., size=None, queue_size=32, drop=True, segment_secs=None,
+                 api=None, render=None):
+        self.path = str(path)
+        self.fourcc = cv2.VideoWriter_fourcc(*fourcc)
+        self.fps = fps
+        self.size = tuple(size) if size is not None else None  # (w, h), taken from the first frame if None
+        self.drop = drop
+        self.segment_secs = segment_secs
+        self.api = api
+        self.render = render  # render(frame, *args) on the writer thread, only for frames that are kept
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._writer = None
+        self._segment_end = None
+        self.segments = []  # files written so far
+        self.error = None  # exception that stopped the writer thread
+
+        # write-latency accounting, from write() to the frame being encoded
+        self.written = 0
+        self.dropped = 0
+        self.latency_total = 0.
+        self.latency_max = 0.
+        self.encode_total = 0.
+
+        self._thread = threading.Thread(target=self._run, name='video-writer', daemon=True)
+        self._thread.start()
+
+    def write(self, frame, *args, timestamp=None):
+        """Queue one BGR frame (and the render() arguments), returns False if it was dropped."""
+        if self.error is not None:
+            raise self.error
+        item = (frame, args, time.time() if timestamp is None else timestamp)
+        if not self.drop:
+            self._queue.put(item)
+            return True
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+            return False
+        return True
+
+    def _segment_path(self, now):
+        if not self.segment_secs:
+            return self.path
+        p = Path(self.path)
+        return str(p.with_name(f"{p.stem}_{time.strftime('%Y%m%d-%H%M%S', time.localtime(now))}{p.suffix}"))
+
+    def _open(self, now):
+        if self._writer is not None:
+            self._writer.release()
+        path = self._segment_path(now)
+        if self.api is None:
+            self._writer = cv2.VideoWriter(path, self.fourcc, self.fps, self.size)
+        else:
+            self._writer = cv2.VideoWriter(path, self.api, self.fourcc, self.fps, self.size)
+        self.segments.append(path)
+        if self.segment_secs:
+            # next multiple of the period, e.g. the next full hour
+            self._segment_end = (now // self.segment_secs + 1) * self.segment_secs
+
+    def _run(self):
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    break
+                self._encode(*item)
+        except Exception as e:
+            self.error = e
+            # empty the queue, a write() blocked on it (drop=False) wakes up and the next one raises
+            while True:
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    break
+        finally:
+            if self._writer is not None:
+                self._writer.release()
+                self._writer = None
+
+    def _encode(self, frame, args, timestamp):
+        if self.render is not None:
+            frame = self.render(frame, *args)
+        t = time.time()
+        if self.size is None:
+            self.size = (frame.shape[1], frame.shape[0])
+        if self._writer is None or (self._segment_end is not None and t >= self._segment_end):
+            self._open(t)
+        if (frame.shape[1], frame.shape[0]) != self.size:
+            frame = cv2.resize(frame, self.size)
+        self._writer.write(frame)
+
+        done = time.time()
+        self.encode_total += done - t
+        METRICS.observe('encode', done - t)
+        latency = done - timestamp
+        self.latency_total += latency
+        self.latency_max = max(self.latency_max, latency)
+        self.written += 1
+
+    def release(self):
+        # encode what is still queued, then close the file
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def stats(self):
+        n = max(self.written, 1)
+        return {
+            'written': self.written,
+            'dropped': self.dropped,
+            'queued': self._queue.qsize(),
+            'latency_ms': self.latency_total / n * 1E3,
+            'latency_max_ms': self.latency_max * 1E3,
+            'encode_ms': self.encode_total / n * 1E3,
+            'segments': len(self.segments),
+        }